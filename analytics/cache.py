@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from flask import current_app, g
+from extensions import db
+from metrics import register_metrics
+from expenses.rollups import data_version
+
+
+class AnalyticsCache:
+    """In-process LRU of analytics payloads, tagged with a data version.
+
+    An entry only counts as a hit while the user's data version is unchanged
+    and it is younger than ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries=2048, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+analytics_cache = AnalyticsCache()
+
+
+def cached_columns(name, builder, user_id, *args):
+    """``builder(user_id, *args)``, served from the cache when still current.
+
+    ``user_id`` may be a tuple of household members' ids; the entry is then
+    current while none of their data has changed.
+    """
+    version = data_version(db.session, user_id)
+    key = (user_id, name, args)
+    value = analytics_cache.get(key, version)
+    if value is None:
+        value = builder(user_id, *args)
+        analytics_cache.set(key, version, value)
+    return value
+
+
+class Warmer:
+    """Runs post-login warm-ups on a small thread pool.
+
+    At most ``max_pending`` warm-ups are queued or running; further ones are
+    dropped, so a login storm can't pile work onto the database.
+    """
+
+    def __init__(self, workers=2, max_pending=16):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="analytics-warmup"
+        )
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, app, user_id, jobs):
+        """Queue ``jobs`` for ``user_id``; returns False if dropped."""
+        with self._lock:
+            if user_id in self._pending or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.add(user_id)
+        self._executor.submit(self._run, app, user_id, jobs)
+        return True
+
+    def _run(self, app, user_id, jobs):
+        try:
+            with app.app_context():
+                # Only reads happen here, so route them to the replica if one
+                # is configured; this app context's g is the job's own
+                g.db_read_replica = True
+                for name, builder, args in jobs:
+                    cached_columns(name, builder, user_id, *args)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Error warming analytics for {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
+
+    def snapshot(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+_warmer = None
+_warmer_lock = threading.Lock()
+
+
+def warm_analytics(user_id, today=None):
+    """Precompute the current month's and year's analytics in the background.
+
+    Called right after login; a no-op when ANALYTICS_WARMUP is off.
+    """
+    global _warmer
+    app = current_app._get_current_object()
+    if not app.config["ANALYTICS_WARMUP"]:
+        return False
+    with _warmer_lock:
+        if _warmer is None:
+            _warmer = Warmer(
+                workers=app.config["ANALYTICS_WARMUP_WORKERS"],
+                max_pending=app.config["ANALYTICS_WARMUP_MAX_PENDING"],
+            )
+
+    # Imported here: the views import this module
+    from .views import (
+        category_columns,
+        payment_columns,
+        spending_columns,
+        top_category_columns,
+        trend_columns,
+    )
+
+    today = today or date.today()
+    year, month = today.year, today.month
+    jobs = [
+        ("category", category_columns, (year, month)),
+        ("spending", spending_columns, (year, month)),
+        ("payment", payment_columns, (year, month)),
+        ("top", top_category_columns, (year,)),
+        ("trend", trend_columns, (today,)),
+    ]
+    return _warmer.submit(app, user_id, jobs)
+
+
+def init_analytics_cache(app):
+    """Configure the analytics cache and expose its counters."""
+    app.config.setdefault("ANALYTICS_CACHE_SIZE", 2048)
+    app.config.setdefault("ANALYTICS_CACHE_TTL", 600)
+    app.config.setdefault("ANALYTICS_WARMUP", True)
+    app.config.setdefault("ANALYTICS_WARMUP_WORKERS", 2)
+    app.config.setdefault("ANALYTICS_WARMUP_MAX_PENDING", 16)
+    analytics_cache.max_entries = app.config["ANALYTICS_CACHE_SIZE"]
+    analytics_cache.ttl = app.config["ANALYTICS_CACHE_TTL"]
+
+    register_metrics("analytics_cache", analytics_cache.snapshot)
+    register_metrics(
+        "analytics_warmup",
+        lambda: _warmer.snapshot() if _warmer else {"pending": 0},
+    )
@@ -0,0 +1,70 @@
+"""Static chart rendering for PDF reports.
+
+Kept free of app imports so the functions can run in worker processes.
+"""
+
+import io
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+
+# Figure size in inches and resolution of rendered charts
+FIGURE_SIZE = (4.2, 3.0)
+DPI = 120
+
+
+def _png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=DPI, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def render_pie(title, labels, values, colors):
+    """Category share as a donut chart."""
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE)
+    ax.pie(
+        values,
+        labels=None,
+        colors=colors[: len(values)],
+        startangle=90,
+        wedgeprops={"width": 0.45},
+    )
+    ax.legend(
+        labels, loc="center left", bbox_to_anchor=(1, 0.5), fontsize=7, frameon=False
+    )
+    ax.set_title(title, fontsize=10)
+    ax.axis("equal")
+    return _png(fig)
+
+
+def render_bars(title, labels, values, color):
+    """Totals per day (or month) as bars."""
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE)
+    ax.bar([str(label) for label in labels], values, color=color)
+    ax.set_title(title, fontsize=10)
+    ax.tick_params(axis="x", labelsize=6, rotation=90 if len(labels) > 12 else 0)
+    ax.tick_params(axis="y", labelsize=7)
+    ax.spines[["top", "right"]].set_visible(False)
+    return _png(fig)
+
+
+def render_trend(title, labels, values, color):
+    """Monthly totals across a year as a line."""
+    fig, ax = plt.subplots(figsize=(8.4, 3.0))
+    ax.plot(labels, values, marker="o", color=color)
+    ax.fill_between(range(len(values)), values, color=color, alpha=0.15)
+    ax.set_title(title, fontsize=10)
+    ax.tick_params(labelsize=7)
+    ax.spines[["top", "right"]].set_visible(False)
+    return _png(fig)
+
+
+RENDERERS = {"pie": render_pie, "bars": render_bars, "trend": render_trend}
+
+
+def render(kind, *args):
+    """Render one chart by kind; the process pool's entry point."""
+    return RENDERERS[kind](*args)
@@ -0,0 +1,232 @@
+import calendar
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import select
+from models import ExpenseRollup, ExpenseVersion
+from expenses.rollups import unpack_daily
+
+
+def _days_in(month):
+    return calendar.monthrange(month.year, month.month)[1]
+
+
+def _offsets(months):
+    """First column of each month's days when stored side by side, plus the end."""
+    offsets = [0]
+    for month in months:
+        offsets.append(offsets[-1] + _days_in(month))
+    return offsets
+
+
+def _fill(daily, months, offsets, categories, rollups):
+    """Copy the rollups' per-day cents into ``daily``, a row per category."""
+    rows = {category: i for i, category in enumerate(categories)}
+    for rollup in rollups:
+        m = bisect_left(months, rollup.month)
+        daily[rows[rollup.main_category], offsets[m] : offsets[m + 1]] = unpack_daily(
+            rollup.daily
+        )[: _days_in(rollup.month)]
+
+
+class DailyIndex:
+    """One user's cumulative spending per day, per category and overall.
+
+    Only months that have rollups are stored, their days side by side:
+    month ``months[m]`` occupies columns ``offsets[m]`` to ``offsets[m + 1]``
+    of ``daily``. Months without rollups spent nothing, so leaving them out
+    changes no sums, and an index's size follows the months a user has
+    spent in rather than the span between their first and last expense.
+    ``cumulative[c, i]`` is what category ``c`` had cost, in cents, before
+    stored day ``i``; the last row is all categories together. The total
+    for any range is the difference of two columns, however long it is.
+    """
+
+    def __init__(self, months, daily, categories, versions, cumulative=None, start=0):
+        self.months = months
+        self.offsets = _offsets(months)
+        self.daily = daily
+        self.categories = categories
+        self.versions = versions
+        if cumulative is None:
+            cumulative = np.zeros((len(categories) + 1, daily.shape[1] + 1), np.int64)
+        self.cumulative = cumulative
+        self._accumulate(start)
+
+    @classmethod
+    def build(cls, rollups, versions):
+        """Index over ``rollups``, all of a user's ExpenseRollup rows."""
+        months = sorted({r.month for r in rollups})
+        categories = sorted({r.main_category for r in rollups})
+        offsets = _offsets(months)
+        daily = np.zeros((len(categories), offsets[-1]), np.int64)
+        _fill(daily, months, offsets, categories, rollups)
+        return cls(months, daily, categories, versions)
+
+    @property
+    def nbytes(self):
+        return self.daily.nbytes + self.cumulative.nbytes
+
+    def covers(self, rollups):
+        """Whether ``rollups`` fit in this index's months and categories."""
+        return all(
+            self._stored(r.month) is not None and r.main_category in self.categories
+            for r in rollups
+        )
+
+    def patched(self, months, rollups, versions):
+        """A copy with ``months`` replaced by ``rollups``, their current rows.
+
+        Cumulative totals are only recomputed from the earliest changed day on.
+        """
+        stored = sorted(m for m in map(self._stored, months) if m is not None)
+        if not stored:
+            return DailyIndex(
+                self.months,
+                self.daily,
+                self.categories,
+                versions,
+                self.cumulative,
+                self.daily.shape[1],
+            )
+        daily = self.daily.copy()
+        for m in stored:
+            daily[:, self.offsets[m] : self.offsets[m + 1]] = 0
+        _fill(daily, self.months, self.offsets, self.categories, rollups)
+        return DailyIndex(
+            self.months,
+            daily,
+            self.categories,
+            versions,
+            self.cumulative.copy(),
+            self.offsets[stored[0]],
+        )
+
+    def _stored(self, month):
+        """Position of ``month`` in ``months``, or None if it isn't stored."""
+        m = bisect_left(self.months, month)
+        return m if m < len(self.months) and self.months[m] == month else None
+
+    def _accumulate(self, start):
+        """Recompute the cumulative totals from day offset ``start`` on."""
+        count = len(self.categories)
+        self.cumulative[:count, start + 1 :] = self.cumulative[
+            :count, start : start + 1
+        ] + np.cumsum(self.daily[:, start:], axis=1)
+        self.cumulative[count, start + 1 :] = self.cumulative[:count, start + 1 :].sum(
+            axis=0
+        )
+
+    def _position(self, day, inclusive=False):
+        """Stored days before ``day``, or up to and including it."""
+        month = day.replace(day=1)
+        m = bisect_left(self.months, month)
+        if m < len(self.months) and self.months[m] == month:
+            return self.offsets[m] + day.day - (0 if inclusive else 1)
+        return self.offsets[m]
+
+    def totals(self, start, end):
+        """``(total, {category: total})`` in cents for [start, end], inclusive."""
+        if not self.months:
+            return 0, {}
+        lo = self._position(start)
+        hi = self._position(end, inclusive=True)
+        if hi <= lo:
+            return 0, {}
+        spent = self.cumulative[:, hi] - self.cumulative[:, lo]
+        by_category = {
+            category: int(cents)
+            for category, cents in zip(self.categories, spent[:-1])
+            if cents
+        }
+        return int(spent[-1]), by_category
+
+
+class DailyIndexCache:
+    """Per-process LRU of users' DailyIndex, kept current by month version.
+
+    A write bumps the versions of the months it touched; only those months
+    are reread from the rollups and patched into the index. Bounded by
+    entries and by the bytes of their arrays, whichever is hit first.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, session, user_id):
+        versions = dict(
+            session.execute(
+                select(ExpenseVersion.month, ExpenseVersion.version).where(
+                    ExpenseVersion.user_id == user_id
+                )
+            ).all()
+        )
+        with self._lock:
+            index = self._entries.get(user_id)
+            if index is not None:
+                self._entries.move_to_end(user_id)
+        if index is not None and index.versions == versions:
+            return index
+
+        query = select(ExpenseRollup).where(ExpenseRollup.user_id == user_id)
+        if index is None:
+            index = DailyIndex.build(session.execute(query).scalars().all(), versions)
+        else:
+            changed = {
+                month
+                for month in versions.keys() | index.versions.keys()
+                if versions.get(month) != index.versions.get(month)
+            }
+            rollups = (
+                session.execute(query.where(ExpenseRollup.month.in_(changed)))
+                .scalars()
+                .all()
+            )
+            if index.covers(rollups):
+                index = index.patched(changed, rollups, versions)
+            else:
+                index = DailyIndex.build(
+                    session.execute(query).scalars().all(), versions
+                )
+
+        with self._lock:
+            previous = self._entries.pop(user_id, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[user_id] = index
+            self._bytes += index.nbytes
+            # The newest entry stays even if it alone is over the limit
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+daily_indexes = DailyIndexCache()
+
+
+def range_totals(session, user_ids, start, end):
+    """``(total, {category: total})`` for [start, end], summed over ``user_ids``.
+
+    Amounts are in BASE_CURRENCY.
+    """
+    total = 0
+    by_category = {}
+    for user_id in user_ids:
+        cents, categories = daily_indexes.get(session, user_id).totals(start, end)
+        total += cents
+        for category, value in categories.items():
+            by_category[category] = by_category.get(category, 0) + value
+    return total / 100, {c: v / 100 for c, v in by_category.items()}
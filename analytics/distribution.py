@@ -0,0 +1,195 @@
+import numpy as np
+from sqlalchemy import Float, Text, case, cast, func, select
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from fx import converted_amount, rate_join
+from models import Expense, FxRate
+
+# Percentiles reported per category, besides min and max
+PERCENTILES = (50, 75, 90, 99)
+PERCENTILE_NAMES = ("median", "p75", "p90", "p99")
+STAT_NAMES = ("min", *PERCENTILE_NAMES, "max")
+
+DEFAULT_BUCKETS = 10
+MAX_BUCKETS = 50
+
+
+def _amounts(where):
+    """Category and converted amount of each expense matching ``where``."""
+    return (
+        select(
+            Expense.main_category.label("category"),
+            cast(converted_amount(), Float).label("amount"),
+        )
+        .outerjoin(FxRate, rate_join())
+        .where(*where)
+    )
+
+
+class amount_list(FunctionElement):
+    """Aggregate of a group's amounts as one comma-separated string.
+
+    One string per category parses much faster than a row per expense.
+    """
+
+    type = Text()
+    inherit_cache = True
+
+
+@compiles(amount_list)
+def _amount_list(element, compiler, **kw):
+    return f"group_concat({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(amount_list, "postgresql")
+def _amount_list_postgresql(element, compiler, **kw):
+    amount = compiler.process(element.clauses, **kw)
+    return f"string_agg(CAST({amount} AS TEXT), ',')"
+
+
+def _payload(labels, counts, stats, histograms):
+    """Columnar payload: one entry per category in each list.
+
+    ``stats`` maps min, the percentile names and max to value lists.
+    """
+    payload = {"labels": labels, "count": counts}
+    for name, values in stats.items():
+        payload[name] = [round(float(v), 2) for v in values]
+    payload["buckets"] = histograms
+    payload["bucket_edges"] = [
+        [round(float(e), 2) for e in np.linspace(lo, hi, len(hist) + 1)]
+        for lo, hi, hist in zip(stats["min"], stats["max"], histograms)
+    ]
+    return payload
+
+
+def sql_distribution(session, where, buckets):
+    """Distribution per category in one grouped PostgreSQL query.
+
+    ``percentile_cont`` gives the percentiles and ``width_bucket`` equal-width
+    histogram buckets between each category's min and max.
+    """
+    amounts = _amounts(where).cte("amounts")
+    summary = (
+        select(
+            amounts.c.category,
+            func.percentile_cont(array([p / 100 for p in PERCENTILES]))
+            .within_group(amounts.c.amount)
+            .label("percentiles"),
+            func.min(amounts.c.amount).label("low"),
+            func.max(amounts.c.amount).label("high"),
+            func.count().label("count"),
+        )
+        .group_by(amounts.c.category)
+        .cte("summary")
+    )
+    # width_bucket() puts the maximum in bucket n + 1, and needs low < high
+    width_bucket = func.width_bucket(
+        amounts.c.amount, summary.c.low, summary.c.high, buckets
+    )
+    bucket = case(
+        (summary.c.high > summary.c.low, func.least(width_bucket, buckets)),
+        else_=1,
+    ).label("bucket")
+    histogram = (
+        select(amounts.c.category, bucket, func.count().label("count"))
+        .join(summary, summary.c.category == amounts.c.category)
+        .group_by(amounts.c.category, "bucket")
+        .cte("histogram")
+    )
+    rows = session.execute(
+        select(
+            summary.c.category,
+            summary.c.percentiles,
+            summary.c.low,
+            summary.c.high,
+            summary.c.count,
+            histogram.c.bucket,
+            histogram.c.count.label("bucket_count"),
+        )
+        .join(histogram, histogram.c.category == summary.c.category)
+        .order_by(summary.c.count.desc(), summary.c.category)
+    ).all()
+
+    labels, counts, histograms = [], [], []
+    stats = {name: [] for name in STAT_NAMES}
+    for row in rows:
+        if not labels or labels[-1] != row.category:
+            labels.append(row.category)
+            counts.append(row.count)
+            stats["min"].append(row.low)
+            stats["max"].append(row.high)
+            for name, value in zip(PERCENTILE_NAMES, row.percentiles):
+                stats[name].append(value)
+            histograms.append([0] * buckets)
+        histograms[-1][row.bucket - 1] = row.bucket_count
+    return _payload(labels, counts, stats, histograms)
+
+
+def numpy_distribution(session, where, buckets, extra=None):
+    """Distribution per category computed with NumPy from the amounts alone.
+
+    The database sends each category's amounts as one string. ``extra``
+    adds ``{category: amounts}`` arrays from outside the table, such as
+    archived expenses. Percentiles interpolate like ``percentile_cont``, so
+    both paths agree.
+    """
+    amounts = _amounts(where).subquery()
+    rows = session.execute(
+        select(amounts.c.category, amount_list(amounts.c.amount)).group_by(
+            amounts.c.category
+        )
+    ).all()
+    groups = {category: np.fromstring(values, sep=",") for category, values in rows}
+    for category, values in (extra or {}).items():
+        if category in groups:
+            values = np.concatenate([groups[category], values])
+        groups[category] = values
+
+    index = {category: code for code, category in enumerate(groups)}
+    codes = np.repeat(np.arange(len(groups)), [len(v) for v in groups.values()])
+    amounts = np.concatenate(list(groups.values())) if groups else np.array([])
+    if not len(amounts):
+        return _payload([], [], {name: [] for name in STAT_NAMES}, [])
+
+    # Sort by category, then amount: each category is a sorted slice
+    order = np.lexsort((amounts, codes))
+    codes = codes[order]
+    amounts = amounts[order]
+    counts = np.bincount(codes, minlength=len(index))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    low = amounts[starts]
+    high = amounts[starts + counts - 1]
+
+    # Linear interpolation between the closest ranks, for all categories at once
+    positions = (counts[:, None] - 1) * (np.array(PERCENTILES) / 100)
+    below = np.floor(positions).astype(np.int64)
+    above = np.minimum(below + 1, counts[:, None] - 1)
+    fraction = positions - below
+    lower = amounts[starts[:, None] + below]
+    upper = amounts[starts[:, None] + above]
+    percentiles = lower + (upper - lower) * fraction
+
+    # Equal-width buckets between each category's min and max
+    width = (high - low)[codes]
+    scaled = np.divide(
+        amounts - low[codes], width, out=np.zeros_like(amounts), where=width > 0
+    )
+    bucket = np.minimum((scaled * buckets).astype(np.int64), buckets - 1)
+    histograms = np.bincount(
+        codes * buckets + bucket, minlength=len(index) * buckets
+    ).reshape(len(index), buckets)
+
+    labels = list(index)
+    ranked = sorted(range(len(labels)), key=lambda i: (-counts[i], labels[i]))
+    stats = {"min": low[ranked]}
+    for i, name in enumerate(PERCENTILE_NAMES):
+        stats[name] = percentiles[ranked, i]
+    stats["max"] = high[ranked]
+    return _payload(
+        [labels[i] for i in ranked],
+        [int(counts[i]) for i in ranked],
+        stats,
+        histograms[ranked].tolist(),
+    )
@@ -0,0 +1,121 @@
+from sqlalchemy import Float, and_, cast, func, or_, select
+from fx import converted_amount, rate_join
+from models import Expense, FxRate
+
+# Transactions per page when drilling into a subcategory
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def level_rows(session, where):
+    """``(main_category, subcategory, total, count)`` at every level.
+
+    Subcategory rows come with their category's subtotal (subcategory None)
+    and the grand total (both None), as ``GROUP BY ROLLUP`` returns them.
+    PostgreSQL runs the ROLLUP; SQLite has none, so the subtotals are
+    added up from the same single grouped query's rows.
+    """
+    total = cast(func.sum(converted_amount()), Float).label("total")
+    count = func.count().label("count")
+    if session.get_bind().dialect.name == "postgresql":
+        rows = session.execute(
+            select(
+                Expense.main_category,
+                Expense.subcategory,
+                func.grouping(Expense.main_category).label("main_level"),
+                func.grouping(Expense.subcategory).label("sub_level"),
+                total,
+                count,
+            )
+            .outerjoin(FxRate, rate_join())
+            .where(*where)
+            .group_by(func.rollup(Expense.main_category, Expense.subcategory))
+        )
+        return [
+            (
+                None if row.main_level else row.main_category,
+                None if row.sub_level else row.subcategory,
+                row.total,
+                row.count,
+            )
+            for row in rows
+        ]
+
+    rows = session.execute(
+        select(Expense.main_category, Expense.subcategory, total, count)
+        .outerjoin(FxRate, rate_join())
+        .where(*where)
+        .group_by(Expense.main_category, Expense.subcategory)
+    ).all()
+    subtotals = {}
+    for main, _, amount, number in rows:
+        for key in ((main, None), (None, None)):
+            key_total, key_count = subtotals.get(key, (0, 0))
+            subtotals[key] = (key_total + amount, key_count + number)
+    if not rows:
+        subtotals[None, None] = (None, 0)
+    return [tuple(row) for row in rows] + [
+        (main, sub, amount, number)
+        for (main, sub), (amount, number) in subtotals.items()
+    ]
+
+
+def drilldown_tree(rows, archived):
+    """Category and subcategory levels as a sunburst tree, largest first.
+
+    ``rows`` come from :func:`level_rows`; ``archived`` maps (category,
+    subcategory) pairs to archived ``(cents, count)`` and is added to every
+    level it falls under.
+    """
+    totals = {}
+    for main, sub, amount, count in rows:
+        totals[main, sub] = (amount or 0, count)
+    for (main, sub), (cents, count) in archived.items():
+        for key in ((main, sub), (main, None), (None, None)):
+            amount, number = totals.get(key, (0, 0))
+            totals[key] = (amount + cents / 100, number + count)
+
+    def node(name, key):
+        amount, count = totals.get(key, (0, 0))
+        return {"name": name, "value": round(amount, 2), "count": count}
+
+    categories = {}
+    for main, sub in totals:
+        if main is not None and sub is not None:
+            categories.setdefault(main, []).append(sub)
+
+    root = node("Total", (None, None))
+    root["children"] = []
+    for main, subs in categories.items():
+        category = node(main, (main, None))
+        category["children"] = sorted(
+            (node(sub, (main, sub)) for sub in subs),
+            key=lambda n: n["value"],
+            reverse=True,
+        )
+        root["children"].append(category)
+    root["children"].sort(key=lambda n: n["value"], reverse=True)
+    return root
+
+
+def transactions(session, where, before, limit):
+    """Up to ``limit`` ``(expense, amount in BASE_CURRENCY)`` pairs, newest
+    first, strictly before a ``(date, id)`` position if ``before`` is given."""
+    if before:
+        before_date, before_id = before
+        where = (
+            *where,
+            or_(
+                Expense.date < before_date,
+                and_(Expense.date == before_date, Expense.id < before_id),
+            ),
+        )
+    amount = converted_amount().label("converted")
+    rows = session.execute(
+        select(Expense, amount)
+        .outerjoin(FxRate, rate_join())
+        .where(*where)
+        .order_by(Expense.date.desc(), Expense.id.desc())
+        .limit(limit)
+    ).all()
+    return [(expense, float(converted)) for expense, converted in rows]
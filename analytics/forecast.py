@@ -0,0 +1,317 @@
+import calendar
+from datetime import date, datetime, timezone
+import numpy as np
+from sqlalchemy import Float, cast, extract, func, select
+from database import use_primary
+from fx import converted_amount, rate_join
+from models import Expense, ExpenseRollup, ExpenseVersion, ForecastModel, FxRate
+from expenses.archive import archived_totals
+from expenses.rollups import month_start
+
+# Complete months of monthly totals a model is fitted on
+HISTORY_MONTHS = 24
+# Most recent months the trend line is fitted to
+TREND_MONTHS = 12
+# Complete months whose daily spending shapes the day-of-month profile
+PROFILE_MONTHS = 12
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def history_version(session, user_id, month):
+    """Version of a user's data before ``month``; a model fitted for that
+    month stays valid while it is unchanged."""
+    return session.execute(
+        select(func.coalesce(func.sum(ExpenseVersion.version), 0)).where(
+            ExpenseVersion.user_id == user_id, ExpenseVersion.month < month
+        )
+    ).scalar()
+
+
+def forecast_inputs(session, user_id, month):
+    """Daily and monthly aggregates a forecast for ``month`` is fitted on.
+
+    Monthly totals per category come from the rollups; spending per
+    category and day of month from one grouped query (archive included).
+    """
+    start = add_months(month, -HISTORY_MONTHS)
+    monthly_rows = session.execute(
+        select(ExpenseRollup.main_category, ExpenseRollup.month, ExpenseRollup.total)
+        .where(
+            ExpenseRollup.user_id == user_id,
+            ExpenseRollup.month >= start,
+            ExpenseRollup.month < month,
+        )
+    ).all()
+
+    profile_start = add_months(month, -PROFILE_MONTHS)
+    by_day = extract("day", Expense.date).label("day")
+    daily = {
+        (row.main_category, int(row.day)): row.total
+        for row in session.execute(
+            select(
+                Expense.main_category,
+                by_day,
+                cast(func.sum(converted_amount()), Float).label("total"),
+            )
+            .outerjoin(FxRate, rate_join())
+            .where(
+                Expense.user_id == user_id,
+                Expense.date >= profile_start,
+                Expense.date < month,
+            )
+            .group_by(Expense.main_category, by_day)
+        )
+    }
+    archived = archived_totals(
+        user_id, profile_start, month, ("main_category", "day")
+    )
+    for key, (cents, _) in archived.items():
+        daily[key] = daily.get(key, 0) + cents / 100
+
+    categories = sorted(
+        {row.main_category for row in monthly_rows} | {c for c, _ in daily}
+    )
+    index = {category: i for i, category in enumerate(categories)}
+    monthly_totals = np.zeros((len(categories), HISTORY_MONTHS))
+    for row in monthly_rows:
+        offset = (row.month.year - start.year) * 12 + row.month.month - start.month
+        monthly_totals[index[row.main_category], offset] += float(row.total)
+    daily_totals = np.zeros((len(categories), 31))
+    for (category, day), total in daily.items():
+        daily_totals[index[category], day - 1] += total
+
+    return {
+        "month": month.isoformat(),
+        "categories": categories,
+        "monthly": monthly_totals,
+        "daily": daily_totals,
+    }
+
+
+def fit(inputs):
+    """Fit one user's per-category models; pure NumPy, so it runs on a pool.
+
+    Each category gets a least-squares trend line over its recent monthly
+    totals, the totals of the same months a year earlier (seasonal naive)
+    and the cumulative share of a month's spending usually done by each
+    day. Returns JSON-ready parameters.
+    """
+    monthly = inputs["monthly"]
+    count, months = monthly.shape
+    spent = np.flatnonzero(monthly.sum(axis=0))
+    # Months before the user's first spending are not history
+    first = spent[0] if len(spent) else months
+
+    # Trend, all categories in one solve; t = 0 is the forecast month
+    lo = max(first, months - TREND_MONTHS)
+    intercept = np.zeros(count)
+    slope = np.zeros(count)
+    if months - lo >= 2:
+        t = np.arange(lo, months) - months
+        design = np.stack([np.ones(len(t)), t], axis=1)
+        (intercept, slope), *_ = np.linalg.lstsq(design, monthly[:, lo:].T, rcond=None)
+    elif months - lo == 1:
+        intercept = monthly[:, -1].copy()
+
+    # Same month a year earlier, for each of the next 12 months
+    seasonal = monthly[:, months - 12 :].copy()
+    seasonal[:, : max(first - (months - 12), 0)] = np.nan
+
+    # Cumulative share of the month's spending by the end of each day
+    cumulative = np.cumsum(inputs["daily"], axis=1)
+    total = cumulative[:, -1:]
+    even = np.arange(1, 32) / 31
+    profile = np.divide(
+        cumulative, total, out=np.tile(even, (count, 1)), where=total > 0
+    )
+
+    return {
+        "month": inputs["month"],
+        "categories": inputs["categories"],
+        "intercept": np.round(intercept, 4).tolist(),
+        "slope": np.round(slope, 4).tolist(),
+        "seasonal": [
+            [None if np.isnan(v) else round(float(v), 2) for v in row]
+            for row in seasonal
+        ],
+        "profile": np.round(profile, 4).tolist(),
+    }
+
+
+def model_for(session, user_id, month):
+    """Parameters of the user's forecast for ``month``, fitted if stale.
+
+    A current model may come from the read replica. Otherwise the rest of
+    the request uses the primary: the model is looked up again there, and
+    a freshly fitted one is stored for later requests. Failing to store it
+    does not fail the forecast.
+    """
+    version = history_version(session, user_id, month)
+    stored = session.get(ForecastModel, user_id)
+    if stored and stored.month == month and stored.history_version == version:
+        return stored.params
+
+    use_primary(seconds=0)
+    version = history_version(session, user_id, month)
+    stored = session.get(ForecastModel, user_id, populate_existing=True)
+    if stored and stored.month == month and stored.history_version == version:
+        return stored.params
+
+    params = fit(forecast_inputs(session, user_id, month))
+    try:
+        store_model(session, user_id, month, version, params)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Error storing forecast model for {user_id}: {e}")
+    return params
+
+
+def refit_users(session, user_ids, month, pool, force=False):
+    """Fit and store the forecasts of ``user_ids`` for ``month``.
+
+    Aggregates are read here; the fitting runs on ``pool``. Models still
+    current are skipped unless ``force``. The caller commits. Returns the
+    number of models fitted.
+    """
+    stored = {
+        model.user_id: model
+        for model in session.execute(
+            select(ForecastModel).where(ForecastModel.user_id.in_(user_ids))
+        ).scalars()
+    }
+    jobs = {}
+    for user_id in user_ids:
+        version = history_version(session, user_id, month)
+        model = stored.get(user_id)
+        current = (
+            model is not None
+            and model.month == month
+            and model.history_version == version
+        )
+        if force or not current:
+            inputs = forecast_inputs(session, user_id, month)
+            jobs[user_id] = (version, pool.submit(fit, inputs))
+
+    for user_id, (version, future) in jobs.items():
+        store_model(session, user_id, month, version, future.result())
+    return len(jobs)
+
+
+def store_model(session, user_id, month, version, params):
+    session.merge(
+        ForecastModel(
+            user_id=user_id,
+            month=month,
+            history_version=version,
+            params=params,
+            fitted_at=datetime.now(timezone.utc),
+        )
+    )
+
+
+def monthly_forecasts(params, months):
+    """Model totals per category for the forecast month and ``months - 1``
+    after it: the trend, averaged with last year's total where known."""
+    k = np.arange(months)
+    trend = np.maximum(
+        np.array(params["intercept"])[:, None] + np.array(params["slope"])[:, None] * k,
+        0,
+    )
+    seasonal = np.array(params["seasonal"], dtype=float)[:, :months]
+    return np.where(np.isnan(seasonal), trend, (trend + seasonal) / 2)
+
+
+def predict(params, spent, today):
+    """``{category: (month estimate, rest-of-year estimate)}`` for ``today``.
+
+    ``spent`` maps categories to this month's spending so far. A month's
+    estimate is what was spent plus the model's total times the share of
+    the month usually still to come; categories the model hasn't seen are
+    extrapolated from their pace.
+    """
+    days = calendar.monthrange(today.year, today.month)[1]
+    categories = params["categories"]
+    estimates = {}
+    if categories:
+        models = monthly_forecasts(params, 13 - today.month)
+        profile = np.array(params["profile"])
+        # Share usually done by today, rescaled to this month's length
+        by_month_end = profile[:, days - 1]
+        done = np.divide(
+            profile[:, today.day - 1],
+            by_month_end,
+            out=np.ones(len(categories)),
+            where=by_month_end > 0,
+        )
+        done = np.minimum(done, 1)
+        for i, category in enumerate(categories):
+            month = spent.get(category, 0) + (1 - done[i]) * models[i, 0]
+            estimates[category] = (float(month), float(models[i, 1:].sum()))
+    for category, so_far in spent.items():
+        if category not in estimates:
+            estimates[category] = (so_far * days / today.day, 0.0)
+    return estimates
+
+
+def spent_so_far(session, user_id, today):
+    """``(this month, this year)`` spending so far, each ``{category: total}``."""
+    month = month_start(today)
+    spent_month = {}
+    spent_year = {}
+    for row in session.execute(
+        select(ExpenseRollup.main_category, ExpenseRollup.month, ExpenseRollup.total)
+        .where(
+            ExpenseRollup.user_id == user_id,
+            ExpenseRollup.month >= date(today.year, 1, 1),
+            ExpenseRollup.month <= month,
+        )
+    ):
+        total = float(row.total)
+        spent_year[row.main_category] = spent_year.get(row.main_category, 0) + total
+        if row.month == month:
+            spent_month[row.main_category] = total
+    return spent_month, spent_year
+
+
+def forecast_columns(session, user_ids, today):
+    """This month's and year's spending so far and forecast, per category.
+
+    ``user_ids`` is a tuple of ids; a household's forecast is the sum of
+    its members'.
+    """
+    month = month_start(today)
+    totals = {
+        key: {} for key in ("spent_month", "month", "spent_year", "year")
+    }
+    for user_id in user_ids:
+        spent_month, spent_year = spent_so_far(session, user_id, today)
+        estimates = predict(model_for(session, user_id, month), spent_month, today)
+        for category in estimates.keys() | spent_year.keys():
+            estimate, later = estimates.get(category, (0, 0))
+            this_month = spent_month.get(category, 0)
+            this_year = spent_year.get(category, 0)
+            for key, value in (
+                ("spent_month", this_month),
+                ("month", estimate),
+                ("spent_year", this_year),
+                ("year", this_year - this_month + estimate + later),
+            ):
+                totals[key][category] = totals[key].get(category, 0) + value
+
+    labels = sorted(totals["year"], key=totals["year"].get, reverse=True)
+    columns = {"labels": labels}
+    for period in ("month", "year"):
+        spent = totals[f"spent_{period}"]
+        forecast = totals[period]
+        columns[period] = {
+            "spent": round(sum(spent.values()), 2),
+            "forecast": round(sum(forecast.values()), 2),
+            "spent_by_category": [round(spent.get(c, 0), 2) for c in labels],
+            "forecast_by_category": [round(forecast.get(c, 0), 2) for c in labels],
+        }
+    return columns
@@ -0,0 +1,102 @@
+import calendar
+from datetime import timedelta
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import ExpenseRollup, Household, HouseholdMember, User, period_bounds
+from expenses.rollups import month_start
+
+# Most members a household may have
+MAX_HOUSEHOLD_MEMBERS = 8
+
+
+def household_members(user_id):
+    """Sorted tuple of the ids of the user's household's active members.
+
+    None when the user is not in a household.
+    """
+    own = aliased(HouseholdMember)
+    household_id = (
+        select(own.household_id).where(own.user_id == user_id).scalar_subquery()
+    )
+    member_ids = db.session.execute(
+        select(HouseholdMember.user_id)
+        .join(User, User.id == HouseholdMember.user_id)
+        .where(
+            HouseholdMember.household_id == household_id,
+            User.deleted_at.is_(None),
+        )
+    ).scalars()
+    return tuple(sorted(member_ids)) or None
+
+
+def remove_member(user_id):
+    """Take a user out of their household, deleting it once it is empty.
+
+    The caller commits.
+    """
+    membership = db.session.get(HouseholdMember, user_id)
+    if membership is None:
+        return
+    db.session.delete(membership)
+    db.session.flush()
+    remaining = db.session.execute(
+        select(func.count()).where(
+            HouseholdMember.household_id == membership.household_id
+        )
+    ).scalar()
+    if not remaining:
+        db.session.execute(
+            delete(Household).where(Household.id == membership.household_id)
+        )
+
+
+# Builders for a household, from the members' monthly rollups. Each member's
+# rollups are a handful of rows per month, so this costs about the same as
+# one user's analytics no matter how much history the members have.
+
+
+def _rollup_totals(member_ids, start, end, *keys):
+    """``{key: total}`` of the members' rollups for months in [start, end)."""
+    rows = db.session.execute(
+        select(*keys, func.sum(ExpenseRollup.total).label("total"))
+        .where(
+            ExpenseRollup.user_id.in_(member_ids),
+            ExpenseRollup.month >= start,
+            ExpenseRollup.month < end,
+        )
+        .group_by(*keys)
+    ).all()
+    return {row[0]: round(float(row.total), 2) for row in rows}
+
+
+def category_columns(member_ids, year, month):
+    """Totals per main category; month 0 means the whole year."""
+    totals = _rollup_totals(
+        member_ids, *period_bounds(year, month), ExpenseRollup.main_category
+    )
+    return {"labels": list(totals), "values": list(totals.values())}
+
+
+def monthly_columns(member_ids, year):
+    """Totals per month of a year."""
+    totals = _rollup_totals(member_ids, *period_bounds(year), ExpenseRollup.month)
+    values = [0] * 12
+    for month, total in totals.items():
+        values[month.month - 1] = total
+    return {"labels": [calendar.month_abbr[m] for m in range(1, 13)], "values": values}
+
+
+def trend_columns(member_ids, today):
+    """Monthly totals for the last 12 months, oldest first."""
+    start = month_start(today - timedelta(days=365))
+    end = today + timedelta(days=1)
+    totals = _rollup_totals(member_ids, start, end, ExpenseRollup.month)
+
+    labels = []
+    values = []
+    for i in range(12):
+        day = today - timedelta(days=30 * i)
+        labels.insert(0, f"{calendar.month_name[day.month][:3]} {day.year}")
+        values.insert(0, totals.get(month_start(day), 0))
+    return {"labels": labels, "values": values}
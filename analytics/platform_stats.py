@@ -0,0 +1,212 @@
+import time
+import uuid
+from datetime import date
+from sqlalchemy import Float, cast, create_engine, delete, func, select
+from sqlalchemy.pool import NullPool
+from database import postgres_engine_options
+from models import (
+    ExpenseRollup,
+    PlatformCategoryStat,
+    PlatformMonthStat,
+    PlatformStatsRun,
+    User,
+)
+
+DEFAULT_SHARDS = 16
+# Rows fetched per round trip while streaming a shard
+STREAM_BATCH = 10000
+
+
+def shard_bounds(shards):
+    """``shards`` equal [lo, hi) ranges of the UUID space; the last hi is None.
+
+    Ids are random, so each range holds about the same number of users.
+    """
+    step = 2**128 // shards
+    edges = [uuid.UUID(int=i * step) for i in range(shards)] + [None]
+    return list(zip(edges, edges[1:]))
+
+
+def _in_shard(query, column, lo, hi):
+    query = query.where(column >= lo)
+    return query.where(column < hi) if hi is not None else query
+
+
+def shard_engine(url):
+    """An unpooled engine for a pool process; it only ever needs one connection."""
+    options = {"poolclass": NullPool}
+    if url.startswith("postgresql"):
+        options["connect_args"] = postgres_engine_options(url)["connect_args"]
+    return create_engine(url, **options)
+
+
+def aggregate_shard(url, lo, hi):
+    """Totals of the users with ids in [lo, hi); runs in a pool process.
+
+    Streams the shard's rollups (a row per user, month and category) in id
+    order, then its signup dates, so memory stays flat whatever its size.
+    Returns picklable ``{"months", "categories", "users"}``.
+    """
+    # [total, count, active users, new users] by month
+    months = {}
+    # [total, count, users] by (month, main_category)
+    categories = {}
+    users = 0
+    engine = shard_engine(url)
+    try:
+        with engine.connect() as connection:
+            connection = connection.execution_options(
+                stream_results=True, yield_per=STREAM_BATCH
+            )
+            rollups = _in_shard(
+                select(
+                    ExpenseRollup.user_id,
+                    ExpenseRollup.month,
+                    ExpenseRollup.main_category,
+                    ExpenseRollup.total,
+                    ExpenseRollup.count,
+                ),
+                ExpenseRollup.user_id,
+                lo,
+                hi,
+            ).order_by(ExpenseRollup.user_id, ExpenseRollup.month)
+            last = None
+            for user_id, month, category, total, count in connection.execute(rollups):
+                stat = categories.setdefault((month, category), [0, 0, 0])
+                stat[0] += total
+                stat[1] += count
+                stat[2] += 1
+                month_stat = months.setdefault(month, [0, 0, 0, 0])
+                month_stat[0] += total
+                month_stat[1] += count
+                if (user_id, month) != last:
+                    month_stat[2] += 1
+                    last = (user_id, month)
+
+            accounts = _in_shard(
+                select(User.created_at, User.deleted_at), User.id, lo, hi
+            )
+            for created_at, deleted_at in connection.execute(accounts):
+                if created_at is not None:
+                    month = date(created_at.year, created_at.month, 1)
+                    months.setdefault(month, [0, 0, 0, 0])[3] += 1
+                if deleted_at is None:
+                    users += 1
+    finally:
+        engine.dispose()
+    return {"months": months, "categories": categories, "users": users}
+
+
+def _combine(results):
+    months, categories, users = {}, {}, 0
+    for result in results:
+        for target, source in (
+            (months, result["months"]),
+            (categories, result["categories"]),
+        ):
+            for key, values in source.items():
+                if key in target:
+                    target[key] = [a + b for a, b in zip(target[key], values)]
+                else:
+                    target[key] = list(values)
+        users += result["users"]
+    return months, categories, users
+
+
+def run_platform_stats(session, url, shards, pool):
+    """Aggregate every shard of ``url``'s users on ``pool`` and replace the
+    summary tables with the results. The caller commits. Returns the run.
+    """
+    started = time.perf_counter()
+    futures = [
+        pool.submit(aggregate_shard, url, lo, hi) for lo, hi in shard_bounds(shards)
+    ]
+    months, categories, users = _combine(future.result() for future in futures)
+
+    session.execute(delete(PlatformCategoryStat))
+    session.execute(delete(PlatformMonthStat))
+    session.add_all(
+        PlatformMonthStat(
+            month=month,
+            total=total,
+            count=count,
+            active_users=active,
+            new_users=new,
+        )
+        for month, (total, count, active, new) in months.items()
+    )
+    session.add_all(
+        PlatformCategoryStat(
+            month=month,
+            main_category=category,
+            total=total,
+            count=count,
+            users=spenders,
+        )
+        for (month, category), (total, count, spenders) in categories.items()
+    )
+    run = PlatformStatsRun(
+        shards=shards, users=users, seconds=round(time.perf_counter() - started, 2)
+    )
+    session.add(run)
+    return run
+
+
+def _growth(series):
+    """Percentage change of each month against the one before; None if unknown."""
+    return [None] + [
+        round((after - before) / before * 100, 1) if before else None
+        for before, after in zip(series, series[1:])
+    ]
+
+
+def platform_columns(session, months=12):
+    """The latest run's stats, or None before the first run.
+
+    Monthly series cover every month; category totals cover the last
+    ``months`` months of them (0 for all).
+    """
+    run = session.execute(
+        select(PlatformStatsRun).order_by(PlatformStatsRun.id.desc()).limit(1)
+    ).scalar()
+    if run is None:
+        return None
+
+    rows = (
+        session.execute(select(PlatformMonthStat).order_by(PlatformMonthStat.month))
+        .scalars()
+        .all()
+    )
+    spend = [float(row.total) for row in rows]
+    active = [row.active_users for row in rows]
+    columns = {
+        "computed_at": run.computed_at.isoformat(),
+        "users": run.users,
+        "labels": [f"{row.month:%Y-%m}" for row in rows],
+        "spend": spend,
+        "transactions": [row.count for row in rows],
+        "active_users": active,
+        "new_users": [row.new_users for row in rows],
+        "spend_growth_pct": _growth(spend),
+        "active_users_growth_pct": _growth(active),
+    }
+
+    total = cast(func.sum(PlatformCategoryStat.total), Float).label("total")
+    query = (
+        select(
+            PlatformCategoryStat.main_category,
+            total,
+            func.sum(PlatformCategoryStat.count).label("count"),
+        )
+        .group_by(PlatformCategoryStat.main_category)
+        .order_by(total.desc())
+    )
+    if months and rows:
+        query = query.where(PlatformCategoryStat.month >= rows[-months:][0].month)
+    by_category = session.execute(query).all()
+    columns["categories"] = {
+        "labels": [row.main_category for row in by_category],
+        "values": [round(row.total, 2) for row in by_category],
+        "counts": [int(row.count) for row in by_category],
+    }
+    return columns
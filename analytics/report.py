@@ -0,0 +1,205 @@
+import calendar
+import io
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from flask import current_app
+from sqlalchemy import func, select
+from reportlab.lib.units import inch
+from reportlab.platypus import Image, KeepTogether, Paragraph, Spacer, Table
+from extensions import db
+from models import ExpenseRollup, ExpenseVersion
+from . import charts
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _render_pool():
+    """Shared process pool for chart rendering, or None to render inline."""
+    global _pool
+    workers = current_app.config["REPORT_RENDER_WORKERS"]
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded web worker can deadlock the child
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _pool
+
+
+def chart_cache_dir(user_id):
+    return os.path.join(current_app.config["CHART_CACHE_DIR"], str(user_id))
+
+
+def _cache_path(user_id, period, kind, version):
+    return os.path.join(chart_cache_dir(user_id), f"{period}-{kind}-v{version}.png")
+
+
+def _read_cached(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _store(path, png):
+    """Write a chart atomically and drop older versions of it."""
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(png)
+    os.replace(path + ".tmp", path)
+
+    prefix = name.rsplit("-v", 1)[0] + "-v"
+    for entry in os.listdir(directory):
+        if entry.startswith(prefix) and entry != name:
+            try:
+                os.remove(os.path.join(directory, entry))
+            except FileNotFoundError:
+                pass
+
+
+def remove_chart_cache(user_id):
+    shutil.rmtree(chart_cache_dir(user_id), ignore_errors=True)
+
+
+def month_versions(user_id, year):
+    """``{month number: data version}`` for a year (0 if never written)."""
+    rows = db.session.execute(
+        select(ExpenseVersion.month, ExpenseVersion.version).where(
+            ExpenseVersion.user_id == user_id,
+            ExpenseVersion.month >= date(year, 1, 1),
+            ExpenseVersion.month < date(year + 1, 1, 1),
+        )
+    ).all()
+    versions = dict.fromkeys(range(1, 13), 0)
+    versions.update({row.month.month: row.version for row in rows})
+    return versions
+
+
+def month_totals(user_id, year):
+    """``{month number: (total, count)}`` from the rollups, archive included."""
+    rows = db.session.execute(
+        select(
+            ExpenseRollup.month,
+            func.sum(ExpenseRollup.total).label("total"),
+            func.sum(ExpenseRollup.count).label("count"),
+        )
+        .where(
+            ExpenseRollup.user_id == user_id,
+            ExpenseRollup.month >= date(year, 1, 1),
+            ExpenseRollup.month < date(year + 1, 1, 1),
+        )
+        .group_by(ExpenseRollup.month)
+    ).all()
+    return {row.month.month: (row.total, row.count) for row in rows if row.count}
+
+
+def annual_charts(user_id, year):
+    """PNG charts for an annual report: the trend plus per-month pie and bars.
+
+    Charts are cached on disk per (user, month, data version), so after a
+    change only the affected month (and the year's trend) is re-rendered.
+    Misses render in parallel on the process pool. Returns ``(charts,
+    totals)``; charts maps "trend" and (month, kind) to PNG bytes.
+    """
+    # Imported here: the views import this module
+    from .views import CHART_STYLES, PALETTE, category_columns, spending_columns
+
+    trend_color = CHART_STYLES["trend"]["borderColor"]
+    daily_color = CHART_STYLES["daily"]["backgroundColor"]
+
+    versions = month_versions(user_id, year)
+    totals = month_totals(user_id, year)
+
+    jobs = {}
+    trend_path = _cache_path(user_id, year, "trend", sum(versions.values()))
+    result = {"trend": _read_cached(trend_path)}
+    if result["trend"] is None:
+        columns = spending_columns(user_id, year, 0)
+        title = f"Monthly spending {year}"
+        jobs["trend"] = (
+            trend_path,
+            ("trend", title, columns["labels"], columns["values"], trend_color),
+        )
+
+    for month in totals:
+        period = f"{year}-{month:02d}"
+        name = calendar.month_name[month]
+        pie_path = _cache_path(user_id, period, "pie", versions[month])
+        bars_path = _cache_path(user_id, period, "bars", versions[month])
+        result[(month, "pie")] = _read_cached(pie_path)
+        result[(month, "bars")] = _read_cached(bars_path)
+
+        if result[(month, "pie")] is None:
+            columns = category_columns(user_id, year, month)
+            title = f"{name} by category"
+            jobs[(month, "pie")] = (
+                pie_path,
+                ("pie", title, columns["labels"], columns["values"], PALETTE),
+            )
+        if result[(month, "bars")] is None:
+            columns = spending_columns(user_id, year, month)
+            title = f"{name} daily spending"
+            jobs[(month, "bars")] = (
+                bars_path,
+                ("bars", title, columns["labels"], columns["values"], daily_color),
+            )
+
+    pool = _render_pool()
+    if pool is None:
+        rendered = {key: charts.render(*args) for key, (_, args) in jobs.items()}
+    else:
+        futures = {
+            key: pool.submit(charts.render, *args) for key, (_, args) in jobs.items()
+        }
+        rendered = {key: future.result() for key, future in futures.items()}
+
+    for key, png in rendered.items():
+        _store(jobs[key][0], png)
+        result[key] = png
+    return result, totals
+
+
+def _image(png, width):
+    image = Image(io.BytesIO(png))
+    image.drawWidth = width
+    image.drawHeight = width * image.imageHeight / image.imageWidth
+    return image
+
+
+def annual_sections(user_id, year, styles, heading_style):
+    """Report flowables: the year's trend chart, then one section per month."""
+    result, totals = annual_charts(user_id, year)
+
+    elements = [Paragraph("Monthly Breakdown", heading_style)]
+    if result["trend"]:
+        elements += [_image(result["trend"], 6.5 * inch), Spacer(1, 0.3 * inch)]
+
+    for month in range(1, 13):
+        if month not in totals:
+            continue
+        total, count = totals[month]
+        section = [
+            Paragraph(f"{calendar.month_name[month]} {year}", styles["Heading3"]),
+            Paragraph(f"${total:,.2f} across {count} transactions", styles["Normal"]),
+            Spacer(1, 0.1 * inch),
+            Table(
+                [
+                    [
+                        _image(result[(month, "pie")], 3.2 * inch),
+                        _image(result[(month, "bars")], 3.2 * inch),
+                    ]
+                ]
+            ),
+            Spacer(1, 0.25 * inch),
+        ]
+        elements.append(KeepTogether(section))
+    return elements
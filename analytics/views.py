@@ -1,11 +1,35 @@
 import io
-from flask import Blueprint, render_template, jsonify, request, send_file
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    send_file,
+)
 from flask_login import login_required, current_user
-from models import Expense
-from sqlalchemy import extract, func, and_
-from datetime import datetime, timedelta
+from extensions import db
+from database import read_replica
+from ratelimit import rate_limit
+from . import distribution, drilldown, forecast, household, platform_stats
+from .daily_index import range_totals
+from .cache import cached_columns
+from .report import annual_sections
+from models import Expense, FxRate, period_bounds
+from fx import converted_amount, rate_join
+from expenses.archive import (
+    archived_amounts,
+    archived_largest,
+    archived_page,
+    archived_totals,
+)
+from api.serializers import decode_cursor, encode_cursor, serialize_expense
+from sqlalchemy import Float, case, cast, extract, func, or_
+from datetime import date, datetime, timedelta
 from collections import defaultdict
 import calendar
+import numpy as np
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
@@ -28,476 +52,770 @@ analytics_bp = Blueprint("analytics", __name__, url_prefix="/analytics")
 
 @analytics_bp.route("/")
 @login_required
+@read_replica
 def dashboard():
     """Main analytics dashboard."""
-    return render_template("analytics/dashboard.html")
-
+    return render_template(
+        "analytics/dashboard.html",
+        household=household.household_members(current_user.id) is not None,
+    )
 
-@analytics_bp.route("/api/expense-by-category")
-@login_required
-def expense_by_category():
-    """Get expense data grouped by main category for current month."""
-    month = request.args.get("month", datetime.now().month, type=int)
-    year = request.args.get("year", datetime.now().year, type=int)
 
-    # Build query
-    query = db.session.query(
-        Expense.main_category, func.sum(Expense.amount).label("total")
-    ).filter(Expense.user_id == current_user.id, extract("year", Expense.date) == year)
-
-    # Add month filter only if not "All Year" (month != 0)
-    if month != 0:
-        query = query.filter(extract("month", Expense.date) == month)
-
-    expenses = query.group_by(Expense.main_category).all()
-
-    data = {
-        "labels": [e.main_category for e in expenses],
-        "datasets": [
-            {
-                "data": [float(e.total) for e in expenses],
-                "backgroundColor": [
-                    "#FF6384",
-                    "#36A2EB",
-                    "#FFCE56",
-                    "#4BC0C0",
-                    "#9966FF",
-                    "#FF9F40",
-                    "#FF6384",
-                    "#C9CBCF",
-                    "#4BC0C0",
-                    "#FF6384",
-                    "#36A2EB",
-                    "#FFCE56",
-                    "#FF9F40",
-                    "#9966FF",
-                    "#C9CBCF",
-                ],
-            }
-        ],
+def _scope():
+    """Whose expenses a chart covers: the current user's id, or a tuple of
+    their household's member ids for ``?scope=household``.
+
+    None when a household is asked for but the user is not in one.
+    """
+    if request.args.get("scope") == "household":
+        return household.household_members(current_user.id)
+    return current_user.id
+
+
+def _no_household():
+    return jsonify({"error": "You are not in a household"}), 404
+
+
+# Chart.js dataset styling for clients of the original payload format. The
+# dashboard requests format=columnar and styles its charts itself.
+PALETTE = [
+    "#FF6384",
+    "#36A2EB",
+    "#FFCE56",
+    "#4BC0C0",
+    "#9966FF",
+    "#FF9F40",
+    "#FF6384",
+    "#C9CBCF",
+    "#4BC0C0",
+    "#FF6384",
+    "#36A2EB",
+    "#FFCE56",
+    "#FF9F40",
+    "#9966FF",
+    "#C9CBCF",
+]
+
+CHART_STYLES = {
+    "category": {"backgroundColor": PALETTE},
+    "trend": {
+        "label": "Monthly Expenses",
+        "fill": False,
+        "borderColor": "#36A2EB",
+        "backgroundColor": "#36A2EB",
+        "tension": 0.4,
+    },
+    "monthly": {
+        "label": "Monthly Spending",
+        "backgroundColor": "#4BC0C0",
+        "borderColor": "#4BC0C0",
+        "borderWidth": 1,
+    },
+    "daily": {
+        "label": "Daily Spending",
+        "backgroundColor": "#4BC0C0",
+        "borderColor": "#4BC0C0",
+        "borderWidth": 1,
+    },
+    "top": {
+        "label": "Total Spent",
+        "backgroundColor": ["#FF6384", "#36A2EB", "#FFCE56", "#4BC0C0", "#9966FF"],
+    },
+    "payment": {
+        "label": "Amount by Payment Method",
+        "backgroundColor": ["#FF9F40", "#FF6384", "#C9CBCF", "#4BC0C0", "#36A2EB"],
+    },
+}
+
+MONTH_LABELS = [calendar.month_abbr[m] for m in range(1, 13)]
+
+# Most periods one compare request may ask for
+MAX_COMPARE_PERIODS = 6
+
+
+def _total():
+    """Sum of amounts computed by the database, not per row in Python.
+
+    Amounts are converted to BASE_CURRENCY, so the query must outer-join
+    ``FxRate`` on ``rate_join()``. The sum stays Numeric; pass it through
+    :func:`_amount` rather than casting to Float in SQL, which leaks binary
+    noise such as 319.71000000000004 into the payloads.
+    """
+    return func.sum(converted_amount()).label("total")
+
+
+def _amount(total):
+    """A ``_total()`` value as a float rounded to cents; None (no rows) is 0."""
+    return round(float(total or 0), 2)
+
+
+def _owned_by(user_id):
+    """Filter for one user's expenses, or a household's given a tuple of ids."""
+    if isinstance(user_id, tuple):
+        return Expense.user_id.in_(user_id)
+    return Expense.user_id == user_id
+
+
+def _archived_between(user_id, start, end, keys):
+    """Archived ``{key tuple: (cents, count)}``, summed over a tuple of ids."""
+    if not isinstance(user_id, tuple):
+        return archived_totals(user_id, start, end, keys)
+    combined = {}
+    for member_id in user_id:
+        for key, (cents, count) in archived_totals(member_id, start, end, keys).items():
+            total_cents, total_count = combined.get(key, (0, 0))
+            combined[key] = (total_cents + cents, total_count + count)
+    return combined
+
+
+def _archived_amounts(user_id, start, end, key):
+    """Archived ``{label: amounts}``, concatenated over a tuple of ids."""
+    if not isinstance(user_id, tuple):
+        return archived_amounts(user_id, start, end, key)
+    combined = defaultdict(list)
+    for member_id in user_id:
+        for label, values in archived_amounts(member_id, start, end, key).items():
+            combined[label].append(values)
+    return {label: np.concatenate(parts) for label, parts in combined.items()}
+
+
+def _archived(user_id, year, month, *keys):
+    """Archived ``{key tuple: (cents, count)}`` for a period; {} if none."""
+    return _archived_between(user_id, *period_bounds(year, month), keys)
+
+
+def _merge_archived(totals, archived, counts=None):
+    """Add archived aggregates to ``totals`` (and ``counts``) in place.
+
+    Single-column keys are unwrapped to match the query rows' keys.
+    """
+    for key, (cents, count) in archived.items():
+        key = key[0] if len(key) == 1 else key
+        totals[key] = round(totals.get(key, 0) + cents / 100, 2)
+        if counts is not None:
+            counts[key] = counts.get(key, 0) + count
+
+
+def chart_payload(style, columns):
+    """Chart.js-shaped payload (labels plus one styled dataset) from columns."""
+    payload = {
+        "labels": columns["labels"],
+        "datasets": [dict(CHART_STYLES[style], data=columns["values"])],
     }
+    if "counts" in columns:
+        payload["counts"] = columns["counts"]
+    return payload
+
+
+def chart_response(style, columns):
+    """Respond with columns for ``format=columnar``, else the Chart.js payload."""
+    if request.args.get("format") == "columnar":
+        return jsonify(columns)
+    return jsonify(chart_payload(style, columns))
+
+
+def category_columns(user_id, year, month):
+    """Totals per main category; month 0 means the whole year."""
+    if isinstance(user_id, tuple):
+        return household.category_columns(user_id, year, month)
+    rows = (
+        db.session.query(Expense.main_category, _total())
+        .outerjoin(FxRate, rate_join())
+        .filter(_owned_by(user_id), Expense.in_period(year, month))
+        .group_by(Expense.main_category)
+        .all()
+    )
+    totals = {r.main_category: _amount(r.total) for r in rows}
+    _merge_archived(totals, _archived(user_id, year, month, "main_category"))
+    return {"labels": list(totals), "values": list(totals.values())}
 
-    return jsonify(data)
-    """Get expense data grouped by main category for current month."""
-    month = request.args.get("month", datetime.now().month, type=int)
-    year = request.args.get("year", datetime.now().year, type=int)
 
-    expenses = (
-        db.session.query(Expense.main_category, func.sum(Expense.amount).label("total"))
-        .filter(
-            Expense.user_id == current_user.id,
-            extract("month", Expense.date) == month,
-            extract("year", Expense.date) == year,
-        )
-        .group_by(Expense.main_category)
+def trend_columns(user_id, today=None):
+    """Monthly totals for the last 12 months, oldest first."""
+    end_date = today or datetime.now().date()
+    if isinstance(user_id, tuple):
+        return household.trend_columns(user_id, end_date)
+    start_date = end_date - timedelta(days=365)
+
+    # Grouped by expression: a bare "month" would name fx_rates.month
+    year = extract("year", Expense.date).label("year")
+    month = extract("month", Expense.date).label("month")
+    rows = (
+        db.session.query(year, month, _total())
+        .outerjoin(FxRate, rate_join())
+        .filter(_owned_by(user_id), Expense.date >= start_date)
+        .group_by(year, month)
         .all()
     )
+    totals = {(int(r.year), int(r.month)): _amount(r.total) for r in rows}
+    archived = _archived_between(user_id, start_date, None, ("year", "month"))
+    _merge_archived(totals, archived)
 
-    data = {
-        "labels": [e.main_category for e in expenses],
-        "datasets": [
-            {
-                "data": [float(e.total) for e in expenses],
-                "backgroundColor": [
-                    "#FF6384",
-                    "#36A2EB",
-                    "#FFCE56",
-                    "#4BC0C0",
-                    "#9966FF",
-                    "#FF9F40",
-                    "#FF6384",
-                    "#C9CBCF",
-                    "#4BC0C0",
-                    "#FF6384",
-                    "#36A2EB",
-                    "#FFCE56",
-                    "#FF9F40",
-                    "#9966FF",
-                    "#C9CBCF",
-                ],
-            }
-        ],
-    }
+    # Create labels and data for the last 12 months
+    labels = []
+    values = []
+    for i in range(12):
+        date = end_date - timedelta(days=30 * i)
+        labels.insert(0, f"{calendar.month_name[date.month][:3]} {date.year}")
+        values.insert(0, totals.get((date.year, date.month), 0))
+
+    return {"labels": labels, "values": values}
+
+
+def spending_columns(user_id, year, month):
+    """Daily totals for a month, or monthly totals when month is 0."""
+    if isinstance(user_id, tuple) and month == 0:
+        return household.monthly_columns(user_id, year)
+    bucket = "month" if month == 0 else "day"
+    rows = (
+        db.session.query(extract(bucket, Expense.date).label("bucket"), _total())
+        .outerjoin(FxRate, rate_join())
+        .filter(_owned_by(user_id), Expense.in_period(year, month))
+        .group_by("bucket")
+        .all()
+    )
 
-    return jsonify(data)
+    if month == 0:
+        labels = MONTH_LABELS
+    else:
+        labels = list(range(1, calendar.monthrange(year, month)[1] + 1))
 
+    values = [0] * len(labels)
+    for r in rows:
+        values[int(r.bucket) - 1] = _amount(r.total)
+    for (bucket_value,), (cents, _) in _archived(user_id, year, month, bucket).items():
+        values[bucket_value - 1] = round(values[bucket_value - 1] + cents / 100, 2)
 
-@analytics_bp.route("/api/monthly-trend")
-@login_required
-def monthly_trend():
-    """Get expense trend for the last 12 months."""
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)
+    return {"labels": labels, "values": values}
+
+
+def top_category_columns(user_id, year, limit=5):
+    """The year's highest-spending main categories."""
+    columns = category_columns(user_id, year, 0)
+    ranked = sorted(zip(columns["values"], columns["labels"]), reverse=True)[:limit]
+    return {"labels": [label for _, label in ranked], "values": [v for v, _ in ranked]}
 
-    expenses = (
+
+def payment_columns(user_id, year, month):
+    """Totals and transaction counts per payment method."""
+    rows = (
         db.session.query(
-            extract("year", Expense.date).label("year"),
-            extract("month", Expense.date).label("month"),
-            func.sum(Expense.amount).label("total"),
+            Expense.payment_method,
+            _total(),
+            func.count(Expense.id).label("count"),
         )
-        .filter(Expense.user_id == current_user.id, Expense.date >= start_date)
-        .group_by("year", "month")
-        .order_by("year", "month")
+        .outerjoin(FxRate, rate_join())
+        .filter(
+            _owned_by(user_id),
+            Expense.in_period(year, month),
+            Expense.payment_method.isnot(None),
+        )
+        .group_by(Expense.payment_method)
         .all()
     )
+    totals = {r.payment_method: _amount(r.total) for r in rows}
+    counts = {r.payment_method: r.count for r in rows}
+    archived = _archived(user_id, year, month, "payment_method")
+    archived.pop((None,), None)
+    _merge_archived(totals, archived, counts)
+    return {
+        "labels": list(totals),
+        "values": list(totals.values()),
+        "counts": [counts[method] for method in totals],
+    }
 
-    # Create labels and data for the last 12 months
-    labels = []
-    data = []
 
-    for i in range(12):
-        date = end_date - timedelta(days=30 * i)
-        month_name = calendar.month_name[date.month][:3]
-        year = date.year
-        labels.insert(0, f"{month_name} {year}")
-
-        # Find matching expense
-        total = 0
-        for e in expenses:
-            if e.year == year and e.month == date.month:
-                total = float(e.total)
-                break
-        data.insert(0, total)
+def report_totals(user_id, year, month):
+    """Totals and counts per (main category, payment method) for the PDF."""
+    rows = (
+        db.session.query(
+            Expense.main_category,
+            Expense.payment_method,
+            _total(),
+            func.count(Expense.id).label("count"),
+        )
+        .outerjoin(FxRate, rate_join())
+        .filter(_owned_by(user_id), Expense.in_period(year, month))
+        .group_by(Expense.main_category, Expense.payment_method)
+        .all()
+    )
+    totals = {
+        (r.main_category, r.payment_method): _amount(r.total) for r in rows
+    }
+    counts = {(r.main_category, r.payment_method): r.count for r in rows}
+    archived = _archived(user_id, year, month, "main_category", "payment_method")
+    _merge_archived(totals, archived, counts)
+    return totals, counts
+
+
+def top_expenses(user_id, year, month, limit=10):
+    """The period's largest expenses as (expense, amount in BASE_CURRENCY)."""
+    amount = converted_amount().label("converted")
+    rows = (
+        db.session.query(Expense, amount)
+        .outerjoin(FxRate, rate_join())
+        .filter(_owned_by(user_id), Expense.in_period(year, month))
+        .order_by(amount.desc())
+        .limit(limit)
+        .all()
+    )
+    top = [(expense, float(converted)) for expense, converted in rows]
+    top += archived_largest(user_id, *period_bounds(year, month), limit)
+    return sorted(top, key=lambda pair: pair[1], reverse=True)[:limit]
 
-    return jsonify(
-        {
-            "labels": labels,
-            "datasets": [
-                {
-                    "label": "Monthly Expenses",
-                    "data": data,
-                    "fill": False,
-                    "borderColor": "#36A2EB",
-                    "backgroundColor": "#36A2EB",
-                    "tension": 0.4,
-                }
-            ],
-        }
+
+def distribution_columns(user_id, year, month, buckets=distribution.DEFAULT_BUCKETS):
+    """Amount percentiles and histogram per main category; month 0 is the year.
+
+    PostgreSQL computes them in one grouped query. SQLite, and periods with
+    archived expenses, use NumPy over just the amounts.
+    """
+    where = (_owned_by(user_id), Expense.in_period(year, month))
+    archived = _archived_amounts(
+        user_id, *period_bounds(year, month), "main_category"
+    )
+    if not archived and db.engine.dialect.name == "postgresql":
+        return distribution.sql_distribution(db.session, where, buckets)
+    return distribution.numpy_distribution(db.session, where, buckets, archived)
+
+
+def drilldown_columns(user_id, year, month):
+    """Category and subcategory totals and counts as a tree, from one
+    ROLLUP query; month 0 means the whole year."""
+    where = (_owned_by(user_id), Expense.in_period(year, month))
+    return drilldown.drilldown_tree(
+        drilldown.level_rows(db.session, where),
+        _archived(user_id, year, month, "main_category", "subcategory"),
     )
 
 
-@analytics_bp.route("/api/category-breakdown")
+def drilldown_page(user_id, year, month, category, subcategory, before, limit):
+    """Up to ``limit`` of a subcategory's ``(expense, amount)`` pairs, newest
+    first, from the table and the archive."""
+    where = (
+        _owned_by(user_id),
+        Expense.in_period(year, month),
+        Expense.main_category == category,
+        Expense.subcategory == subcategory,
+    )
+    page = drilldown.transactions(db.session, where, before, limit)
+    filters = {"main_category": category, "subcategory": subcategory}
+    for member_id in user_id if isinstance(user_id, tuple) else (user_id,):
+        page += archived_page(
+            member_id, *period_bounds(year, month), filters, before, limit
+        )
+    page.sort(key=lambda pair: (pair[0].date, pair[0].id), reverse=True)
+    return page[:limit]
+
+
+def forecast_columns(user_id, today):
+    """This month's and year's spending so far and forecast per category."""
+    user_ids = user_id if isinstance(user_id, tuple) else (user_id,)
+    return forecast.forecast_columns(db.session, user_ids, today)
+
+
+def parse_range(start, end):
+    """Parse ISO ``start`` and ``end`` dates into an inclusive (start, end).
+
+    Raises ValueError for bad dates or a range that ends before it starts.
+    """
+    try:
+        start, end = date.fromisoformat(start), date.fromisoformat(end)
+    except (TypeError, ValueError) as e:
+        raise ValueError("start and end must be YYYY-MM-DD dates") from e
+    if end < start:
+        raise ValueError("end is before start")
+    return start, end
+
+
+def range_category_columns(user_id, start, end):
+    """Totals per main category for any [start, end] range, largest first.
+
+    Two lookups per category in the user's prefix-sum daily index.
+    """
+    user_ids = user_id if isinstance(user_id, tuple) else (user_id,)
+    total, totals = range_totals(db.session, user_ids, start, end)
+    labels = sorted(totals, key=totals.get, reverse=True)
+    return {
+        "labels": labels,
+        "values": [round(totals[label], 2) for label in labels],
+        "total": round(total, 2),
+    }
+
+
+def parse_periods(raw):
+    """Parse ``2024,2025`` or ``2024-03,2025-03`` into [(year, month)].
+
+    Month 0 means a whole year. Raises ValueError for bad input or when
+    years and months are mixed. Years stop at 9998: a period's bounds end
+    on the first day after it.
+    """
+    periods = []
+    for part in raw.split(","):
+        year, _, month = part.strip().partition("-")
+        period = (int(year), int(month) if month else 0)
+        if not 1 <= period[0] <= 9998 or not 0 <= period[1] <= 12:
+            raise ValueError(f"Invalid period: {part}")
+        periods.append(period)
+
+    if not 2 <= len(periods) <= MAX_COMPARE_PERIODS:
+        raise ValueError(f"Compare between 2 and {MAX_COMPARE_PERIODS} periods")
+    if len({month == 0 for _, month in periods}) > 1:
+        raise ValueError("Periods must all be years or all be months")
+    return periods
+
+
+def _changes(series):
+    """Deltas and percentage changes of each period against the one before it."""
+    deltas, pct_changes = [], []
+    for before, after in zip(series, series[1:]):
+        deltas.append([round(b - a, 2) for a, b in zip(before, after)])
+        pct_changes.append(
+            [round((b - a) / a * 100, 1) if a else None for a, b in zip(before, after)]
+        )
+    return deltas, pct_changes
+
+
+def compare_columns(user_id, periods):
+    """Per-category and per-month (or per-day) totals for several periods.
+
+    One scan: the WHERE clause covers every period's date range, and each
+    period becomes its own conditionally summed column.
+    """
+    yearly = periods[0][1] == 0
+    unit = "month" if yearly else "day"
+    bucket = extract(unit, Expense.date).label("bucket")
+    amount = converted_amount()
+    sums = [
+        cast(
+            func.sum(case((Expense.in_period(year, month), amount), else_=0)),
+            Float,
+        ).label(f"p{i}")
+        for i, (year, month) in enumerate(periods)
+    ]
+
+    rows = (
+        db.session.query(Expense.main_category, bucket, *sums)
+        .outerjoin(FxRate, rate_join())
+        .filter(
+            _owned_by(user_id),
+            or_(*(Expense.in_period(year, month) for year, month in periods)),
+        )
+        .group_by(Expense.main_category, "bucket")
+        .all()
+    )
+
+    bucket_labels = MONTH_LABELS if yearly else list(range(1, 32))
+    by_category = defaultdict(lambda: [0.0] * len(periods))
+    by_bucket = [[0.0] * len(bucket_labels) for _ in periods]
+    for row in rows:
+        for i in range(len(periods)):
+            value = row[2 + i] or 0.0
+            by_category[row.main_category][i] += value
+            by_bucket[i][int(row.bucket) - 1] += value
+    for i, (year, month) in enumerate(periods):
+        archived = _archived(user_id, year, month, "main_category", unit)
+        for (category, bucket_value), (cents, _) in archived.items():
+            by_category[category][i] += cents / 100
+            by_bucket[i][bucket_value - 1] += cents / 100
+
+    categories = sorted(by_category, key=lambda c: -by_category[c][-1])
+    category_series = [
+        [round(by_category[c][i], 2) for c in categories] for i in range(len(periods))
+    ]
+    bucket_series = [[round(v, 2) for v in series] for series in by_bucket]
+    totals = [round(sum(series), 2) for series in bucket_series]
+
+    category_deltas, category_pct = _changes(category_series)
+    bucket_deltas, bucket_pct = _changes(bucket_series)
+    total_deltas, total_pct = _changes([[t] for t in totals])
+
+    return {
+        "periods": [f"{y}" if not m else f"{y}-{m:02d}" for y, m in periods],
+        "totals": totals,
+        "total_deltas": [d[0] for d in total_deltas],
+        "total_pct_changes": [p[0] for p in total_pct],
+        "by_category": {
+            "labels": categories,
+            "values": category_series,
+            "deltas": category_deltas,
+            "pct_changes": category_pct,
+        },
+        "by_bucket": {
+            "unit": unit,
+            "labels": bucket_labels,
+            "values": bucket_series,
+            "deltas": bucket_deltas,
+            "pct_changes": bucket_pct,
+        },
+    }
+
+
+@analytics_bp.route("/api/expense-by-category")
 @login_required
-def category_breakdown():
-    """Get detailed breakdown by category and subcategory."""
+@rate_limit("analytics")
+@read_replica
+def expense_by_category():
+    """Get expense data grouped by main category for current month.
+
+    ``start`` and ``end`` (inclusive ISO dates) select any range instead.
+    """
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+    if "start" in request.args or "end" in request.args:
+        try:
+            start, end = parse_range(request.args.get("start"), request.args.get("end"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return chart_response("category", range_category_columns(owner, start, end))
     month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
 
-    # Build query
-    query = Expense.query.filter(
-        Expense.user_id == current_user.id, extract("year", Expense.date) == year
+    return chart_response(
+        "category",
+        cached_columns("category", category_columns, owner, year, month),
     )
 
-    # Add month filter only if not "All Year"
-    if month != 0:
-        query = query.filter(extract("month", Expense.date) == month)
-
-    expenses = query.all()
 
-    # Group by category and subcategory
-    breakdown = defaultdict(lambda: defaultdict(float))
-    for expense in expenses:
-        breakdown[expense.main_category][expense.subcategory] += float(expense.amount)
+@analytics_bp.route("/api/monthly-trend")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def monthly_trend():
+    """Get expense trend for the last 12 months."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+    return chart_response(
+        "trend",
+        cached_columns("trend", trend_columns, owner, datetime.now().date()),
+    )
 
-    # Format for treemap/sunburst
-    data = []
-    for main_cat, subcats in breakdown.items():
-        children = [{"name": sub, "value": amt} for sub, amt in subcats.items()]
-        data.append(
-            {"name": main_cat, "children": children, "value": sum(subcats.values())}
-        )
 
-    return jsonify(data)
+@analytics_bp.route("/api/category-breakdown")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def category_breakdown():
     """Get detailed breakdown by category and subcategory."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
     month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
 
-    expenses = Expense.query.filter(
-        Expense.user_id == current_user.id,
-        extract("month", Expense.date) == month,
-        extract("year", Expense.date) == year,
-    ).all()
-
-    # Group by category and subcategory
-    breakdown = defaultdict(lambda: defaultdict(float))
-    for expense in expenses:
-        breakdown[expense.main_category][expense.subcategory] += float(expense.amount)
-
     # Format for treemap/sunburst
-    data = []
-    for main_cat, subcats in breakdown.items():
-        children = [{"name": sub, "value": amt} for sub, amt in subcats.items()]
-        data.append(
-            {"name": main_cat, "children": children, "value": sum(subcats.values())}
-        )
-
-    return jsonify(data)
+    tree = cached_columns("drilldown", drilldown_columns, owner, year, month)
+    return jsonify(tree["children"])
 
 
 @analytics_bp.route("/api/daily-spending")
 @login_required
+@rate_limit("analytics")
+@read_replica
 def daily_spending():
     """Get daily spending for current month or monthly spending for full year."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
     month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
 
     # For "All Year", show monthly totals instead of daily
-    if month == 0:
-        expenses = (
-            db.session.query(
-                extract("month", Expense.date).label("month"),
-                func.sum(Expense.amount).label("total"),
-            )
-            .filter(
-                Expense.user_id == current_user.id,
-                extract("year", Expense.date) == year,
-            )
-            .group_by("month")
-            .order_by("month")
-            .all()
-        )
+    style = "monthly" if month == 0 else "daily"
+    return chart_response(
+        style,
+        cached_columns("spending", spending_columns, owner, year, month),
+    )
 
-        # Create data for all 12 months
-        monthly_data = [0] * 12
-        month_names = [
-            "Jan",
-            "Feb",
-            "Mar",
-            "Apr",
-            "May",
-            "Jun",
-            "Jul",
-            "Aug",
-            "Sep",
-            "Oct",
-            "Nov",
-            "Dec",
-        ]
-
-        for expense in expenses:
-            monthly_data[expense.month - 1] = float(expense.total)
-
-        return jsonify(
-            {
-                "labels": month_names,
-                "datasets": [
-                    {
-                        "label": "Monthly Spending",
-                        "data": monthly_data,
-                        "backgroundColor": "#4BC0C0",
-                        "borderColor": "#4BC0C0",
-                        "borderWidth": 1,
-                    }
-                ],
-            }
-        )
-    else:
-        # Original daily view for specific month
-        expenses = (
-            db.session.query(
-                extract("day", Expense.date).label("day"),
-                func.sum(Expense.amount).label("total"),
-            )
-            .filter(
-                Expense.user_id == current_user.id,
-                extract("month", Expense.date) == month,
-                extract("year", Expense.date) == year,
-            )
-            .group_by("day")
-            .order_by("day")
-            .all()
-        )
 
-        # Create data for all days in month
-        days_in_month = calendar.monthrange(year, month)[1]
-        daily_data = [0] * days_in_month
-
-        for expense in expenses:
-            daily_data[expense.day - 1] = float(expense.total)
-
-        return jsonify(
-            {
-                "labels": list(range(1, days_in_month + 1)),
-                "datasets": [
-                    {
-                        "label": "Daily Spending",
-                        "data": daily_data,
-                        "backgroundColor": "#4BC0C0",
-                        "borderColor": "#4BC0C0",
-                        "borderWidth": 1,
-                    }
-                ],
-            }
+@analytics_bp.route("/api/top-categories")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def top_categories():
+    """Get top 5 spending categories for the year, or a ``start``-``end`` range."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+    if "start" in request.args or "end" in request.args:
+        try:
+            start, end = parse_range(request.args.get("start"), request.args.get("end"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        columns = range_category_columns(owner, start, end)
+        return chart_response(
+            "top", {"labels": columns["labels"][:5], "values": columns["values"][:5]}
         )
-    """Get daily spending for current month."""
-    month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
 
-    expenses = (
-        db.session.query(
-            extract("day", Expense.date).label("day"),
-            func.sum(Expense.amount).label("total"),
-        )
-        .filter(
-            Expense.user_id == current_user.id,
-            extract("month", Expense.date) == month,
-            extract("year", Expense.date) == year,
-        )
-        .group_by("day")
-        .order_by("day")
-        .all()
+    return chart_response(
+        "top", cached_columns("top", top_category_columns, owner, year)
     )
 
-    # Create data for all days in month
-    days_in_month = calendar.monthrange(year, month)[1]
-    daily_data = [0] * days_in_month
 
-    for expense in expenses:
-        daily_data[expense.day - 1] = float(expense.total)
+@analytics_bp.route("/api/payment-methods")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def payment_methods():
+    """Get expense breakdown by payment method."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+    month = request.args.get("month", datetime.now().month, type=int)
+    year = request.args.get("year", datetime.now().year, type=int)
 
-    return jsonify(
-        {
-            "labels": list(range(1, days_in_month + 1)),
-            "datasets": [
-                {
-                    "label": "Daily Spending",
-                    "data": daily_data,
-                    "backgroundColor": "#4BC0C0",
-                    "borderColor": "#4BC0C0",
-                    "borderWidth": 1,
-                }
-            ],
-        }
+    return chart_response(
+        "payment",
+        cached_columns("payment", payment_columns, owner, year, month),
     )
 
 
-@analytics_bp.route("/api/top-categories")
+@analytics_bp.route("/api/compare")
 @login_required
-def top_categories():
-    """Get top 5 spending categories for the year."""
+@rate_limit("analytics")
+@read_replica
+def compare():
+    """Compare spending across periods, e.g. ``?periods=2024,2025``.
+
+    Deltas and percentage changes are against the previous period in the list.
+    """
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+    try:
+        periods = parse_periods(request.args.get("periods", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(compare_columns(owner, periods))
+
+
+@analytics_bp.route("/api/distribution")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def expense_distribution():
+    """Median, p75, p90, p99, min, max and a histogram per category."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+    month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
+    buckets = request.args.get("buckets", distribution.DEFAULT_BUCKETS, type=int)
+    buckets = min(max(buckets, 1), distribution.MAX_BUCKETS)
 
-    expenses = (
-        db.session.query(Expense.main_category, func.sum(Expense.amount).label("total"))
-        .filter(
-            Expense.user_id == current_user.id, extract("year", Expense.date) == year
+    return jsonify(
+        cached_columns(
+            "distribution", distribution_columns, owner, year, month, buckets
         )
-        .group_by(Expense.main_category)
-        .order_by(func.sum(Expense.amount).desc())
-        .limit(5)
-        .all()
     )
 
+
+@analytics_bp.route("/api/forecast")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def spending_forecast():
+    """Where this month's and this year's spending is heading at this pace."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
+
     return jsonify(
-        {
-            "labels": [e.main_category for e in expenses],
-            "datasets": [
-                {
-                    "label": "Total Spent",
-                    "data": [float(e.total) for e in expenses],
-                    "backgroundColor": [
-                        "#FF6384",
-                        "#36A2EB",
-                        "#FFCE56",
-                        "#4BC0C0",
-                        "#9966FF",
-                    ],
-                }
-            ],
-        }
+        cached_columns("forecast", forecast_columns, owner, datetime.now().date())
     )
 
 
-@analytics_bp.route("/api/payment-methods")
+@analytics_bp.route("/api/drilldown")
 @login_required
-def payment_methods():
-    """Get expense breakdown by payment method."""
+@rate_limit("analytics")
+@read_replica
+def drilldown_levels():
+    """Main categories and their subcategories, with totals and counts.
+
+    Transactions are left out; fetch them a page at a time from
+    ``/api/drilldown/transactions`` when a subcategory is opened.
+    """
+    owner = _scope()
+    if owner is None:
+        return _no_household()
     month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
 
-    # Build query
-    query = db.session.query(
-        Expense.payment_method,
-        func.sum(Expense.amount).label("total"),
-        func.count(Expense.id).label("count"),
-    ).filter(
-        Expense.user_id == current_user.id,
-        extract("year", Expense.date) == year,
-        Expense.payment_method.isnot(None),
-    )
+    return jsonify(cached_columns("drilldown", drilldown_columns, owner, year, month))
 
-    # Add month filter only if not "All Year"
-    if month != 0:
-        query = query.filter(extract("month", Expense.date) == month)
 
-    expenses = query.group_by(Expense.payment_method).all()
+# Expense fields listed when drilling into a subcategory
+TRANSACTION_FIELDS = ("name", "amount", "currency", "date", "payment_method")
 
-    return jsonify(
-        {
-            "labels": [e.payment_method for e in expenses],
-            "datasets": [
-                {
-                    "label": "Amount by Payment Method",
-                    "data": [float(e.total) for e in expenses],
-                    "backgroundColor": [
-                        "#FF9F40",
-                        "#FF6384",
-                        "#C9CBCF",
-                        "#4BC0C0",
-                        "#36A2EB",
-                    ],
-                }
-            ],
-            "counts": [e.count for e in expenses],
-        }
-    )
-    """Get expense breakdown by payment method."""
+
+@analytics_bp.route("/api/drilldown/transactions")
+@login_required
+@rate_limit("analytics")
+@read_replica
+def drilldown_transactions():
+    """One subcategory's expenses newest first, ``limit`` at a time."""
+    owner = _scope()
+    if owner is None:
+        return _no_household()
     month = request.args.get("month", datetime.now().month, type=int)
     year = request.args.get("year", datetime.now().year, type=int)
-
-    expenses = (
-        db.session.query(
-            Expense.payment_method,
-            func.sum(Expense.amount).label("total"),
-            func.count(Expense.id).label("count"),
-        )
-        .filter(
-            Expense.user_id == current_user.id,
-            extract("month", Expense.date) == month,
-            extract("year", Expense.date) == year,
-            Expense.payment_method.isnot(None),
-        )
-        .group_by(Expense.payment_method)
-        .all()
+    category = request.args.get("category")
+    subcategory = request.args.get("subcategory")
+    if not category or not subcategory:
+        return jsonify({"error": "category and subcategory are required"}), 400
+    limit = request.args.get("limit", drilldown.PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), drilldown.MAX_PAGE_SIZE)
+    before = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    pairs = drilldown_page(
+        owner, year, month, category, subcategory, before, limit + 1
     )
+    page = pairs[:limit]
+    next_cursor = None
+    if len(pairs) > limit:
+        next_cursor = encode_cursor(page[-1][0].date, page[-1][0].id)
 
     return jsonify(
         {
-            "labels": [e.payment_method for e in expenses],
-            "datasets": [
-                {
-                    "label": "Amount by Payment Method",
-                    "data": [float(e.total) for e in expenses],
-                    "backgroundColor": [
-                        "#FF9F40",
-                        "#FF6384",
-                        "#C9CBCF",
-                        "#4BC0C0",
-                        "#36A2EB",
-                    ],
-                }
+            "items": [
+                dict(serialize_expense(e, TRANSACTION_FIELDS), converted=round(a, 2))
+                for e, a in page
             ],
-            "counts": [e.count for e in expenses],
+            "next_cursor": next_cursor,
         }
     )
 
 
-# Don't forget to import db
-from extensions import db
+@analytics_bp.route("/api/platform")
+@login_required
+@read_replica
+def platform():
+    """Platform-wide spend, active users and growth from the latest nightly
+    ``flask platform-stats`` run. Only for ADMIN_USERNAMES."""
+    if current_user.username not in current_app.config["ADMIN_USERNAMES"]:
+        abort(404)
+    months = request.args.get("months", 12, type=int)
+
+    columns = platform_stats.platform_columns(db.session, max(months, 0))
+    if columns is None:
+        return jsonify({"error": "No stats yet; run flask platform-stats"}), 404
+    return jsonify(columns)
 
 
 @analytics_bp.route("/export/pdf")
 @login_required
+@rate_limit("export", heavy=True)
+@read_replica
 def export_pdf():
     """Export analytics report as PDF."""
     month = request.args.get("month", datetime.now().month, type=int)
@@ -561,19 +879,12 @@ def export_pdf():
     )
     elements.append(Spacer(1, 0.5 * inch))
 
-    # Get expense data
-    query = Expense.query.filter(
-        Expense.user_id == current_user.id, extract("year", Expense.date) == year
-    )
-
-    if month != 0:
-        query = query.filter(extract("month", Expense.date) == month)
-
-    expenses = query.all()
+    # Totals by category and payment method, including any moved to the archive
+    totals, counts = report_totals(current_user.id, year, month)
 
     # Calculate summary statistics
-    total_expenses = sum(expense.amount for expense in expenses)
-    transaction_count = len(expenses)
+    total_expenses = sum(totals.values())
+    transaction_count = sum(counts.values())
 
     # Summary section
     elements.append(Paragraph("Executive Summary", heading_style))
@@ -613,10 +924,10 @@ def export_pdf():
     # Category breakdown
     elements.append(Paragraph("Expense Breakdown by Category", heading_style))
 
-    # Group expenses by category
+    # Group totals by category
     category_totals = defaultdict(float)
-    for expense in expenses:
-        category_totals[expense.main_category] += float(expense.amount)
+    for (category, _), amount in totals.items():
+        category_totals[category] += amount
 
     # Sort categories by total amount
     sorted_categories = sorted(
@@ -657,17 +968,14 @@ def export_pdf():
     # Top expenses
     elements.append(Paragraph("Top 10 Expenses", heading_style))
 
-    # Sort expenses by amount
-    sorted_expenses = sorted(expenses, key=lambda x: x.amount, reverse=True)[:10]
-
     expense_data = [["Date", "Name", "Category", "Amount"]]
-    for expense in sorted_expenses:
+    for expense, amount in top_expenses(current_user.id, year, month):
         expense_data.append(
             [
                 expense.date.strftime("%m/%d/%Y"),
                 expense.name[:30] + "..." if len(expense.name) > 30 else expense.name,
                 expense.main_category,
-                f"${expense.amount:,.2f}",
+                f"${amount:,.2f}",
             ]
         )
 
@@ -693,19 +1001,22 @@ def export_pdf():
     elements.append(Spacer(1, 0.5 * inch))
 
     # Payment methods breakdown
-    if any(e.payment_method for e in expenses):
+    payment_totals = defaultdict(float)
+    payment_counts = defaultdict(int)
+    for key, amount in totals.items():
+        method = key[1]
+        if method:
+            payment_totals[method] += amount
+            payment_counts[method] += counts[key]
+
+    if payment_totals:
         elements.append(Paragraph("Payment Methods", heading_style))
 
-        payment_totals = defaultdict(float)
-        for expense in expenses:
-            if expense.payment_method:
-                payment_totals[expense.payment_method] += float(expense.amount)
-
         payment_data = [["Payment Method", "Amount", "Count"]]
         for method, amount in sorted(
             payment_totals.items(), key=lambda x: x[1], reverse=True
         ):
-            count = sum(1 for e in expenses if e.payment_method == method)
+            count = payment_counts[method]
             payment_data.append([method, f"${amount:,.2f}", str(count)])
 
         payment_table = Table(
@@ -728,6 +1039,11 @@ def export_pdf():
 
         elements.append(payment_table)
 
+    # Annual reports add the trend and a charted section per month
+    if month == 0:
+        elements.append(PageBreak())
+        elements.extend(annual_sections(current_user.id, year, styles, heading_style))
+
     # Build PDF
     doc.build(elements)
 
@@ -0,0 +1,85 @@
+import base64
+from datetime import date, datetime
+import uuid
+
+# Columns a client may read; ``id`` is always included
+EXPENSE_FIELDS = (
+    "name",
+    "amount",
+    "currency",
+    "main_category",
+    "subcategory",
+    "date",
+    "payment_method",
+    "description",
+    "updated_at",
+)
+
+
+def serialize_expense(expense, fields=EXPENSE_FIELDS):
+    """Compact JSON-ready dict for an expense; empty values are omitted.
+
+    Amounts are strings so clients keep exact cents.
+    """
+    data = {"id": str(expense.id)}
+    for field in fields:
+        value = getattr(expense, field)
+        if value is None or value == "":
+            continue
+        if field == "amount":
+            value = str(value)
+        elif field in ("date", "updated_at"):
+            value = value.isoformat()
+        data[field] = value
+    return data
+
+
+def encode_cursor(expense_date, expense_id):
+    """Opaque paging cursor for a (date, id) position."""
+    raw = f"{expense_date.isoformat()}|{expense_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from :func:`encode_cursor`; raises ValueError if invalid."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        raw_date, raw_id = base64.urlsafe_b64decode(padded).decode().split("|")
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    return date.fromisoformat(raw_date), uuid.UUID(raw_id)
+
+
+def encode_sync_cursor(changed, deleted, archived=None):
+    """Opaque sync cursor for the last change and last deletion seen.
+
+    Each position is a (timestamp, id) pair or None. ``archived``, a
+    (date, id) pair, is the archive position a first sync continues from.
+    """
+    parts = []
+    for position in (changed, deleted):
+        parts += [position[0].isoformat(), str(position[1])] if position else ["", ""]
+    if archived:
+        parts += [archived[0].isoformat(), str(archived[1])]
+    raw = "|".join(parts).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_sync_cursor(cursor):
+    """Decode a cursor from :func:`encode_sync_cursor` into ``(changed,
+    deleted, archived)``; raises ValueError if invalid."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        parts = base64.urlsafe_b64decode(padded).decode().split("|")
+        if len(parts) not in (4, 6):
+            raise ValueError("Invalid cursor")
+        positions = [
+            (datetime.fromisoformat(at), uuid.UUID(row_id)) if at else None
+            for at, row_id in (parts[:2], parts[2:4])
+        ]
+        archived = None
+        if len(parts) == 6:
+            archived = (date.fromisoformat(parts[4]), uuid.UUID(parts[5]))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    return positions[0], positions[1], archived
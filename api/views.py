@@ -0,0 +1,303 @@
+from functools import wraps
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import and_, or_
+from werkzeug.datastructures import MultiDict
+from extensions import db
+from database import read_replica
+from models import Expense
+from expenses.forms import ExpenseForm
+from expenses.bulk import delete_expenses
+from expenses.sync import archived_changes, changes_since, first_sync_positions
+from constants.categories import validate_category
+from .serializers import (
+    decode_cursor,
+    decode_sync_cursor,
+    encode_cursor,
+    encode_sync_cursor,
+    serialize_expense,
+)
+from datetime import date, datetime, timedelta, timezone
+import uuid
+
+api_bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+# Page size limits for listing
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Most create + update + delete items accepted by one batch call
+MAX_BATCH_ITEMS = 1000
+
+# Writable expense fields, in ExpenseForm terms
+WRITABLE_FIELDS = (
+    "name",
+    "amount",
+    "currency",
+    "main_category",
+    "subcategory",
+    "date",
+    "payment_method",
+    "description",
+)
+
+
+def api_error(message, status):
+    return jsonify({"error": message}), status
+
+
+def api_login_required(view):
+    """Like ``login_required`` but answers 401 JSON instead of redirecting."""
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return api_error("Authentication required.", 401)
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def _validate_item(item, expense=None):
+    """Validate one create/update item with the same rules as the HTML form.
+
+    For updates, fields missing from ``item`` keep the expense's current
+    values. Returns ``(values, errors)``.
+    """
+    if not isinstance(item, dict):
+        return None, {"item": ["Must be an object."]}
+
+    merged = {}
+    for field in WRITABLE_FIELDS:
+        value = item.get(field, getattr(expense, field, None))
+        if value is not None:
+            merged[field] = str(value)
+
+    form = ExpenseForm(formdata=MultiDict(merged), meta={"csrf": False})
+    if not form.validate():
+        errors = {k: v for k, v in form.errors.items() if k != "submit"}
+        if errors:
+            return None, errors
+    if not validate_category(form.main_category.data, form.subcategory.data):
+        return None, {"subcategory": ["Invalid category selection."]}
+
+    return {
+        "name": form.name.data,
+        "amount": form.amount.data,
+        "currency": form.currency.data,
+        "main_category": form.main_category.data,
+        "subcategory": form.subcategory.data,
+        "date": form.date.data,
+        "payment_method": form.payment_method.data or None,
+        "description": form.description.data or None,
+    }, None
+
+
+def _parse_id(raw_id):
+    try:
+        return uuid.UUID(str(raw_id))
+    except ValueError:
+        return None
+
+
+@api_bp.route("/expenses")
+@api_login_required
+@read_replica
+def list_expenses():
+    """List expenses newest first, ``limit`` at a time, resumable by cursor."""
+    limit = min(
+        max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE
+    )
+    query = Expense.query.filter(Expense.user_id == current_user.id)
+
+    start = request.args.get("start")
+    end = request.args.get("end")
+    category = request.args.get("category")
+    try:
+        if start:
+            query = query.filter(Expense.date >= date.fromisoformat(start))
+        if end:
+            query = query.filter(Expense.date <= date.fromisoformat(end))
+    except ValueError:
+        return api_error("Invalid date.", 400)
+    try:
+        cursor = request.args.get("cursor")
+        if cursor:
+            cursor_date, cursor_id = decode_cursor(cursor)
+            query = query.filter(
+                or_(
+                    Expense.date < cursor_date,
+                    and_(Expense.date == cursor_date, Expense.id < cursor_id),
+                )
+            )
+    except ValueError:
+        return api_error("Invalid cursor.", 400)
+    if category:
+        query = query.filter(Expense.main_category == category)
+
+    expenses = query.order_by(Expense.date.desc(), Expense.id.desc()).limit(limit + 1).all()
+
+    page = expenses[:limit]
+    next_cursor = None
+    if len(expenses) > limit:
+        next_cursor = encode_cursor(page[-1].date, page[-1].id)
+
+    return jsonify(
+        {"items": [serialize_expense(e) for e in page], "next_cursor": next_cursor}
+    )
+
+
+@api_bp.route("/expenses/<uuid:expense_id>")
+@api_login_required
+@read_replica
+def get_expense(expense_id):
+    """Get a single expense."""
+    expense = Expense.query.filter_by(id=expense_id, user_id=current_user.id).first()
+    if expense is None:
+        return api_error("Expense not found.", 404)
+    return jsonify(serialize_expense(expense))
+
+
+@api_bp.route("/sync")
+@api_login_required
+def sync():
+    """Expenses changed and deleted since ``cursor``, oldest first.
+
+    Without a cursor, returns every expense and no deletions: the live
+    ones first, then the archived ones, newest first. Keep calling with the
+    returned ``cursor`` while ``has_more`` is true, then save it for the
+    next sync. Reads the primary: rows a lagging replica hasn't received
+    yet would be skipped for good.
+    """
+    limit = min(
+        max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE
+    )
+    until = datetime.now(timezone.utc) - timedelta(
+        seconds=current_app.config["SYNC_LAG_SECONDS"]
+    )
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            changed_after, deleted_after, archived = decode_sync_cursor(cursor)
+        except ValueError:
+            return api_error("Invalid cursor.", 400)
+    else:
+        changed_after, deleted_after, archived = first_sync_positions(until)
+
+    expenses, tombstones, has_more = changes_since(
+        db.session, current_user.id, changed_after, deleted_after, until, limit
+    )
+    if expenses:
+        changed_after = (expenses[-1].updated_at, expenses[-1].id)
+    if tombstones:
+        deleted_after = (tombstones[-1].deleted_at, tombstones[-1].expense_id)
+    # Archived expenses come last, so rows archived during a first sync
+    # are still found there
+    changed = expenses
+    if archived and not has_more:
+        archived_expenses, archived = archived_changes(
+            db.session, current_user.id, archived, limit
+        )
+        changed = expenses + archived_expenses
+        has_more = archived is not None
+
+    return jsonify(
+        {
+            "changed": [serialize_expense(e) for e in changed],
+            "deleted": [str(t.expense_id) for t in tombstones],
+            "cursor": encode_sync_cursor(changed_after, deleted_after, archived),
+            "has_more": has_more,
+        }
+    )
+
+
+@api_bp.route("/expenses/batch", methods=["POST"])
+@api_login_required
+def batch_expenses():
+    """Create, update and delete many expenses in one transaction.
+
+    Body: ``{"create": [...], "update": [{"id": ..., ...}], "delete": [ids],
+    "atomic": false}``. Invalid items are reported per index and skipped;
+    with ``atomic`` set, any invalid item rejects the whole batch.
+    """
+    if not request.is_json:
+        return api_error("Expected a JSON body.", 415)
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_error("Invalid JSON body.", 400)
+
+    creates = payload.get("create") or []
+    updates = payload.get("update") or []
+    deletes = payload.get("delete") or []
+    if not all(isinstance(items, list) for items in (creates, updates, deletes)):
+        return api_error("create, update and delete must be lists.", 400)
+    if len(creates) + len(updates) + len(deletes) > MAX_BATCH_ITEMS:
+        return api_error(f"At most {MAX_BATCH_ITEMS} items per batch.", 413)
+
+    results = {"create": [], "update": [], "delete": []}
+    failed = False
+
+    new_expenses = []
+    for index, item in enumerate(creates):
+        values, errors = _validate_item(item)
+        if errors:
+            failed = True
+            results["create"].append({"i": index, "errors": errors})
+            continue
+        expense = Expense(id=uuid.uuid4(), user_id=current_user.id, **values)
+        new_expenses.append(expense)
+        results["create"].append({"i": index, "id": str(expense.id)})
+
+    # Load every expense being updated with one query
+    update_ids = [_parse_id(item.get("id")) if isinstance(item, dict) else None for item in updates]
+    existing = {}
+    wanted = [expense_id for expense_id in update_ids if expense_id]
+    if wanted:
+        existing = {
+            e.id: e
+            for e in Expense.query.filter(
+                Expense.user_id == current_user.id, Expense.id.in_(wanted)
+            )
+        }
+
+    changes = []
+    for index, (item, expense_id) in enumerate(zip(updates, update_ids)):
+        expense = existing.get(expense_id)
+        if expense is None:
+            failed = True
+            results["update"].append({"i": index, "errors": {"id": ["Expense not found."]}})
+            continue
+        values, errors = _validate_item(item, expense)
+        if errors:
+            failed = True
+            results["update"].append({"i": index, "errors": errors})
+            continue
+        changes.append((expense, values))
+        results["update"].append({"i": index, "id": str(expense.id)})
+
+    delete_ids = [_parse_id(raw_id) for raw_id in deletes]
+    for index, expense_id in enumerate(delete_ids):
+        if expense_id is None:
+            failed = True
+            results["delete"].append({"i": index, "errors": {"id": ["Invalid id."]}})
+
+    if failed and payload.get("atomic"):
+        return jsonify(dict(results, applied=False)), 422
+
+    try:
+        db.session.add_all(new_expenses)
+        for expense, values in changes:
+            for field, value in values.items():
+                setattr(expense, field, value)
+        results["deleted"] = delete_expenses(
+            current_user.id, [expense_id for expense_id in delete_ids if expense_id]
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error applying expense batch: {e}")
+        return api_error("An error occurred while saving the batch.", 500)
+
+    return jsonify(dict(results, applied=True))
@@ -1,9 +1,22 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 from flask import Flask, render_template
 from flask_moment import Moment
 from flask_login import LoginManager, login_required, current_user
 from extensions import db
-from models import User
+from models import User, EXPENSES_PARTITION_BY
+from database import (
+    READ_REPLICA_BIND,
+    ensure_expense_partitions,
+    init_pool_metrics,
+    init_read_replica,
+    postgres_engine_options,
+)
+from metrics import metrics_bp
+from responses import init_compression, init_json
+from commands import register_commands
+from analytics.cache import init_analytics_cache
+from auth.hashing import init_password_hashing
+from ratelimit import init_rate_limits
 import sys
 import os
 import logging
@@ -25,24 +38,33 @@ if database_url:
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
     logger.info("🐘 Using external PostgreSQL database")
 
-    # Add connection reliability settings
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_pre_ping": True,
-        "pool_recycle": 300,
-        "connect_args": {
-            "sslmode": "require",
-            "connect_timeout": 10,
-            "options": "-c statement_timeout=30000", # 30 seconds query timeout
-        },
-        "pool_size": 5,  # Handle sleeping database
-        "max_overflow": 10,  # Handle sleeping database
-        "pool_timeout": 30,  # Max time to wait for a connection
-    }
+    # Connection reliability and pool settings (see DB_POOL_MODE)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = postgres_engine_options(database_url)
 else:
     # Fallback to SQLite for development
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///project.db"
     logger.info("🗃️ Using SQLite database (development)")
 
+# Optional read replica for heavy GET routes (analytics, expense listing)
+read_database_url = os.environ.get("DATABASE_READ_URL")
+if read_database_url:
+    if read_database_url.startswith("postgres://"):
+        read_database_url = read_database_url.replace("postgres://", "postgresql://", 1)
+
+    replica_options = {"url": read_database_url}
+    if read_database_url.startswith("postgresql"):
+        # Its own pool with the same reliability settings, opened read-only
+        replica_options.update(postgres_engine_options(read_database_url))
+        replica_options["execution_options"] = {"postgresql_readonly": True}
+
+    app.config["SQLALCHEMY_BINDS"] = {READ_REPLICA_BIND: replica_options}
+    logger.info("📖 Routing analytics reads to the read replica")
+
+# Seconds a client keeps reading from the primary after it writes
+app.config["READ_YOUR_WRITES_SECONDS"] = int(
+    os.environ.get("READ_YOUR_WRITES_SECONDS", 10)
+)
+
 # Configuration
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY") or "dev-fallback-key"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
@@ -50,10 +72,75 @@ app.config["REMEMBER_COOKIE_DURATION"] = timedelta(days=30)
 app.config["REMEMBER_COOKIE_SECURE"] = False
 app.config["REMEMBER_COOKIE_HTTPONLY"] = True
 app.config["REMEMBER_COOKIE_SAMESITE"] = "Lax"
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+# Usernames allowed to view platform-wide stats, comma-separated
+app.config["ADMIN_USERNAMES"] = {
+    name.strip()
+    for name in os.environ.get("ADMIN_USERNAMES", "").split(",")
+    if name.strip()
+}
+
+# Password hashing: scheme (scrypt, pbkdf2_sha256 or bcrypt), its cost and the
+# bounded pool hashes run on (thread or process)
+app.config["PASSWORD_HASHER"] = os.environ.get("PASSWORD_HASHER", "scrypt")
+if os.environ.get("PASSWORD_HASH_COST"):
+    app.config["PASSWORD_HASH_COST"] = int(os.environ["PASSWORD_HASH_COST"])
+app.config["PASSWORD_HASH_POOL"] = os.environ.get("PASSWORD_HASH_POOL", "thread")
+if os.environ.get("PASSWORD_HASH_WORKERS"):
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.environ["PASSWORD_HASH_WORKERS"])
+if os.environ.get("PASSWORD_HASH_MAX_QUEUE"):
+    app.config["PASSWORD_HASH_MAX_QUEUE"] = int(os.environ["PASSWORD_HASH_MAX_QUEUE"])
+
+# Annual PDF reports: chart PNG cache and the processes that render charts
+app.config["CHART_CACHE_DIR"] = os.environ.get("CHART_CACHE_DIR") or os.path.join(
+    app.instance_path, "chart_cache"
+)
+app.config["REPORT_RENDER_WORKERS"] = int(os.environ.get("REPORT_RENDER_WORKERS", 2))
+
+# Per-user rate limits ("<tokens per second>,<burst>" per route class), shared
+# through Redis when RATE_LIMIT_REDIS_URL is set
+app.config["RATE_LIMIT_ENABLED"] = os.environ.get("RATE_LIMIT_ENABLED", "1") != "0"
+app.config["RATE_LIMIT_REDIS_URL"] = os.environ.get("RATE_LIMIT_REDIS_URL")
+app.config["RATE_LIMIT_HEAVY_CONCURRENCY"] = int(
+    os.environ.get("RATE_LIMIT_HEAVY_CONCURRENCY", 2)
+)
+app.config["RATE_LIMITS"] = {
+    route_class: (float(rate), int(burst))
+    for route_class in ("analytics", "export", "bulk")
+    if os.environ.get(f"RATE_LIMIT_{route_class.upper()}")
+    for rate, burst in [os.environ[f"RATE_LIMIT_{route_class.upper()}"].split(",")]
+}
+
+# Where archive-expenses writes per-user columnar archives
+app.config["ARCHIVE_DIR"] = os.environ.get("ARCHIVE_DIR") or os.path.join(
+    app.instance_path, "archive"
+)
+
+# Days a soft-deleted account is kept before purge-deleted-accounts removes it
+app.config["PURGE_GRACE_DAYS"] = int(os.environ.get("PURGE_GRACE_DAYS", 30))
+
+# Changes younger than this many seconds wait for the next /api/v1/sync call
+app.config["SYNC_LAG_SECONDS"] = int(os.environ.get("SYNC_LAG_SECONDS", 5))
+
+# Background warm-up of the analytics cache after login
+app.config["ANALYTICS_WARMUP"] = os.environ.get("ANALYTICS_WARMUP", "1") != "0"
+app.config["ANALYTICS_WARMUP_WORKERS"] = int(
+    os.environ.get("ANALYTICS_WARMUP_WORKERS", 2)
+)
+app.config["ANALYTICS_WARMUP_MAX_PENDING"] = int(
+    os.environ.get("ANALYTICS_WARMUP_MAX_PENDING", 16)
+)
 
 # Initialize extensions
 moment = Moment(app)
+init_json(app)
+init_compression(app)
 db.init_app(app)
+init_read_replica(app, db)
+init_pool_metrics(app, db)
+init_analytics_cache(app)
+init_password_hashing(app)
+init_rate_limits(app)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -79,11 +166,16 @@ from auth.views import auth_bp
 from user.views import user_bp
 from expenses.views import expenses_bp
 from analytics.views import analytics_bp
+from api.views import api_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(user_bp)
 app.register_blueprint(expenses_bp)
 app.register_blueprint(analytics_bp)
+app.register_blueprint(api_bp)
+app.register_blueprint(metrics_bp)
+
+register_commands(app)
 
 
 # Test database connection and create tables
@@ -100,6 +192,10 @@ def test_db_connection():
             db.create_all()
             logger.info("✅ Database tables ready")
 
+            # Make sure current and upcoming expense partitions exist
+            if EXPENSES_PARTITION_BY:
+                ensure_expense_partitions(db.engine, EXPENSES_PARTITION_BY)
+
             # Log user count for verification
             user_count = User.query.count()
             logger.info(f"📊 Current users in database: {user_count}")
@@ -140,29 +236,12 @@ def index():
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    from sqlalchemy import extract, func
-    from models import Expense
-
-    now = datetime.now()
-    current_month = now.month
-    current_year = now.year
-
-    monthly_expenses = Expense.query.filter(
-        Expense.user_id == current_user.id,
-        extract("month", Expense.date) == current_month,
-        extract("year", Expense.date) == current_year,
-    ).all()
+    from expenses.rollups import monthly_summary
 
-    total_amount = sum(expense.amount for expense in monthly_expenses)
-    transaction_count = len(monthly_expenses)
-    average_expense = total_amount / transaction_count if transaction_count > 0 else 0
+    # Month-to-date stats come from the rollups, not from every expense row
+    summary = monthly_summary(db.session, current_user.id)
 
-    return render_template(
-        "dashboard.html",
-        total_amount=total_amount,
-        transaction_count=transaction_count,
-        average_expense=average_expense,
-    )
+    return render_template("dashboard.html", **summary)
 
 
 @app.route("/terms")
@@ -175,6 +254,7 @@ def privacy():
     return render_template("privacy.html")
 
 
+# Development server; production runs gunicorn -c gunicorn.conf.py app:app
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
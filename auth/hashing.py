@@ -0,0 +1,271 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask import current_app
+from metrics import register_metrics
+
+try:
+    import bcrypt
+except ImportError:  # optional, scrypt and pbkdf2 come with the stdlib
+    bcrypt = None
+
+# Default cost per scheme: pbkdf2 iterations, scrypt log2(N), bcrypt rounds
+DEFAULT_COSTS = {"pbkdf2_sha256": 600_000, "scrypt": 15, "bcrypt": 12}
+DEFAULT_SCHEME = "scrypt"
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def legacy_sha256(password, salt):
+    """The original single-round SHA-256 of password + salt."""
+    return hashlib.sha256((password + salt).encode()).hexdigest()
+
+
+class Pbkdf2Hasher:
+    """PBKDF2-HMAC-SHA256; ``pbkdf2_sha256$<iterations>$<salt>$<hash>``."""
+
+    scheme = "pbkdf2_sha256"
+
+    def __init__(self, cost):
+        self.cost = cost
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, self.cost)
+        return f"{self.scheme}${self.cost}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, encoded):
+        _, iterations, salt, digest = encoded.split("$")
+        candidate = hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), _unb64(salt), int(iterations)
+        )
+        return hmac.compare_digest(candidate, _unb64(digest))
+
+    def cost_of(self, encoded):
+        return int(encoded.split("$")[1])
+
+
+class ScryptHasher:
+    """scrypt with N = 2**cost, r=8, p=1; ``scrypt$<cost>$<salt>$<hash>``."""
+
+    scheme = "scrypt"
+
+    def __init__(self, cost):
+        self.cost = cost
+
+    @staticmethod
+    def _derive(password, salt, cost):
+        n = 2**cost
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=8, p=1, maxmem=256 * n * 8, dklen=32
+        )
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        digest = self._derive(password, salt, self.cost)
+        return f"{self.scheme}${self.cost}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, encoded):
+        _, cost, salt, digest = encoded.split("$")
+        candidate = self._derive(password, _unb64(salt), int(cost))
+        return hmac.compare_digest(candidate, _unb64(digest))
+
+    def cost_of(self, encoded):
+        return int(encoded.split("$")[1])
+
+
+class BcryptHasher:
+    """bcrypt (needs the ``bcrypt`` package); standard ``$2b$<rounds>$...``."""
+
+    scheme = "bcrypt"
+
+    def __init__(self, cost):
+        if bcrypt is None:
+            raise RuntimeError("PASSWORD_HASHER=bcrypt needs the bcrypt package")
+        self.cost = cost
+
+    def hash(self, password):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.cost)).decode()
+
+    def verify(self, password, encoded):
+        return bcrypt.checkpw(password.encode(), encoded.encode())
+
+    def cost_of(self, encoded):
+        return int(encoded.split("$")[2])
+
+
+HASHERS = {h.scheme: h for h in (Pbkdf2Hasher, ScryptHasher, BcryptHasher)}
+
+
+def scheme_of(encoded):
+    """Scheme of a stored hash; "legacy" for the old salted SHA-256."""
+    if encoded.startswith("$2"):
+        return "bcrypt"
+    scheme = encoded.split("$", 1)[0]
+    return scheme if scheme in HASHERS else "legacy"
+
+
+def make_hasher(scheme, cost=None):
+    return HASHERS[scheme](cost if cost is not None else DEFAULT_COSTS[scheme])
+
+
+def _hash(scheme, cost, password):
+    return make_hasher(scheme, cost).hash(password)
+
+
+def _verify(scheme, cost, password, encoded, salt):
+    """Check a password; returns ``(ok, new_hash)``.
+
+    ``new_hash`` is set when the stored hash is legacy or uses another
+    scheme or cost than configured, so the caller can upgrade it.
+    """
+    stored = scheme_of(encoded)
+    if stored == "legacy":
+        ok = hmac.compare_digest(legacy_sha256(password, salt or ""), encoded)
+    else:
+        ok = make_hasher(stored).verify(password, encoded)
+    if not ok:
+        return False, None
+
+    current = make_hasher(scheme, cost)
+    if stored != scheme or current.cost_of(encoded) != current.cost:
+        return True, current.hash(password)
+    return True, None
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool's queue is full or a job timed out."""
+
+
+class HashingPool:
+    """Runs password hashing on a bounded thread or process pool.
+
+    At most ``max_queue`` jobs wait beyond the ``workers`` running ones;
+    more are rejected with HasherBusy instead of tying up request threads.
+    """
+
+    def __init__(self, scheme, cost, kind="thread", workers=None, max_queue=None):
+        self.scheme = scheme
+        self.cost = cost
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        executor = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        self._executor = executor(max_workers=self.workers)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+
+    def _run(self, fn, *args, timeout=None):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HasherBusy()
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+
+        # A job that timed out keeps its slot until it really finishes
+        def finished(future):
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.seconds += time.perf_counter() - started
+
+        future.add_done_callback(finished)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HasherBusy()
+
+    def hash(self, password, timeout=None):
+        return self._run(_hash, self.scheme, self.cost, password, timeout=timeout)
+
+    def verify(self, password, encoded, salt=None, timeout=None):
+        return self._run(
+            _verify, self.scheme, self.cost, password, encoded, salt, timeout=timeout
+        )
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "scheme": self.scheme,
+                "cost": self.cost,
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queue_depth": max(self.in_flight - self.workers, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_seconds": round(self.seconds / self.completed, 4)
+                if self.completed
+                else 0,
+            }
+
+
+def _pool():
+    return current_app.extensions["password_hashing"]
+
+
+def hash_password(password):
+    """Hash a new password with the configured scheme and cost."""
+    return _pool().hash(password, timeout=current_app.config["PASSWORD_HASH_TIMEOUT"])
+
+
+def verify_password(user, password):
+    """Check ``password`` for ``user``; returns ``(ok, upgraded_hash)``."""
+    return _pool().verify(
+        password,
+        user.password_hash,
+        user.salt,
+        timeout=current_app.config["PASSWORD_HASH_TIMEOUT"],
+    )
+
+
+def burn_password_check(password):
+    """Spend a verification's worth of time for an unknown account."""
+    pool = _pool()
+    pool.verify(
+        password, pool.dummy_hash, timeout=current_app.config["PASSWORD_HASH_TIMEOUT"]
+    )
+
+
+def init_password_hashing(app):
+    """Create the hashing pool from PASSWORD_HASH_* config and expose metrics."""
+    scheme = app.config.setdefault("PASSWORD_HASHER", DEFAULT_SCHEME)
+    if scheme not in HASHERS:
+        raise ValueError(f"PASSWORD_HASHER must be one of {', '.join(HASHERS)}")
+    cost = app.config.setdefault("PASSWORD_HASH_COST", DEFAULT_COSTS[scheme])
+    app.config.setdefault("PASSWORD_HASH_POOL", "thread")
+    app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+
+    pool = HashingPool(
+        scheme,
+        cost,
+        kind=app.config["PASSWORD_HASH_POOL"],
+        workers=app.config.get("PASSWORD_HASH_WORKERS"),
+        max_queue=app.config.get("PASSWORD_HASH_MAX_QUEUE"),
+    )
+    pool.dummy_hash = make_hasher(scheme, cost).hash(secrets.token_hex(8))
+    app.extensions["password_hashing"] = pool
+    register_metrics("password_hashing", pool.snapshot)
@@ -1,23 +1,14 @@
-import hashlib
-import secrets
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from extensions import db
 from models import User
+from analytics.cache import warm_analytics
+from .hashing import HasherBusy, burn_password_check, hash_password, verify_password
 from .forms import SignupForm, LoginForm
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
-
-def generate_salt():
-    """Generate a random salt for password hashing."""
-    return secrets.token_hex(16)
-
-
-def hash_password_with_salt(password, salt):
-    """Hash password with salt using SHA-256."""
-    return hashlib.sha256((password + salt).encode()).hexdigest()
+BUSY_MESSAGE = "The server is busy right now. Please try again in a moment."
 
 
 @auth_bp.route("/signup", methods=["GET", "POST"])
@@ -29,9 +20,12 @@ def signup():
     form = SignupForm()
 
     if form.validate_on_submit():
-        # Generate salt and hash password
-        salt = generate_salt()
-        password_hash = hash_password_with_salt(form.password.data, salt)
+        # The KDF embeds its own salt; the salt column is only for legacy hashes
+        try:
+            password_hash = hash_password(form.password.data)
+        except HasherBusy:
+            flash(BUSY_MESSAGE, "warning")
+            return render_template("auth/signup.html", form=form), 503
 
         # Create new user
         user = User(
@@ -40,7 +34,7 @@ def signup():
             first_name=form.first_name.data,
             last_name=form.last_name.data,
             password_hash=password_hash,
-            salt=salt,
+            salt="",
             is_active=True,
             is_verified=False,  # Might implement email verification later
         )
@@ -77,23 +71,39 @@ def login():
         else:
             user = User.query.filter_by(username=user_input).first()
 
-        if user and user.is_active:
-            # Verify password
-            password_hash = hash_password_with_salt(form.password.data, user.salt)
-
-            if password_hash == user.password_hash:
-                login_user(user, remember=form.remember_me.data)
-
-                # Redirect to next page if exists
-                next_page = request.args.get("next")
-                if next_page:
-                    return redirect(next_page)
-
-                return redirect(url_for("dashboard"))
+        try:
+            if user and user.is_active:
+                verified, upgraded_hash = verify_password(user, form.password.data)
             else:
-                flash("Invalid username/email or password.", "danger")
-        else:
-            flash("Invalid username/email or password.", "danger")
+                # Take as long as a real check so accounts can't be probed
+                burn_password_check(form.password.data)
+                verified, upgraded_hash = False, None
+        except HasherBusy:
+            flash(BUSY_MESSAGE, "warning")
+            return render_template("auth/login.html", form=form), 503
+
+        if verified:
+            # Legacy or outdated hash: store it with the current scheme
+            if upgraded_hash:
+                user.password_hash = upgraded_hash
+                user.salt = ""
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Password rehash error: {e}")
+
+            login_user(user, remember=form.remember_me.data)
+            warm_analytics(user.id)
+
+            # Redirect to next page if exists
+            next_page = request.args.get("next")
+            if next_page:
+                return redirect(next_page)
+
+            return redirect(url_for("dashboard"))
+
+        flash("Invalid username/email or password.", "danger")
 
     return render_template("auth/login.html", form=form)
 
@@ -0,0 +1,83 @@
+"""Serialization time and response size of the analytics chart payloads.
+
+Compares the Chart.js-shaped payloads with the columnar format, encoded with
+the stdlib JSON provider and with orjson, raw and compressed.
+
+    python benchmarks/bench_chart_payloads.py
+"""
+
+import gzip
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics.views import MONTH_LABELS, chart_payload  # noqa: E402
+from constants.categories import get_all_categories  # noqa: E402
+from constants.payment_methods import PAYMENT_METHODS  # noqa: E402
+from responses import brotli, orjson  # noqa: E402
+
+ROUNDS = 2000
+
+
+def _amounts(n):
+    return [round(random.uniform(5, 2500), 2) for _ in range(n)]
+
+
+def sample_columns():
+    """Columns shaped like each endpoint's output for a busy user."""
+    categories = get_all_categories()
+    return {
+        "expense-by-category": ("category", {"labels": categories, "values": _amounts(len(categories))}),
+        "monthly-trend": ("trend", {"labels": [f"{m} 2025" for m in MONTH_LABELS], "values": _amounts(12)}),
+        "daily-spending (month)": ("daily", {"labels": list(range(1, 32)), "values": _amounts(31)}),
+        "daily-spending (year)": ("monthly", {"labels": MONTH_LABELS, "values": _amounts(12)}),
+        "top-categories": ("top", {"labels": categories[:5], "values": _amounts(5)}),
+        "payment-methods": (
+            "payment",
+            {
+                "labels": PAYMENT_METHODS,
+                "values": _amounts(len(PAYMENT_METHODS)),
+                "counts": [random.randint(1, 90) for _ in PAYMENT_METHODS],
+            },
+        ),
+    }
+
+
+def _encoders():
+    # Same settings as Flask's default provider (sorted keys, compact)
+    encoders = {"json": lambda obj: json.dumps(obj, separators=(",", ":"), sort_keys=True).encode()}
+    if orjson is not None:
+        encoders["orjson"] = orjson.dumps
+    return encoders
+
+
+def main():
+    random.seed(42)
+    encoders = _encoders()
+    header = f"{'endpoint':<24}{'format':<10}{'encoder':<8}{'us/op':>8}{'bytes':>8}{'gzip':>7}"
+    if brotli is not None:
+        header += f"{'br':>7}"
+    print(header)
+    print("-" * len(header))
+
+    for endpoint, (style, columns) in sample_columns().items():
+        payloads = {"chartjs": chart_payload(style, columns), "columnar": columns}
+        for fmt, payload in payloads.items():
+            for name, encode in encoders.items():
+                seconds = timeit.timeit(lambda: encode(payload), number=ROUNDS)
+                body = encode(payload)
+                row = (
+                    f"{endpoint:<24}{fmt:<10}{name:<8}{seconds / ROUNDS * 1e6:>8.1f}"
+                    f"{len(body):>8}{len(gzip.compress(body)):>7}"
+                )
+                if brotli is not None:
+                    row += f"{len(brotli.compress(body)):>7}"
+                print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Password verifications per second for each hashing cost.
+
+Runs concurrent verifications through the same bounded pool the login view
+uses, so the numbers include queueing. Pick the highest cost that still
+covers peak logins per worker with headroom.
+
+    python benchmarks/bench_login.py --scheme scrypt --costs 13 14 15 16
+    python benchmarks/bench_login.py --scheme pbkdf2_sha256 --costs 200000 600000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.hashing import DEFAULT_COSTS, HASHERS, HasherBusy, HashingPool, make_hasher  # noqa: E402
+
+
+def run(scheme, cost, kind, workers, clients, seconds):
+    pool = HashingPool(scheme, cost, kind=kind, workers=workers, max_queue=clients)
+    encoded = make_hasher(scheme, cost).hash("correct horse battery staple")
+    latencies = []
+    rejected = []
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                pool.verify("correct horse battery staple", encoded)
+            except HasherBusy:
+                rejected.append(1)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    return len(latencies) / seconds, p95, len(rejected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scheme", choices=sorted(HASHERS), default="scrypt")
+    parser.add_argument("--costs", type=int, nargs="+")
+    parser.add_argument("--pool", choices=("thread", "process"), default="thread")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent logins")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    costs = args.costs or [DEFAULT_COSTS[args.scheme]]
+    print(
+        f"{args.scheme}, {args.pool} pool of {args.workers}, {args.clients} clients"
+    )
+    print(f"{'cost':>10} {'logins/s':>10} {'p95 ms':>10} {'rejected':>10}")
+    for cost in costs:
+        rate, p95, rejected = run(
+            args.scheme, cost, args.pool, args.workers, args.clients, args.seconds
+        )
+        print(f"{cost:>10} {rate:>10.1f} {p95 * 1000:>10.1f} {rejected:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import EXPENSES_PARTITION_BY, User
+from database import READ_REPLICA_BIND, ensure_expense_partitions
+from expenses.rollups import (
+    month_start,
+    rate_dependent_months,
+    refresh_rollups,
+    refresh_user_rollups,
+)
+from user.purge import purge_user, purgeable_users
+from expenses.archive import archive_user
+from exports import EXPORT_FORMATS, export_expenses
+from fx import rate_cache, read_rates, store_rates
+from analytics.forecast import refit_users
+from analytics.platform_stats import DEFAULT_SHARDS, run_platform_stats
+
+
+@click.command("create-partitions")
+@click.option(
+    "--ahead",
+    type=int,
+    default=None,
+    help="Future periods to create (default: 1 year or 3 months).",
+)
+@with_appcontext
+def create_partitions(ahead):
+    """Create upcoming expenses partitions ahead of time (PostgreSQL only)."""
+    if not EXPENSES_PARTITION_BY:
+        raise click.ClickException("Set EXPENSES_PARTITION_BY to 'year' or 'month'.")
+    if db.engine.dialect.name != "postgresql":
+        raise click.ClickException("Partitioning is only supported on PostgreSQL.")
+
+    created = ensure_expense_partitions(db.engine, EXPENSES_PARTITION_BY, ahead=ahead)
+    if created:
+        click.echo(f"Created partitions: {', '.join(created)}")
+    else:
+        click.echo("All partitions already exist.")
+
+
+@click.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups():
+    """Recompute every user's monthly expense rollups (one commit per user)."""
+    user_ids = db.session.execute(db.select(User.id)).scalars().all()
+    for user_id in user_ids:
+        refresh_user_rollups(db.session.connection(), user_id)
+        db.session.commit()
+    click.echo(f"Rebuilt rollups for {len(user_ids)} users.")
+
+
+@click.command("purge-deleted-accounts")
+@click.option(
+    "--grace-days",
+    type=int,
+    default=None,
+    help="Days an account stays soft-deleted first (default: PURGE_GRACE_DAYS).",
+)
+@click.option(
+    "--batch-size", type=int, default=1000, help="Expenses deleted per transaction."
+)
+@click.option(
+    "--sleep",
+    "pause",
+    type=float,
+    default=0.1,
+    help="Seconds to pause between batches.",
+)
+@click.option("--limit", type=int, default=None, help="Most accounts to purge.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be purged.")
+@with_appcontext
+def purge_deleted_accounts(grace_days, batch_size, pause, limit, dry_run):
+    """Hard-delete accounts soft-deleted longer than the grace period."""
+    if grace_days is None:
+        grace_days = current_app.config["PURGE_GRACE_DAYS"]
+    if batch_size < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--batch-size")
+
+    user_ids = purgeable_users(grace_days)[:limit]
+    if dry_run:
+        click.echo(f"{len(user_ids)} accounts past the {grace_days}-day grace period.")
+        return
+
+    expenses = 0
+    for user_id in user_ids:
+        expenses += purge_user(user_id, batch_size=batch_size, pause=pause)
+        if pause:
+            time.sleep(pause)
+    click.echo(f"Purged {len(user_ids)} accounts and {expenses} expenses.")
+
+
+@click.command("archive-expenses")
+@click.option(
+    "--before",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=None,
+    help="Archive expenses dated before this day (default: --keep-years).",
+)
+@click.option(
+    "--keep-years",
+    type=int,
+    default=2,
+    help="Full calendar years kept in the expenses table besides the current one.",
+)
+@click.option("--user", "username", default=None, help="Only archive this user.")
+@click.option("--batch-size", type=int, default=1000, help="Expenses per delete.")
+@click.option(
+    "--sleep",
+    "pause",
+    type=float,
+    default=0.1,
+    help="Seconds to pause between users.",
+)
+@with_appcontext
+def archive_expenses(before, keep_years, username, batch_size, pause):
+    """Move old expenses into per-user columnar archive files."""
+    if before is None:
+        before = date(date.today().year - keep_years, 1, 1)
+    else:
+        before = before.date()
+
+    query = db.select(User.id).where(User.deleted_at.is_(None))
+    if username:
+        query = query.where(User.username == username)
+    user_ids = db.session.execute(query).scalars().all()
+
+    archived = 0
+    for user_id in user_ids:
+        archived += archive_user(user_id, before, batch_size=batch_size)
+        if pause:
+            time.sleep(pause)
+    click.echo(
+        f"Archived {archived} expenses dated before {before} for {len(user_ids)} users."
+    )
+
+
+@click.command("export-parquet")
+@click.argument("out_dir", type=click.Path(file_okay=False))
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(EXPORT_FORMATS),
+    default="parquet",
+    help="Parquet (zstd) or Arrow IPC files.",
+)
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), default=None)
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), default=None)
+@click.option("--with-users", is_flag=True, help="Add each expense's username.")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only export rows updated since the last run into OUT_DIR.",
+)
+@click.option("--batch-size", type=int, default=50000, help="Rows per record batch.")
+@click.option(
+    "--lag",
+    type=int,
+    default=60,
+    help="Leave rows updated in the last LAG seconds for the next run.",
+)
+@with_appcontext
+def export_parquet(out_dir, fmt, start, end, with_users, incremental, batch_size, lag):
+    """Stream expenses into year=/month= partitioned files for analysts.
+
+    Archived expenses are included. Reads from the read replica when one is
+    configured.
+    """
+    engine = db.engines.get(READ_REPLICA_BIND) or db.engine
+    try:
+        rows, files = export_expenses(
+            engine,
+            out_dir,
+            fmt=fmt,
+            start=start.date() if start else None,
+            end=end.date() if end else None,
+            with_users=with_users,
+            incremental=incremental,
+            batch_size=batch_size,
+            lag=lag,
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Exported {rows} expenses into {len(files)} files under {out_dir}.")
+
+
+@click.command("load-fx-rates")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def load_fx_rates(path):
+    """Load monthly exchange rates from a currency,month,rate CSV file.
+
+    Rollups of the months the new rates apply to are recomputed in the same
+    transaction, which also invalidates cached analytics for those users.
+    """
+    try:
+        rates = read_rates(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not rates:
+        raise click.ClickException("No rates to load.")
+
+    connection = db.session.connection()
+    since = store_rates(connection, rates)
+    touched = rate_dependent_months(connection, since)
+    refresh_rollups(connection, touched)
+    db.session.commit()
+    rate_cache.clear()
+    click.echo(
+        f"Loaded {len(rates)} rates for {len(since)} currencies; "
+        f"refreshed rollups for {len(touched)} user-months."
+    )
+
+
+@click.command("refit-forecasts")
+@click.option(
+    "--workers", type=int, default=None, help="Fitting processes (default: CPUs)."
+)
+@click.option("--batch-size", type=int, default=200, help="Users per commit.")
+@click.option("--force", is_flag=True, help="Also refit models that are current.")
+@with_appcontext
+def refit_forecasts(workers, batch_size, force):
+    """Refit every active user's spending forecast for this month.
+
+    Meant to run overnight, so page views find their models ready. Reads
+    the aggregates here and fits on a process pool.
+    """
+    if batch_size < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--batch-size")
+    month = month_start(date.today())
+    user_ids = (
+        db.session.execute(db.select(User.id).where(User.deleted_at.is_(None)))
+        .scalars()
+        .all()
+    )
+
+    fitted = 0
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        for i in range(0, len(user_ids), batch_size):
+            fitted += refit_users(
+                db.session, user_ids[i : i + batch_size], month, pool, force
+            )
+            db.session.commit()
+    click.echo(f"Refit {fitted} of {len(user_ids)} forecasts for {month:%Y-%m}.")
+
+
+@click.command("platform-stats")
+@click.option(
+    "--shards",
+    type=int,
+    default=DEFAULT_SHARDS,
+    help="User id ranges aggregated separately.",
+)
+@click.option(
+    "--workers", type=int, default=None, help="Aggregating processes (default: CPUs)."
+)
+@with_appcontext
+def platform_stats(shards, workers):
+    """Recompute the platform-wide stats admins see, from every user's rollups.
+
+    Meant to run nightly. Each shard of users is streamed on a process pool,
+    from the read replica when one is configured; only the summary tables
+    are written to the primary.
+    """
+    if shards < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--shards")
+    engine = db.engines.get(READ_REPLICA_BIND) or db.engine
+    url = engine.url.render_as_string(hide_password=False)
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        run = run_platform_stats(db.session, url, shards, pool)
+        db.session.commit()
+    click.echo(f"Aggregated {run.users} users in {shards} shards in {run.seconds}s.")
+
+
+def register_commands(app):
+    """Register the maintenance CLI commands on the app."""
+    app.cli.add_command(create_partitions)
+    app.cli.add_command(rebuild_rollups)
+    app.cli.add_command(purge_deleted_accounts)
+    app.cli.add_command(archive_expenses)
+    app.cli.add_command(export_parquet)
+    app.cli.add_command(load_fx_rates)
+    app.cli.add_command(refit_forecasts)
+    app.cli.add_command(platform_stats)
@@ -0,0 +1,35 @@
+# constants/currencies.py
+
+# ISO 4217 codes an expense can be recorded in; analytics convert them to
+# BASE_CURRENCY with the loaded FX rates
+CURRENCIES = [
+    "USD",
+    "EUR",
+    "GBP",
+    "CAD",
+    "AUD",
+    "NZD",
+    "JPY",
+    "CNY",
+    "HKD",
+    "SGD",
+    "KRW",
+    "INR",
+    "THB",
+    "CHF",
+    "SEK",
+    "NOK",
+    "DKK",
+    "PLN",
+    "CZK",
+    "HUF",
+    "TRY",
+    "MXN",
+    "BRL",
+    "ZAR",
+]
+
+
+def validate_currency(currency):
+    """Validate a currency code."""
+    return currency in CURRENCIES
@@ -0,0 +1,17 @@
+# constants/payment_methods.py
+
+PAYMENT_METHODS = [
+    "Cash",
+    "Credit Card",
+    "Debit Card",
+    "Bank Transfer",
+    "Check",
+    "PayPal",
+    "Venmo",
+    "Other",
+]
+
+
+def validate_payment_method(payment_method):
+    """Validate a payment method; empty means "not recorded"."""
+    return not payment_method or payment_method in PAYMENT_METHODS
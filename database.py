@@ -0,0 +1,424 @@
+from datetime import date
+from functools import wraps
+import logging
+import os
+import threading
+import time
+
+from flask import (
+    current_app,
+    g,
+    has_app_context,
+    has_request_context,
+    request,
+    session,
+)
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, event, exc, text
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Bind key of the optional read-only engine configured from DATABASE_READ_URL
+READ_REPLICA_BIND = "replica"
+
+# Session key holding the time until which this client reads from the primary
+PRIMARY_UNTIL_KEY = "_db_primary_until"
+
+# DB_POOL_MODE values: "app" keeps a regular in-process pool; "pgbouncer" keeps a
+# small pool in front of an external transaction pooler; "null" opens a fresh
+# pooler connection per checkout.
+POOL_MODES = ("app", "pgbouncer", "null")
+
+# Default (pool_size, max_overflow) per worker for each pooled mode
+DEFAULT_POOL_SIZES = {"app": (5, 10), "pgbouncer": (2, 3)}
+
+# How many future partitions to keep ready for each interval
+DEFAULT_PARTITIONS_AHEAD = {"year": 1, "month": 3}
+
+
+def _partition_start(day, interval):
+    if interval == "year":
+        return date(day.year, 1, 1)
+    return date(day.year, day.month, 1)
+
+
+def _next_partition_start(start, interval):
+    if interval == "year":
+        return date(start.year + 1, 1, 1)
+    if start.month == 12:
+        return date(start.year + 1, 1, 1)
+    return date(start.year, start.month + 1, 1)
+
+
+def partition_name(start, interval):
+    """Name of the expenses partition that begins on ``start``."""
+    if interval == "year":
+        return f"expenses_y{start.year}"
+    return f"expenses_y{start.year}m{start.month:02d}"
+
+
+def partition_ranges(first, last, interval):
+    """Return (name, start, end) for every partition covering first..last."""
+    ranges = []
+    start = _partition_start(first, interval)
+    while start <= last:
+        end = _next_partition_start(start, interval)
+        ranges.append((partition_name(start, interval), start, end))
+        start = end
+    return ranges
+
+
+def _shift(day, interval, periods):
+    for _ in range(periods):
+        day = _next_partition_start(_partition_start(day, interval), interval)
+    return day
+
+
+def ensure_expense_partitions(engine, interval, ahead=None, today=None):
+    """Create missing range partitions of ``expenses`` on PostgreSQL.
+
+    Covers everything from the oldest row parked in the default partition up
+    to ``ahead`` periods past today. Rows already sitting in the default
+    partition for a new range are moved into it before it is attached, so the
+    attach never fails. Each partition is created in its own short
+    transaction. Returns the names of the partitions created.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+
+    today = today or date.today()
+    ahead = DEFAULT_PARTITIONS_AHEAD[interval] if ahead is None else ahead
+
+    with engine.begin() as conn:
+        partitioned = conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass('expenses')"
+            )
+        ).first()
+        if not partitioned:
+            logger.warning("expenses is not a partitioned table, skipping")
+            return []
+
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS expenses_default "
+                "PARTITION OF expenses DEFAULT"
+            )
+        )
+        oldest = conn.execute(text("SELECT min(date) FROM expenses_default")).scalar()
+
+    first = min(oldest, today) if oldest else today
+    last = _shift(today, interval, ahead)
+
+    created = []
+    for name, start, end in partition_ranges(first, last, interval):
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT to_regclass(:name)"), {"name": name}
+            ).scalar()
+            if exists:
+                continue
+
+            bounds = {"start": start, "end": end}
+            conn.execute(
+                text(
+                    f"CREATE TABLE {name} "
+                    "(LIKE expenses INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+            )
+            conn.execute(
+                text(
+                    "WITH moved AS ("
+                    "DELETE FROM expenses_default "
+                    "WHERE date >= :start AND date < :end RETURNING *"
+                    f") INSERT INTO {name} SELECT * FROM moved"
+                ),
+                bounds,
+            )
+            conn.execute(
+                text(
+                    f"ALTER TABLE expenses ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            )
+        created.append(name)
+        logger.info(f"📦 Created expenses partition {name}")
+
+    return created
+
+
+def pool_sizing(mode, environ=None):
+    """Work out (pool_size, max_overflow) for one worker process.
+
+    ``DB_POOL_SIZE``/``DB_MAX_OVERFLOW`` win when set. Otherwise a total
+    ``DB_MAX_CONNECTIONS`` budget is split evenly across ``WEB_CONCURRENCY``
+    workers with no overflow, so the fleet never exceeds it.
+    """
+    environ = os.environ if environ is None else environ
+    pool_size, max_overflow = DEFAULT_POOL_SIZES[mode]
+
+    budget = environ.get("DB_MAX_CONNECTIONS")
+    if budget:
+        workers = max(1, int(environ.get("WEB_CONCURRENCY", 1)))
+        pool_size, max_overflow = max(1, int(budget) // workers), 0
+
+    pool_size = int(environ.get("DB_POOL_SIZE", pool_size))
+    max_overflow = int(environ.get("DB_MAX_OVERFLOW", max_overflow))
+    return pool_size, max_overflow
+
+
+def postgres_engine_options(database_url, environ=None):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for PostgreSQL from the environment."""
+    environ = os.environ if environ is None else environ
+    mode = environ.get("DB_POOL_MODE", "app").lower()
+    if mode not in POOL_MODES:
+        raise ValueError(f"DB_POOL_MODE must be one of {', '.join(POOL_MODES)}")
+
+    connect_args = {
+        "sslmode": environ.get("DB_SSLMODE", "require"),
+        "connect_timeout": 10,
+    }
+    options = {"pool_pre_ping": True, "connect_args": connect_args}
+
+    if mode == "app":
+        connect_args["options"] = "-c statement_timeout=30000"  # 30 seconds query timeout
+    else:
+        # Transaction poolers reject the "options" startup parameter and
+        # cannot keep per-session prepared statements; set statement_timeout
+        # on the database role instead. psycopg2 never prepares server-side,
+        # psycopg 3 needs it switched off explicitly.
+        if database_url.startswith("postgresql+psycopg://"):
+            connect_args["prepare_threshold"] = None
+
+    if mode == "null":
+        options["poolclass"] = NullPool
+        return options
+
+    pool_size, max_overflow = pool_sizing(mode, environ)
+    options.update(
+        {
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": int(environ.get("DB_POOL_TIMEOUT", 30)),
+            "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 300)),
+        }
+    )
+    return options
+
+
+class PoolStats:
+    """Counters for one engine's connection pool."""
+
+    FIELDS = (
+        "connects",
+        "checkouts",
+        "checkins",
+        "waits",
+        "timeouts",
+        "invalidations",
+        "pre_ping_failures",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self.wait_seconds = 0.0
+
+    def record(self, field, waited=0.0):
+        with self._lock:
+            self.counts[field] += 1
+            self.wait_seconds += waited
+
+    def snapshot(self, pool):
+        with self._lock:
+            data = dict(self.counts, wait_seconds=round(self.wait_seconds, 3))
+        data["pool"] = type(pool).__name__
+        if isinstance(pool, QueuePool):
+            data.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+            )
+        return data
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that also counts checkouts which had to wait or timed out."""
+
+    stats = None
+
+    def _do_get(self):
+        stats = self.stats
+        if stats is None:
+            return super()._do_get()
+
+        # Only an exhausted pool with no overflow left blocks on checkout
+        must_wait = (
+            self._max_overflow > -1
+            and self.checkedin() == 0
+            and self.overflow() >= self._max_overflow
+        )
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            stats.record("timeouts")
+            raise
+        finally:
+            if must_wait:
+                stats.record("waits", time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def instrument_engine(engine):
+    """Attach pool counters to ``engine`` and return its :class:`PoolStats`."""
+    stats = PoolStats()
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.stats = stats
+
+    event.listen(engine, "connect", lambda *args: stats.record("connects"))
+    event.listen(engine, "checkout", lambda *args: stats.record("checkouts"))
+    event.listen(engine, "checkin", lambda *args: stats.record("checkins"))
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidated(dbapi_connection, connection_record, exception):
+        stats.record("invalidations")
+        # A failed pre-ping surfaces as an InvalidatePoolError on checkout
+        if isinstance(exception, exc.InvalidatePoolError):
+            stats.record("pre_ping_failures")
+
+    return stats
+
+
+def init_pool_metrics(app, db):
+    """Instrument every engine and expose their counters as ``db_pools``."""
+    from metrics import register_metrics
+
+    with app.app_context():
+        engines = dict(db.engines)
+    stats = {key: instrument_engine(engine) for key, engine in engines.items()}
+
+    register_metrics(
+        "db_pools",
+        lambda: {
+            key or "primary": stats[key].snapshot(engine.pool)
+            for key, engine in engines.items()
+        },
+    )
+
+
+class RoutingSession(Session):
+    """Session that sends plain reads to the read replica when allowed.
+
+    Only SELECTs issued outside a flush are routed, and only while the current
+    request opted in with :func:`read_replica`, or a background job set
+    ``g.db_read_replica`` in its own app context. Everything else, and every
+    read after that request or job wrote something, goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and isinstance(clause, Select)
+            and _reads_from_replica()
+        ):
+            engine = self._db.engines.get(READ_REPLICA_BIND)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _reads_from_replica():
+    return (
+        has_app_context()
+        and g.get("db_read_replica", False)
+        and not g.get("db_use_primary", False)
+    )
+
+
+def _wants_primary():
+    """Whether this request must see its client's own recent writes."""
+    if request.args.get("consistency") == "strong":
+        return True
+    if request.headers.get("X-Read-Consistency", "").lower() == "strong":
+        return True
+    return session.get(PRIMARY_UNTIL_KEY, 0) > time.time()
+
+
+def use_primary(seconds=None):
+    """Read from the primary for the rest of this request and a short window after.
+
+    Called automatically after every write; call it directly to force
+    read-your-writes on a route that would otherwise use the replica.
+    """
+    g.db_use_primary = True
+    if seconds is None:
+        seconds = current_app.config.get("READ_YOUR_WRITES_SECONDS", 10)
+    if seconds and current_app.config.get("SQLALCHEMY_BINDS", {}).get(
+        READ_REPLICA_BIND
+    ):
+        session[PRIMARY_UNTIL_KEY] = time.time() + seconds
+
+
+def read_replica(view):
+    """Route a GET view's reads to the read replica, if one is configured.
+
+    Put it below ``@login_required`` so the user itself is loaded from the
+    primary.
+    """
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if request.method == "GET" and not _wants_primary():
+            g.db_read_replica = True
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def _stick_to_primary():
+    if has_request_context():
+        use_primary()
+    elif has_app_context():
+        # A background job: no client session to remember it in
+        g.db_use_primary = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _stick_to_primary_after_flush(db_session, flush_context):
+    _stick_to_primary()
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _stick_to_primary_after_write(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        _stick_to_primary()
+
+
+def init_read_replica(app, db):
+    """Make the replica engine refuse writes at the connection level."""
+    with app.app_context():
+        engine = db.engines.get(READ_REPLICA_BIND)
+    if engine is None or engine.dialect.name != "sqlite":
+        # PostgreSQL replicas get postgresql_readonly via execution options
+        return
+
+    @event.listens_for(engine, "connect")
+    def _query_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
@@ -0,0 +1,442 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+from flask import current_app
+from sqlalchemy import delete, select
+from extensions import db
+from fx import rate_cache, rate_factors
+from models import BASE_CURRENCY, Expense, ExpenseArchive
+
+# Dictionary-encoded columns: int16 codes into dictionary.json, -1 for None
+CODED_COLUMNS = ("main_category", "subcategory", "payment_method", "currency")
+# Free-text columns, kept compressed in text.npz
+TEXT_COLUMNS = ("id", "name", "description", "created_at", "updated_at")
+
+# How many users' archives stay open (memory-mapped) per process
+MAX_OPEN_ARCHIVES = 256
+
+ArchivedExpense = namedtuple(
+    "ArchivedExpense",
+    "id name amount currency main_category subcategory date payment_method "
+    "description created_at updated_at",
+)
+
+
+def archive_path(user_id, generation=None):
+    """Directory of a user's archive, or of one generation of it."""
+    path = os.path.join(current_app.config["ARCHIVE_DIR"], str(user_id))
+    return path if generation is None else os.path.join(path, f"v{generation}")
+
+
+class ArchiveReader:
+    """One user's archived expenses, memory-mapped column by column.
+
+    Rows are sorted by date, so a period is a contiguous slice found by
+    binary search; only those pages of the files are ever read.
+    """
+
+    def __init__(self, path, archived_before):
+        self.path = path
+        self.archived_before = archived_before
+        self.dates = np.load(os.path.join(path, "date.npy"), mmap_mode="r")
+        self.amounts = np.load(os.path.join(path, "amount.npy"), mmap_mode="r")
+        with open(os.path.join(path, "dictionary.json")) as f:
+            self.dictionary = json.load(f)
+        self.codes = {}
+        for column in CODED_COLUMNS:
+            file = os.path.join(path, f"{column}.npy")
+            if os.path.exists(file):
+                self.codes[column] = np.load(file, mmap_mode="r")
+            else:
+                # Archived before the column existed
+                self.codes[column] = np.full(len(self.dates), -1, dtype=np.int16)
+                self.dictionary[column] = []
+        # Whether any amounts need converting to BASE_CURRENCY
+        self.foreign = any(c != BASE_CURRENCY for c in self.dictionary["currency"])
+
+    def __len__(self):
+        return len(self.dates)
+
+    def date_range(self):
+        """First and last archived dates, or (None, None) when empty."""
+        if not len(self):
+            return None, None
+        return self.dates[0].astype(object), self.dates[-1].astype(object)
+
+    def _slice(self, start, end):
+        end = min(end, self.archived_before) if end else self.archived_before
+        lo = np.searchsorted(self.dates, np.datetime64(start, "D")) if start else 0
+        hi = np.searchsorted(self.dates, np.datetime64(end, "D"))
+        return lo, hi
+
+    def _column(self, key, lo, hi):
+        if key in CODED_COLUMNS:
+            return np.asarray(self.codes[key][lo:hi], dtype=np.int64)
+        days = np.asarray(self.dates[lo:hi])
+        if key == "year":
+            return days.astype("datetime64[Y]").astype(np.int64) + 1970
+        if key == "month":
+            return days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        if key == "day":
+            return (days - days.astype("datetime64[M]")).astype(np.int64) + 1
+        raise ValueError(f"Cannot group archived expenses by {key}")
+
+    def _decode(self, key, value):
+        if key in CODED_COLUMNS:
+            if value >= 0:
+                return self.dictionary[key][value]
+            return BASE_CURRENCY if key == "currency" else None
+        return int(value)
+
+    def _cents(self, lo, hi, rates):
+        """Amounts in cents, converted to BASE_CURRENCY when ``rates`` is given."""
+        amounts = np.asarray(self.amounts[lo:hi])
+        if rates is None or not self.foreign:
+            return amounts
+        labels = np.array(self.dictionary["currency"] + [BASE_CURRENCY])
+        currencies = labels[np.asarray(self.codes["currency"][lo:hi])]
+        months = np.asarray(self.dates[lo:hi]).astype("datetime64[M]")
+        return amounts * rate_factors(rates, currencies, months)
+
+    def totals(self, start, end, keys, rates=None):
+        """``{key tuple: (cents, count)}`` for archived expenses in [start, end).
+
+        Amounts are converted with ``rates`` (from the RateCache) if given.
+        """
+        lo, hi = self._slice(start, end)
+        if lo >= hi:
+            return {}
+
+        amounts = self._cents(lo, hi, rates)
+        if keys:
+            columns = np.stack([self._column(key, lo, hi) for key in keys], axis=1)
+            groups, inverse = np.unique(columns, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+        else:
+            groups, inverse = [()], np.zeros(hi - lo, dtype=np.int64)
+
+        cents = np.bincount(inverse, weights=amounts, minlength=len(groups))
+        counts = np.bincount(inverse, minlength=len(groups))
+        return {
+            tuple(self._decode(key, value) for key, value in zip(keys, group)): (
+                int(round(total)),
+                int(count),
+            )
+            for group, total, count in zip(groups, cents, counts)
+        }
+
+    def amounts_by(self, start, end, key, rates=None):
+        """``{label: amounts}`` of archived expenses in [start, end) by ``key``.
+
+        Amounts are float arrays in currency units, converted with ``rates``
+        if given.
+        """
+        lo, hi = self._slice(start, end)
+        if lo >= hi:
+            return {}
+        amounts = self._cents(lo, hi, rates) / 100
+        codes = self._column(key, lo, hi)
+        return {
+            self._decode(key, code): amounts[codes == code] for code in np.unique(codes)
+        }
+
+    def rows(self, start=None, end=None):
+        """Archived expenses in [start, end) as ArchivedExpense tuples."""
+        lo, hi = self._slice(start, end)
+        if lo < hi:
+            yield from self._records(lo, hi, range(hi - lo))
+
+    def largest(self, start, end, limit, rates=None):
+        """The ``limit`` largest archived expenses in [start, end).
+
+        Returns ``(ArchivedExpense, amount)`` pairs, largest first; amounts
+        are converted with ``rates`` if given.
+        """
+        lo, hi = self._slice(start, end)
+        if lo >= hi:
+            return []
+        amounts = self._cents(lo, hi, rates) / 100
+        offsets = np.argsort(-amounts, kind="stable")[:limit]
+        return list(zip(self._records(lo, hi, offsets), amounts[offsets].tolist()))
+
+    def page(self, start, end, filters, before, limit, rates=None):
+        """Up to ``limit`` archived ``(expense, amount)`` pairs in [start, end),
+        newest first, matching ``{column: value}`` ``filters``.
+
+        With ``before``, a ``(date, id)`` position, only expenses strictly
+        before it are returned. Only records near the end of the matching
+        rows are built, however many rows match.
+        """
+        lo, hi = self._slice(start, end)
+        if before:
+            cutoff = np.datetime64(before[0], "D")
+            hi = min(hi, np.searchsorted(self.dates, cutoff, side="right"))
+        if lo >= hi:
+            return []
+
+        matches = np.ones(hi - lo, dtype=bool)
+        for column, value in filters.items():
+            if value not in self.dictionary[column]:
+                return []
+            code = self.dictionary[column].index(value)
+            matches &= self._column(column, lo, hi) == code
+        offsets = np.flatnonzero(matches)
+        # Rows are in date order: keep the last ``limit`` days' worth, plus
+        # the cursor's own day whose ids still need comparing
+        days = np.asarray(self.dates[lo:hi])[offsets]
+        earlier = offsets[days < cutoff] if before else offsets
+        if len(earlier) > limit:
+            boundary = self.dates[lo + earlier[-limit]]
+            offsets = offsets[days >= boundary]
+
+        amounts = self._cents(lo, hi, rates) / 100
+        pairs = [
+            (record, amount)
+            for record, amount in zip(
+                self._records(lo, hi, offsets), amounts[offsets].tolist()
+            )
+            if not before or (record.date, record.id) < before
+        ]
+        pairs.sort(key=lambda pair: (pair[0].date, pair[0].id), reverse=True)
+        return pairs[:limit]
+
+    def _records(self, lo, hi, offsets):
+        with np.load(os.path.join(self.path, "text.npz")) as text:
+            text = {column: text[column][lo:hi] for column in TEXT_COLUMNS}
+        codes = {column: self.codes[column][lo:hi] for column in CODED_COLUMNS}
+        days = self.dates[lo:hi].astype(object)
+
+        for i in offsets:
+            yield ArchivedExpense(
+                id=uuid.UUID(text["id"][i]),
+                name=text["name"][i] or None,
+                amount=Decimal(int(self.amounts[lo + i])).scaleb(-2),
+                currency=self._decode("currency", codes["currency"][i]),
+                main_category=self._decode("main_category", codes["main_category"][i]),
+                subcategory=self._decode("subcategory", codes["subcategory"][i]),
+                date=days[i],
+                payment_method=self._decode(
+                    "payment_method", codes["payment_method"][i]
+                ),
+                description=text["description"][i] or None,
+                created_at=datetime.fromisoformat(text["created_at"][i]),
+                updated_at=datetime.fromisoformat(text["updated_at"][i]),
+            )
+
+
+_readers = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def get_archive(executor, user_id):
+    """The user's ArchiveReader, or None if nothing is archived.
+
+    ``executor`` is a session or connection; readers are cached per process
+    and replaced when the archive's generation changes.
+    """
+    meta = executor.execute(
+        select(ExpenseArchive.generation, ExpenseArchive.archived_before).where(
+            ExpenseArchive.user_id == user_id
+        )
+    ).first()
+    if meta is None:
+        return None
+
+    key = (user_id, meta.generation)
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is not None:
+            _readers.move_to_end(key)
+            return reader
+
+    reader = ArchiveReader(archive_path(user_id, meta.generation), meta.archived_before)
+    with _readers_lock:
+        for stale in [k for k in _readers if k[0] == user_id]:
+            del _readers[stale]
+        _readers[key] = reader
+        while len(_readers) > MAX_OPEN_ARCHIVES:
+            _readers.popitem(last=False)
+    return reader
+
+
+def archived_rates(executor, reader):
+    """Rates for converting a reader's amounts; None if all are in BASE_CURRENCY."""
+    return rate_cache.get(executor) if reader.foreign else None
+
+
+def archived_totals(user_id, start, end, keys=()):
+    """Archived ``{key tuple: (cents, count)}`` for [start, end); {} if none.
+
+    Cents are in BASE_CURRENCY.
+    """
+    reader = get_archive(db.session, user_id)
+    if reader is None or (start and start >= reader.archived_before):
+        return {}
+    return reader.totals(start, end, keys, archived_rates(db.session, reader))
+
+
+def archived_amounts(user_id, start, end, key):
+    """Archived ``{label: amounts in BASE_CURRENCY}`` for [start, end) by ``key``."""
+    reader = get_archive(db.session, user_id)
+    if reader is None or (start and start >= reader.archived_before):
+        return {}
+    return reader.amounts_by(start, end, key, archived_rates(db.session, reader))
+
+
+def archived_largest(user_id, start, end, limit):
+    """The largest archived ``(expense, amount in BASE_CURRENCY)`` pairs."""
+    reader = get_archive(db.session, user_id)
+    if reader is None or (start and start >= reader.archived_before):
+        return []
+    return reader.largest(start, end, limit, archived_rates(db.session, reader))
+
+
+def archived_page(user_id, start, end, filters, before, limit):
+    """A page of archived ``(expense, amount in BASE_CURRENCY)`` pairs, newest
+    first; see :meth:`ArchiveReader.page`."""
+    reader = get_archive(db.session, user_id)
+    if reader is None or (start and start >= reader.archived_before):
+        return []
+    return reader.page(
+        start, end, filters, before, limit, archived_rates(db.session, reader)
+    )
+
+
+def archived_expenses(user_id, start=None, end=None):
+    """Archived expenses of a user in [start, end), oldest first."""
+    reader = get_archive(db.session, user_id)
+    if reader is None:
+        return []
+    return reader.rows(start, end)
+
+
+def write_archive(path, records):
+    """Write date-sorted ArchivedExpense records as a new archive directory."""
+    os.makedirs(path)
+    np.save(
+        os.path.join(path, "date.npy"),
+        np.array([r.date for r in records], dtype="datetime64[D]"),
+    )
+    np.save(
+        os.path.join(path, "amount.npy"),
+        np.array([int(r.amount * 100) for r in records], dtype=np.int64),
+    )
+
+    dictionary = {}
+    for column in CODED_COLUMNS:
+        values = [getattr(r, column) for r in records]
+        labels = sorted(set(values) - {None})
+        index = {label: code for code, label in enumerate(labels)}
+        np.save(
+            os.path.join(path, f"{column}.npy"),
+            np.array([index.get(v, -1) for v in values], dtype=np.int16),
+        )
+        dictionary[column] = labels
+    with open(os.path.join(path, "dictionary.json"), "w") as f:
+        json.dump(dictionary, f)
+
+    text = {}
+    for column in TEXT_COLUMNS:
+        values = (getattr(r, column) for r in records)
+        if column in ("created_at", "updated_at"):
+            text[column] = np.array([v.isoformat() for v in values], dtype=str)
+        else:
+            text[column] = np.array(
+                ["" if v is None else str(v) for v in values], dtype=str
+            )
+    np.savez_compressed(os.path.join(path, "text.npz"), **text)
+
+
+def archive_user(user_id, before, batch_size=1000):
+    """Move a user's expenses dated before ``before`` into their archive.
+
+    The expenses are deleted, and the rows the deletes return are written
+    together with the existing archive as a new generation. The switch to
+    it commits in the same transaction, so readers never see rows twice or
+    not at all. Rollups are
+    left as they are. The generation replaced stays on disk until the next
+    run, so requests still reading it can finish. Returns the number of
+    expenses archived.
+    """
+    meta = db.session.get(ExpenseArchive, user_id)
+    if meta is not None:
+        _remove_generations(user_id, keep=meta.generation)
+    if meta is not None and before <= meta.archived_before:
+        return 0
+
+    table = Expense.__table__
+    generation = meta.generation + 1 if meta is not None else 1
+    path = archive_path(user_id, generation)
+    fresh = []
+    try:
+        # Rows are archived as the DELETE returns them, so an edit committed
+        # meanwhile is either archived or waited for, never lost
+        while True:
+            batch = db.session.execute(
+                delete(table)
+                .where(
+                    table.c.user_id == user_id,
+                    table.c.date < before,
+                    table.c.id.in_(
+                        select(table.c.id)
+                        .where(table.c.user_id == user_id, table.c.date < before)
+                        .limit(batch_size)
+                    ),
+                )
+                .returning(*(table.c[field] for field in ArchivedExpense._fields))
+            ).all()
+            fresh.extend(ArchivedExpense(*row) for row in batch)
+            if len(batch) < batch_size:
+                break
+
+        if not fresh:
+            if meta is None:
+                db.session.rollback()
+                return 0
+            meta.archived_before = before
+            db.session.commit()
+            return 0
+
+        records = list(fresh)
+        if meta is not None:
+            records.extend(get_archive(db.session, user_id).rows())
+        records.sort(key=lambda r: r.date)
+        shutil.rmtree(path, ignore_errors=True)
+        write_archive(path, records)
+
+        if meta is None:
+            meta = ExpenseArchive(user_id=user_id)
+            db.session.add(meta)
+        meta.archived_before = before
+        meta.generation = generation
+        meta.row_count = len(records)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    return len(fresh)
+
+
+def _remove_generations(user_id, keep):
+    """Delete every generation of a user's archive except ``keep``."""
+    root = archive_path(user_id)
+    if not os.path.isdir(root):
+        return
+    for entry in os.listdir(root):
+        if entry != f"v{keep}":
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+def remove_archive(user_id):
+    """Delete a user's archive files (the metadata row is the caller's)."""
+    with _readers_lock:
+        for stale in [k for k in _readers if k[0] == user_id]:
+            del _readers[stale]
+    shutil.rmtree(archive_path(user_id), ignore_errors=True)
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+from sqlalchemy import delete, update
+from extensions import db
+from models import Expense
+from .rollups import refresh_rollups, touched_months
+from .sync import record_tombstones
+
+# Upper bound on ids accepted by one bulk request
+MAX_BULK_IDS = 10000
+
+
+def delete_expenses(user_id, ids):
+    """Delete the user's expenses with the given ids in one statement.
+
+    Ids that do not exist or belong to someone else are ignored. Rollups of
+    the affected months are refreshed and tombstones written in the same
+    transaction; the caller commits. Returns the number of rows deleted.
+    """
+    if not ids:
+        return 0
+
+    rows = db.session.execute(
+        delete(Expense)
+        .where(Expense.user_id == user_id, Expense.id.in_(ids))
+        .returning(Expense.id, Expense.date),
+        execution_options={"synchronize_session": False},
+    ).all()
+
+    connection = db.session.connection()
+    refresh_rollups(connection, touched_months(user_id, {row.date for row in rows}))
+    record_tombstones(connection, {(user_id, row.id) for row in rows})
+    return len(rows)
+
+
+def update_expenses(user_id, ids, **values):
+    """Set ``values`` on the user's expenses with the given ids in one statement.
+
+    The caller commits. Returns the number of rows updated.
+    """
+    if not ids:
+        return 0
+
+    values["updated_at"] = datetime.now(timezone.utc)
+    dates = db.session.execute(
+        update(Expense)
+        .where(Expense.user_id == user_id, Expense.id.in_(ids))
+        .values(**values)
+        .returning(Expense.date),
+        execution_options={"synchronize_session": False},
+    ).scalars().all()
+
+    refresh_rollups(db.session.connection(), touched_months(user_id, dates))
+    return len(dates)
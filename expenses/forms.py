@@ -7,9 +7,24 @@ from wtforms import (
     DateField,
     SubmitField,
 )
-from wtforms.validators import DataRequired, Optional, NumberRange, Length
+from wtforms.validators import (
+    DataRequired,
+    Optional,
+    NumberRange,
+    Length,
+    ValidationError,
+)
 from datetime import date
+from extensions import db
+from fx import rate_cache
+from models import BASE_CURRENCY
 from constants.categories import EXPENSE_CATEGORIES, get_all_categories
+from constants.currencies import CURRENCIES
+from constants.payment_methods import PAYMENT_METHODS
+
+# Expense dates accepted; analytics index days between them
+MIN_EXPENSE_DATE = date(1900, 1, 1)
+MAX_EXPENSE_DATE = date(2099, 12, 31)
 
 
 class ExpenseForm(FlaskForm):
@@ -26,6 +41,12 @@ class ExpenseForm(FlaskForm):
         places=2,
     )
 
+    currency = SelectField(
+        "Currency",
+        choices=[(code, code) for code in dict.fromkeys([BASE_CURRENCY] + CURRENCIES)],
+        default=BASE_CURRENCY,
+    )
+
     main_category = SelectField("Category", validators=[DataRequired()])
 
     subcategory = SelectField("Subcategory", validators=[DataRequired()])
@@ -34,17 +55,8 @@ class ExpenseForm(FlaskForm):
 
     payment_method = SelectField(
         "Payment Method",
-        choices=[
-            ("", "Select Payment Method"),
-            ("Cash", "Cash"),
-            ("Credit Card", "Credit Card"),
-            ("Debit Card", "Debit Card"),
-            ("Bank Transfer", "Bank Transfer"),
-            ("Check", "Check"),
-            ("PayPal", "PayPal"),
-            ("Venmo", "Venmo"),
-            ("Other", "Other"),
-        ],
+        choices=[("", "Select Payment Method")]
+        + [(method, method) for method in PAYMENT_METHODS],
         validators=[Optional()],
     )
 
@@ -52,6 +64,17 @@ class ExpenseForm(FlaskForm):
 
     submit = SubmitField("Save Expense")
 
+    def validate_date(self, field):
+        if field.data and not MIN_EXPENSE_DATE <= field.data <= MAX_EXPENSE_DATE:
+            raise ValidationError(
+                f"Date must be between {MIN_EXPENSE_DATE} and {MAX_EXPENSE_DATE}."
+            )
+
+    def validate_currency(self, field):
+        # Analytics can only convert currencies that have rates loaded
+        if field.data != BASE_CURRENCY and field.data not in rate_cache.get(db.session):
+            raise ValidationError(f"No exchange rates are loaded for {field.data}.")
+
     def __init__(self, *args, **kwargs):
         super(ExpenseForm, self).__init__(*args, **kwargs)
         # Populate main categories
@@ -0,0 +1,359 @@
+import calendar
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from itertools import chain
+import numpy as np
+from sqlalchemy import and_, delete, event, extract, func, inspect, or_, select
+from database import RoutingSession
+from fx import converted_amount, month_of, rate_join
+from models import Expense, ExpenseArchive, ExpenseRollup, ExpenseVersion, FxRate
+from .archive import archived_rates, get_archive
+
+# session.info key collecting the (user_id, month) pairs touched by a flush
+TOUCHED_KEY = "rollup_months"
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def month_end(month):
+    """Last day of ``month``; unlike the next month's start, it can't overflow."""
+    return month.replace(day=calendar.monthrange(month.year, month.month)[1])
+
+
+def month_runs(months):
+    """``(first, last)`` month pairs covering sorted ``months``, one per run of
+    consecutive months, so a filter needs one range per run, not per month."""
+    runs = []
+    for month in months:
+        if runs and previous_month(month) == runs[-1][1]:
+            runs[-1][1] = month
+        else:
+            runs.append([month, month])
+    return [tuple(run) for run in runs]
+
+
+def previous_month(month):
+    if month.month == 1:
+        return date(month.year - 1, 12, 1)
+    return date(month.year, month.month - 1, 1)
+
+
+def pack_daily(cents):
+    """Per-day cents of a month as the bytes stored in ``ExpenseRollup.daily``."""
+    return np.asarray(cents, dtype="<i8").tobytes()
+
+
+def unpack_daily(raw):
+    """The 31 per-day cents of an ``ExpenseRollup.daily`` value."""
+    if raw is None:
+        return np.zeros(31, dtype=np.int64)
+    return np.frombuffer(raw, dtype="<i8").astype(np.int64)
+
+
+def _insert(connection):
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _upsert(connection, rows):
+    stmt = _insert(connection)(ExpenseRollup.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "month", "main_category"],
+        set_={
+            "total": stmt.excluded.total,
+            "count": stmt.excluded.count,
+            "daily": stmt.excluded.daily,
+        },
+    )
+    connection.execute(stmt, rows)
+
+
+def bump_versions(connection, touched):
+    """Increment the data version of each (user_id, month) pair."""
+    table = ExpenseVersion.__table__
+    stmt = _insert(connection)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "month"],
+        set_={"version": table.c.version + 1},
+    )
+    connection.execute(
+        stmt, [{"user_id": u, "month": m, "version": 1} for u, m in touched]
+    )
+
+
+def refresh_rollups(connection, touched):
+    """Recompute the rollups of the given (user_id, month) pairs from expenses.
+
+    One grouped query per user over just the touched months, run on the
+    caller's connection so it commits with the write that caused it. Also
+    bumps the months' data versions. Totals are converted to BASE_CURRENCY.
+
+    Pairs are handled in sorted order, so concurrent writes take their row
+    locks in the same order and can't deadlock each other.
+    """
+    touched = sorted(touched)
+    if touched:
+        bump_versions(connection, touched)
+
+    months_by_user = defaultdict(list)
+    for user_id, month in touched:
+        months_by_user[user_id].append(month)
+
+    # Grouped by expression: a bare "month" would name fx_rates.month
+    by_year = extract("year", Expense.date).label("year")
+    by_month = extract("month", Expense.date).label("month")
+    by_day = extract("day", Expense.date).label("day")
+    for user_id, months in months_by_user.items():
+        runs = month_runs(months)
+        rows = connection.execute(
+            select(
+                by_year,
+                by_month,
+                by_day,
+                Expense.main_category,
+                func.sum(converted_amount()).label("total"),
+                func.count().label("count"),
+            )
+            .outerjoin(FxRate, rate_join())
+            .where(
+                Expense.user_id == user_id,
+                or_(
+                    *(
+                        and_(Expense.date >= first, Expense.date <= month_end(last))
+                        for first, last in runs
+                    )
+                ),
+            )
+            .group_by(by_year, by_month, by_day, Expense.main_category)
+        ).all()
+
+        # [total, count, cents per day] by (month, main_category)
+        totals = {}
+        for r in rows:
+            key = (date(int(r.year), int(r.month), 1), r.main_category)
+            total = totals.setdefault(key, [0, 0, np.zeros(31, dtype=np.int64)])
+            total[0] += r.total
+            total[1] += r.count
+            total[2][int(r.day) - 1] += round(r.total * 100)
+        # Archived months keep counting the expenses moved out to the archive
+        for (month, day, main_category), (cents, count) in archived_month_totals(
+            connection, user_id, months
+        ).items():
+            total = totals.setdefault(
+                (month, main_category), [0, 0, np.zeros(31, dtype=np.int64)]
+            )
+            total[0] += Decimal(cents).scaleb(-2)
+            total[1] += count
+            total[2][day - 1] += cents
+
+        connection.execute(
+            delete(ExpenseRollup).where(
+                ExpenseRollup.user_id == user_id,
+                or_(
+                    *(
+                        ExpenseRollup.month.between(first, last)
+                        for first, last in runs
+                    )
+                ),
+            )
+        )
+        if totals:
+            _upsert(
+                connection,
+                [
+                    {
+                        "user_id": user_id,
+                        "month": month,
+                        "main_category": main_category,
+                        "total": total,
+                        "count": count,
+                        "daily": pack_daily(daily),
+                    }
+                    for (month, main_category), (total, count, daily) in sorted(
+                        totals.items(), key=lambda item: item[0]
+                    )
+                ],
+            )
+
+
+def archived_month_totals(connection, user_id, months):
+    """Archived ``{(month, day, main_category): (cents, count)}`` for the months."""
+    reader = get_archive(connection, user_id)
+    if reader is None:
+        return {}
+    months = set(months)
+    # Nothing is archived past archived_before, so no end is needed
+    totals = reader.totals(
+        min(months),
+        None,
+        ("year", "month", "day", "main_category"),
+        archived_rates(connection, reader),
+    )
+    return {
+        (date(year, month, 1), day, main_category): value
+        for (year, month, day, main_category), value in totals.items()
+        if date(year, month, 1) in months
+    }
+
+
+def refresh_user_rollups(connection, user_id):
+    """Rebuild every rollup of one user from scratch.
+
+    Covers the months with expenses, archived or not, and the months that
+    had rollups, so their data versions change too.
+    """
+    by_year = extract("year", Expense.date).label("year")
+    by_month = extract("month", Expense.date).label("month")
+    months = {
+        date(int(year), int(month), 1)
+        for year, month in connection.execute(
+            select(by_year, by_month)
+            .where(Expense.user_id == user_id)
+            .group_by(by_year, by_month)
+        )
+    }
+    months.update(
+        connection.execute(
+            select(ExpenseRollup.month)
+            .where(ExpenseRollup.user_id == user_id)
+            .distinct()
+        ).scalars()
+    )
+    reader = get_archive(connection, user_id)
+    if reader is not None and len(reader):
+        months.update(
+            date(year, month, 1)
+            for year, month in reader.totals(None, None, ("year", "month"))
+        )
+
+    connection.execute(delete(ExpenseRollup).where(ExpenseRollup.user_id == user_id))
+    refresh_rollups(connection, {(user_id, month) for month in months})
+
+
+def rate_dependent_months(connection, since):
+    """(user_id, month) pairs whose converted totals use newly loaded rates.
+
+    ``since`` maps a currency to the first month loaded; later months may
+    have fallen back to those rates too, so they count as well.
+    """
+    touched = {
+        (user_id, month)
+        for user_id, month in connection.execute(
+            select(Expense.user_id, month_of(Expense.date))
+            .where(
+                or_(
+                    *(
+                        and_(Expense.currency == currency, Expense.date >= first)
+                        for currency, first in since.items()
+                    )
+                )
+            )
+            .distinct()
+        )
+    }
+
+    # Archived expenses count towards their months' rollups as well
+    start = min(since.values())
+    for user_id in connection.execute(select(ExpenseArchive.user_id)).scalars():
+        reader = get_archive(connection, user_id)
+        if reader is None or not reader.foreign:
+            continue
+        for year, month, currency in reader.totals(
+            start, None, ("year", "month", "currency")
+        ):
+            first = since.get(currency)
+            if first is not None and date(year, month, 1) >= first:
+                touched.add((user_id, date(year, month, 1)))
+    return touched
+
+
+def touched_months(user_id, dates):
+    """(user_id, month) pairs for a set of expense dates."""
+    return {(user_id, month_start(day)) for day in dates}
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _collect_touched_months(session, flush_context, instances):
+    touched = session.info.setdefault(TOUCHED_KEY, set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, Expense):
+            continue
+        # Old values too, so moving an expense fixes the month it left
+        attrs = inspect(obj).attrs
+        users = {obj.user_id, *attrs.user_id.history.deleted}
+        days = {obj.date, *attrs.date.history.deleted}
+        for user_id in users - {None}:
+            touched |= touched_months(user_id, days - {None})
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _refresh_touched_months(session, flush_context):
+    touched = session.info.pop(TOUCHED_KEY, None)
+    if touched:
+        refresh_rollups(session.connection(), touched)
+
+
+def monthly_summary(session, user_id, today=None):
+    """This month's and last month's totals plus this month's top category.
+
+    Served from one indexed query over at most two months of rollup rows.
+    """
+    current = month_start(today or date.today())
+    prior = previous_month(current)
+    rows = session.execute(
+        select(ExpenseRollup).where(
+            ExpenseRollup.user_id == user_id,
+            ExpenseRollup.month.in_([current, prior]),
+        )
+    ).scalars()
+
+    summary = {
+        "total_amount": 0,
+        "transaction_count": 0,
+        "prior_total": 0,
+        "prior_count": 0,
+        "top_category": None,
+        "top_category_total": 0,
+    }
+    for rollup in rows:
+        if rollup.month == current:
+            summary["total_amount"] += rollup.total
+            summary["transaction_count"] += rollup.count
+            if rollup.total > summary["top_category_total"]:
+                summary["top_category"] = rollup.main_category
+                summary["top_category_total"] = rollup.total
+        else:
+            summary["prior_total"] += rollup.total
+            summary["prior_count"] += rollup.count
+
+    count = summary["transaction_count"]
+    summary["average_expense"] = summary["total_amount"] / count if count else 0
+    prior_total = summary["prior_total"]
+    summary["change_pct"] = (
+        float((summary["total_amount"] - prior_total) / prior_total * 100)
+        if prior_total
+        else None
+    )
+    return summary
+
+
+def data_version(session, user_id, month=None):
+    """A user's data version, or one month's; changes on every write.
+
+    Month versions only ever grow, so their sum is a version for the user.
+    ``user_id`` may be a tuple of ids, giving one version for all of them.
+    """
+    if isinstance(user_id, tuple):
+        owned = ExpenseVersion.user_id.in_(user_id)
+    else:
+        owned = ExpenseVersion.user_id == user_id
+    query = select(func.coalesce(func.sum(ExpenseVersion.version), 0)).where(owned)
+    if month is not None:
+        query = query.where(ExpenseVersion.month == month_start(month))
+    return session.execute(query).scalar()
@@ -0,0 +1,126 @@
+import uuid
+from datetime import date, datetime, timezone
+from sqlalchemy import and_, event, or_, select
+from database import RoutingSession
+from models import Expense, ExpenseTombstone
+from .archive import get_archive
+from .rollups import _insert
+
+# session.info key collecting the (user_id, expense_id) pairs deleted by a flush
+DELETED_KEY = "deleted_expenses"
+
+# Archive position a first sync starts from: after every archived expense
+ARCHIVE_START = (date.max, uuid.UUID(int=(1 << 128) - 1))
+
+
+def record_tombstones(connection, deleted):
+    """Write a tombstone per deleted (user_id, expense_id) pair.
+
+    Runs on the caller's connection so it commits with the delete.
+    """
+    if not deleted:
+        return
+    deleted_at = datetime.now(timezone.utc)
+    stmt = _insert(connection)(ExpenseTombstone.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["expense_id"], set_={"deleted_at": stmt.excluded.deleted_at}
+    )
+    connection.execute(
+        stmt,
+        [
+            {"expense_id": expense_id, "user_id": user_id, "deleted_at": deleted_at}
+            for user_id, expense_id in deleted
+        ],
+    )
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _collect_deleted_expenses(session, flush_context, instances):
+    deleted = session.info.setdefault(DELETED_KEY, set())
+    for obj in session.deleted:
+        if isinstance(obj, Expense):
+            deleted.add((obj.user_id, obj.id))
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _write_tombstones(session, flush_context):
+    deleted = session.info.pop(DELETED_KEY, None)
+    if deleted:
+        record_tombstones(session.connection(), deleted)
+
+
+def _after(column, id_column, position):
+    """Rows strictly after a (timestamp, id) position."""
+    at, row_id = position
+    return or_(column > at, and_(column == at, id_column > row_id))
+
+
+def first_sync_positions(until):
+    """``(changed, deleted, archived)`` positions a sync without a cursor
+    starts from.
+
+    A first sync downloads what exists, live and archived, so earlier
+    deletions don't matter: it starts after every tombstone up to ``until``.
+    """
+    return None, (until, uuid.UUID(int=(1 << 128) - 1)), ARCHIVE_START
+
+
+def changes_since(session, user_id, changed_after, deleted_after, until, limit):
+    """One page of a user's changes, oldest first.
+
+    ``changed_after`` and ``deleted_after`` are (timestamp, id) positions,
+    or None to start from the beginning. Only changes up to ``until`` are
+    returned, so transactions still in flight aren't skipped. Returns
+    ``(expenses, tombstones, has_more)``, at most ``limit`` of each.
+    """
+    query = select(Expense).where(
+        Expense.user_id == user_id, Expense.updated_at <= until
+    )
+    if changed_after:
+        query = query.where(_after(Expense.updated_at, Expense.id, changed_after))
+    expenses = (
+        session.execute(
+            query.order_by(Expense.updated_at, Expense.id).limit(limit + 1)
+        )
+        .scalars()
+        .all()
+    )
+
+    query = select(ExpenseTombstone).where(
+        ExpenseTombstone.user_id == user_id, ExpenseTombstone.deleted_at <= until
+    )
+    if deleted_after:
+        query = query.where(
+            _after(
+                ExpenseTombstone.deleted_at, ExpenseTombstone.expense_id, deleted_after
+            )
+        )
+    tombstones = (
+        session.execute(
+            query.order_by(ExpenseTombstone.deleted_at, ExpenseTombstone.expense_id)
+            .limit(limit + 1)
+        )
+        .scalars()
+        .all()
+    )
+
+    has_more = len(expenses) > limit or len(tombstones) > limit
+    return expenses[:limit], tombstones[:limit], has_more
+
+
+def archived_changes(session, user_id, before, limit):
+    """Up to ``limit`` of a user's archived expenses, newest first, strictly
+    before a (date, id) position.
+
+    Returns ``(expenses, position)``; ``position`` is where the next page
+    starts, or None once the archive is exhausted.
+    """
+    reader = get_archive(session, user_id)
+    if reader is None:
+        return [], None
+    page = reader.page(None, None, {}, before, limit + 1)
+    expenses = [expense for expense, _ in page]
+    if len(expenses) <= limit:
+        return expenses, None
+    expenses = expenses[:limit]
+    return expenses, (expenses[-1].date, expenses[-1].id)
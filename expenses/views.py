@@ -1,15 +1,27 @@
 
-from flask import Blueprint, render_template, redirect, send_file, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, send_file, url_for, flash, request, jsonify, abort
+from flask import Response, current_app, stream_with_context
 from flask_login import login_required, current_user
 from extensions import db
-from models import Expense
+from database import read_replica
+from ratelimit import rate_limit
+from models import BASE_CURRENCY, Expense, FxRate, period_bounds
+from fx import converted_amount, rate_join
 from .forms import ExpenseForm
+from .bulk import MAX_BULK_IDS, delete_expenses, update_expenses
+from .archive import archived_expenses
+from api.serializers import EXPENSE_FIELDS, serialize_expense
 from constants.categories import (
     EXPENSE_CATEGORIES,
     validate_category,
     get_all_categories,
 )
-from datetime import datetime, timezone
+from constants.payment_methods import PAYMENT_METHODS, validate_payment_method
+from datetime import date, datetime, timedelta, timezone
+from itertools import chain
+import csv
+import io
+import uuid
 from sqlalchemy import extract, func
 
 expenses_bp = Blueprint("expenses", __name__, url_prefix="/expenses")
@@ -17,6 +29,7 @@ expenses_bp = Blueprint("expenses", __name__, url_prefix="/expenses")
 
 @expenses_bp.route("/")
 @login_required
+@read_replica
 def index():
     """List all expenses for the current user."""
     # Get filter parameters
@@ -29,24 +42,32 @@ def index():
         Expense.date.desc()
     )
 
-    # Apply filters
+    # Apply filters (date ranges where possible so partitions can be pruned)
     if year:
-        query = query.filter(extract("year", Expense.date) == year)
-    if month:
+        query = query.filter(Expense.in_period(year, month or 0))
+    elif month:
         query = query.filter(extract("month", Expense.date) == month)
     if category:
         query = query.filter_by(main_category=category)
 
     expenses = query.all()
 
-    # Calculate totals
-    total = sum(expense.amount for expense in expenses)
+    # Calculate totals in the base currency
+    total = (
+        query.with_entities(func.coalesce(func.sum(converted_amount()), 0))
+        .outerjoin(FxRate, rate_join())
+        .order_by(None)
+        .scalar()
+    )
 
     return render_template(
         "expenses/index.html",
         expenses=expenses,
         total=total,
         categories=get_all_categories(),
+        category_map=EXPENSE_CATEGORIES,
+        payment_methods=PAYMENT_METHODS,
+        base_currency=BASE_CURRENCY,
     )
 
 
@@ -66,6 +87,7 @@ def add():
             user_id=current_user.id,
             name=form.name.data,
             amount=form.amount.data,
+            currency=form.currency.data,
             main_category=form.main_category.data,
             subcategory=form.subcategory.data,
             date=form.date.data,
@@ -110,6 +132,7 @@ def edit(expense_id):
 
         expense.name = form.name.data
         expense.amount = form.amount.data
+        expense.currency = form.currency.data
         expense.main_category = form.main_category.data
         expense.subcategory = form.subcategory.data
         expense.date = form.date.data
@@ -151,6 +174,242 @@ def delete(expense_id):
     return redirect(url_for("expenses.index"))
 
 
+def _bulk_payload():
+    """Request data for a bulk action, from a JSON body or a submitted form."""
+    if request.is_json:
+        return request.get_json(silent=True) or {}
+    return request.form
+
+
+def _bulk_ids(payload):
+    """Parse and de-duplicate the expense ids of a bulk action."""
+    raw_ids = payload.get("ids", []) if request.is_json else payload.getlist("ids")
+    if not isinstance(raw_ids, list) or len(raw_ids) > MAX_BULK_IDS:
+        abort(400)
+    try:
+        return list({uuid.UUID(str(raw_id)) for raw_id in raw_ids})
+    except ValueError:
+        abort(400)
+
+
+def _bulk_done(message, **counts):
+    """Row counts as JSON for API clients, a flash message for the HTML page."""
+    if request.is_json:
+        return jsonify(counts)
+    flash(message, "success")
+    return redirect(url_for("expenses.index"))
+
+
+def _bulk_failed(message, status):
+    if request.is_json:
+        return jsonify({"error": message}), status
+    flash(message, "danger")
+    return redirect(url_for("expenses.index"))
+
+
+@expenses_bp.route("/bulk/delete", methods=["POST"])
+@login_required
+@rate_limit("bulk")
+def bulk_delete():
+    """Delete many expenses with a single DELETE statement."""
+    ids = _bulk_ids(_bulk_payload())
+
+    try:
+        deleted = delete_expenses(current_user.id, ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error bulk deleting expenses: {e}")
+        return _bulk_failed("An error occurred while deleting the expenses.", 500)
+
+    return _bulk_done(f"Deleted {deleted} expenses.", deleted=deleted)
+
+
+@expenses_bp.route("/bulk/category", methods=["POST"])
+@login_required
+@rate_limit("bulk")
+def bulk_recategorize():
+    """Move many expenses to another category with a single UPDATE statement."""
+    payload = _bulk_payload()
+    ids = _bulk_ids(payload)
+    main_category = payload.get("main_category")
+    subcategory = payload.get("subcategory")
+
+    if not validate_category(main_category, subcategory):
+        return _bulk_failed("Invalid category selection.", 400)
+
+    try:
+        updated = update_expenses(
+            current_user.id, ids, main_category=main_category, subcategory=subcategory
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error bulk recategorizing expenses: {e}")
+        return _bulk_failed("An error occurred while updating the expenses.", 500)
+
+    return _bulk_done(f"Recategorized {updated} expenses.", updated=updated)
+
+
+@expenses_bp.route("/bulk/payment-method", methods=["POST"])
+@login_required
+@rate_limit("bulk")
+def bulk_payment_method():
+    """Change the payment method of many expenses with a single UPDATE statement."""
+    payload = _bulk_payload()
+    ids = _bulk_ids(payload)
+    payment_method = payload.get("payment_method") or None
+
+    if not validate_payment_method(payment_method):
+        return _bulk_failed("Invalid payment method.", 400)
+
+    try:
+        updated = update_expenses(current_user.id, ids, payment_method=payment_method)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error bulk updating payment methods: {e}")
+        return _bulk_failed("An error occurred while updating the expenses.", 500)
+
+    return _bulk_done(f"Updated {updated} expenses.", updated=updated)
+
+
+# Columns of the CSV export, in order
+CSV_COLUMNS = (
+    "date",
+    "name",
+    "amount",
+    "currency",
+    "main_category",
+    "subcategory",
+    "payment_method",
+    "description",
+)
+
+
+@expenses_bp.route("/export.csv")
+@login_required
+@rate_limit("export", heavy=True)
+@read_replica
+def export_csv():
+    """Stream all of the user's expenses, archived ones included, as CSV."""
+    user_id = current_user.id
+    expenses = db.session.scalars(
+        db.select(Expense)
+        .where(Expense.user_id == user_id)
+        .order_by(Expense.date, Expense.id)
+        .execution_options(yield_per=1000)
+    )
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for expense in chain(archived_expenses(user_id), expenses):
+            values = (getattr(expense, column) for column in CSV_COLUMNS)
+            writer.writerow(["" if value is None else value for value in values])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=expenses.csv"},
+    )
+
+
+def _stream_fields():
+    """Fields requested with ``fields=a,b``; all of them by default.
+
+    Raises ValueError on an unknown field.
+    """
+    raw = request.args.get("fields")
+    if not raw:
+        return EXPENSE_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = set(fields) - set(EXPENSE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def _stream_range():
+    """[start, end) dates from ``year``/``month`` and ``start``/``end`` (inclusive).
+
+    Either bound may be None. Raises ValueError on a malformed date.
+    """
+    year = request.args.get("year", type=int)
+    month = request.args.get("month", 0, type=int)
+    start = end = None
+    if year:
+        start, end = period_bounds(year, month)
+    if request.args.get("start"):
+        first = date.fromisoformat(request.args["start"])
+        start = first if start is None else max(start, first)
+    if request.args.get("end"):
+        after = date.fromisoformat(request.args["end"]) + timedelta(days=1)
+        end = after if end is None else min(end, after)
+    return start, end
+
+
+@expenses_bp.route("/stream.ndjson")
+@login_required
+@rate_limit("export", heavy=True)
+@read_replica
+def stream_ndjson():
+    """Stream the user's expenses, archived ones included, as NDJSON.
+
+    One JSON object per line, oldest first. Filters: ``year`` and ``month``,
+    ``start``/``end`` dates, ``category``. ``fields=name,amount`` selects
+    only those columns (plus ``id``). Rows come off a server-side cursor,
+    so memory stays flat however long the history is.
+    """
+    try:
+        fields = _stream_fields()
+        start, end = _stream_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    category = request.args.get("category")
+
+    user_id = current_user.id
+    query = db.select(Expense.id, *(getattr(Expense, f) for f in fields)).where(
+        Expense.user_id == user_id
+    )
+    if start:
+        query = query.where(Expense.date >= start)
+    if end:
+        query = query.where(Expense.date < end)
+    if category:
+        query = query.where(Expense.main_category == category)
+    rows = db.session.execute(
+        query.order_by(Expense.date, Expense.id).execution_options(yield_per=1000)
+    )
+
+    archived = archived_expenses(user_id, start, end)
+    if category:
+        archived = (e for e in archived if e.main_category == category)
+
+    def generate():
+        dumps = current_app.json.dumps
+        chunk = []
+        size = 0
+        for expense in chain(archived, rows):
+            line = dumps(serialize_expense(expense, fields))
+            chunk.append(line)
+            size += len(line) + 1
+            if size > 64 * 1024:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+                size = 0
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @expenses_bp.route("/api/subcategories/<main_category>")
 @login_required
 def get_subcategories(main_category):
@@ -0,0 +1,285 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from expenses.archive import ArchiveReader, archive_path
+from models import Expense, ExpenseArchive, User
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for export-parquet
+    pa = pq = None
+
+EXPORT_FORMATS = ("parquet", "arrow")
+
+# Incremental state, kept next to the exported files
+WATERMARK_FILE = "_watermark.json"
+
+# Expense columns exported, in order
+EXPENSE_COLUMNS = (
+    "id",
+    "user_id",
+    "date",
+    "amount",
+    "currency",
+    "name",
+    "description",
+    "main_category",
+    "subcategory",
+    "payment_method",
+    "created_at",
+    "updated_at",
+)
+
+
+def arrow_schema(with_users=False):
+    fields = [
+        ("id", pa.string()),
+        ("user_id", pa.string()),
+        ("date", pa.date32()),
+        ("amount", pa.decimal128(10, 2)),
+        ("currency", pa.string()),
+        ("name", pa.string()),
+        ("description", pa.string()),
+        ("main_category", pa.string()),
+        ("subcategory", pa.string()),
+        ("payment_method", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+    ]
+    # No credentials or contact details, only who owns the expense
+    if with_users:
+        fields += [
+            ("username", pa.string()),
+            ("user_created_at", pa.timestamp("us", tz="UTC")),
+        ]
+    return pa.schema(fields)
+
+
+def export_query(start=None, end=None, since=None, until=None, with_users=False):
+    """Expenses to export, ordered so each month's rows arrive together."""
+    columns = [getattr(Expense, column) for column in EXPENSE_COLUMNS]
+    query = select(*columns)
+    if with_users:
+        query = query.add_columns(
+            User.username, User.created_at.label("user_created_at")
+        ).join(User, User.id == Expense.user_id)
+    if start:
+        query = query.where(Expense.date >= start)
+    if end:
+        query = query.where(Expense.date <= end)
+    if since:
+        query = query.where(Expense.updated_at > since)
+    if until:
+        query = query.where(Expense.updated_at <= until)
+    return query.order_by(Expense.date, Expense.id)
+
+
+def read_watermark(out_dir):
+    """``updated_at`` up to which rows were already exported, or None."""
+    try:
+        with open(os.path.join(out_dir, WATERMARK_FILE)) as f:
+            return datetime.fromisoformat(json.load(f)["updated_at"])
+    except FileNotFoundError:
+        return None
+
+
+def write_watermark(out_dir, until):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"updated_at": until.isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+class PartitionedWriter:
+    """Writes record batches into hive-style ``year=/month=`` partitions.
+
+    When rows arrive ordered by date (``ordered``), only one partition file
+    is open at a time and memory stays at one batch. Otherwise every
+    partition written to stays open until :meth:`close`.
+    """
+
+    def __init__(self, out_dir, schema, fmt, run_id, ordered=True):
+        self.out_dir = out_dir
+        self.schema = schema
+        self.fmt = fmt
+        self.run_id = run_id
+        self.ordered = ordered
+        self.files = []
+        self._writers = {}
+
+    def _open(self, key):
+        if self.ordered:
+            self.close()
+        year, month = key
+        directory = os.path.join(self.out_dir, f"year={year}", f"month={month:02d}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.run_id}.{self.fmt}")
+        if self.fmt == "parquet":
+            writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(path, self.schema)
+        self._writers[key] = writer
+        self.files.append(path)
+
+    def write(self, key, rows):
+        if key not in self._writers:
+            self._open(key)
+        columns = list(zip(*rows))
+        arrays = [
+            pa.array(_plain(name, values), type=field.type)
+            for name, values, field in zip(self.schema.names, columns, self.schema)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.fmt == "parquet":
+            self._writers[key].write_batch(batch)
+        else:
+            self._writers[key].write(batch)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+
+def _plain(name, values):
+    if name in ("id", "user_id"):
+        return [str(value) for value in values]
+    return values
+
+
+def _utc(value):
+    # SQLite hands back naive timestamps; they are UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def archived_rows(
+    executor, start=None, end=None, since=None, until=None, with_users=False
+):
+    """Archived expenses to export, one user's archive at a time, as tuples
+    in :func:`arrow_schema` order.
+
+    Archived rows can no longer change, so archives last written before
+    ``since`` are skipped without being opened.
+    """
+    query = select(
+        ExpenseArchive.user_id,
+        ExpenseArchive.generation,
+        ExpenseArchive.archived_before,
+    )
+    if with_users:
+        query = query.add_columns(
+            User.username, User.created_at.label("user_created_at")
+        ).join(User, User.id == ExpenseArchive.user_id)
+    if since:
+        query = query.where(ExpenseArchive.updated_at > since)
+
+    for meta in executor.execute(query.order_by(ExpenseArchive.user_id)).all():
+        reader = ArchiveReader(
+            archive_path(meta.user_id, meta.generation), meta.archived_before
+        )
+        for record in reader.rows(start, end + timedelta(days=1) if end else None):
+            updated_at = _utc(record.updated_at)
+            if (since and updated_at <= since) or (until and updated_at > until):
+                continue
+            row = (
+                record.id,
+                meta.user_id,
+                record.date,
+                record.amount,
+                record.currency,
+                record.name,
+                record.description,
+                record.main_category,
+                record.subcategory,
+                record.payment_method,
+                record.created_at,
+                record.updated_at,
+            )
+            if with_users:
+                row += (meta.username, meta.user_created_at)
+            yield row
+
+
+def _flush(writer, pending):
+    for key in sorted(pending):
+        writer.write(key, pending[key])
+    pending.clear()
+
+
+def export_expenses(
+    engine,
+    out_dir,
+    fmt="parquet",
+    start=None,
+    end=None,
+    with_users=False,
+    incremental=False,
+    batch_size=50000,
+    lag=60,
+    now=None,
+):
+    """Stream expenses into partitioned Parquet/Arrow files under ``out_dir``.
+
+    Uses a server-side cursor and ``batch_size``-row record batches, so
+    memory does not grow with the table. Incremental runs only export rows
+    updated since the previous run's watermark; rows updated in the last
+    ``lag`` seconds wait for the next run so in-flight transactions aren't
+    skipped. Archived expenses follow, in ``part-<run>-archive`` files next
+    to the others. They come a user at a time rather than by date, so they
+    are held until a batch's worth has built up, then written to each of
+    their partitions' files, which stay open until the end. Returns
+    ``(rows, files)``.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required for exports: pip install pyarrow")
+
+    now = now or datetime.now(timezone.utc)
+    until = now - timedelta(seconds=lag)
+    since = read_watermark(out_dir) if incremental else None
+    os.makedirs(out_dir, exist_ok=True)
+
+    schema = arrow_schema(with_users)
+    run_id = now.strftime("%Y%m%dT%H%M%S%f")
+    writer = PartitionedWriter(out_dir, schema, fmt, run_id)
+    archive_writer = PartitionedWriter(
+        out_dir, schema, fmt, f"{run_id}-archive", ordered=False
+    )
+    query = export_query(start, end, since, until, with_users)
+    rows_written = 0
+    try:
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, yield_per=batch_size
+            ).execute(query)
+            for chunk in result.partitions():
+                run, key = [], None
+                for row in chunk:
+                    row_key = (row.date.year, row.date.month)
+                    if row_key != key and run:
+                        writer.write(key, run)
+                        run = []
+                    key = row_key
+                    run.append(row)
+                if run:
+                    writer.write(key, run)
+                rows_written += len(chunk)
+            writer.close()
+
+            # One batch in total, split by partition
+            pending, held = {}, 0
+            for row in archived_rows(connection, start, end, since, until, with_users):
+                pending.setdefault((row[2].year, row[2].month), []).append(row)
+                held += 1
+                if held >= batch_size:
+                    _flush(archive_writer, pending)
+                    held = 0
+                rows_written += 1
+            _flush(archive_writer, pending)
+    finally:
+        writer.close()
+        archive_writer.close()
+
+    write_watermark(out_dir, until)
+    return rows_written, writer.files + archive_writer.files
@@ -0,0 +1,196 @@
+import csv
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+import numpy as np
+from sqlalchemy import and_, case, delete, func, insert, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import Date
+from models import BASE_CURRENCY, Expense, FxRate
+
+
+class month_of(FunctionElement):
+    """First day of a date's month, comparable with ``FxRate.month``."""
+
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(month_of)
+def _month_of(element, compiler, **kw):
+    # SQLite keeps dates as ISO text, which is what this returns
+    return f"date({compiler.process(element.clauses, **kw)}, 'start of month')"
+
+
+@compiles(month_of, "postgresql")
+def _month_of_postgresql(element, compiler, **kw):
+    day = compiler.process(element.clauses, **kw)
+    return f"CAST(date_trunc('month', {day}) AS DATE)"
+
+
+def rate_join():
+    """ON clause of the outer join from expenses to their month's rate."""
+    return and_(
+        FxRate.currency == Expense.currency, FxRate.month == month_of(Expense.date)
+    )
+
+
+def converted_amount():
+    """``Expense.amount`` in BASE_CURRENCY, for queries joined on rate_join().
+
+    A month without a loaded rate uses the latest earlier one; the lookup
+    only runs for such rows. Expenses older than a currency's first rate
+    stay unconverted.
+    """
+    earlier = aliased(FxRate)
+    fallback = (
+        select(earlier.rate)
+        .where(
+            earlier.currency == Expense.currency,
+            earlier.month <= month_of(Expense.date),
+        )
+        .order_by(earlier.month.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    return case(
+        (Expense.currency == BASE_CURRENCY, Expense.amount),
+        else_=Expense.amount * func.coalesce(FxRate.rate, fallback, 1),
+    )
+
+
+def rate_factors(rates, currencies, months):
+    """Conversion factor per row, with the same fallbacks as converted_amount().
+
+    ``rates`` comes from RateCache.get(); ``currencies`` is an array of
+    codes and ``months`` a matching datetime64[M] array.
+    """
+    factors = np.ones(len(months))
+    for currency in np.unique(currencies):
+        if currency == BASE_CURRENCY or currency not in rates:
+            continue
+        mask = currencies == currency
+        rate_months, values = rates[currency]
+        index = np.searchsorted(rate_months, months[mask], side="right") - 1
+        factors[mask] = np.where(index >= 0, values[np.maximum(index, 0)], 1.0)
+    return factors
+
+
+class RateCache:
+    """This process's copy of fx_rates, for converting outside of SQL.
+
+    Each use compares the table's load stamp (row count and newest
+    ``loaded_at``) with the copy's and reloads it when any process has
+    loaded new rates since.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._rates = {}
+        self.reloads = 0
+
+    def get(self, executor):
+        """``{currency: (months, rates)}`` arrays sorted by month.
+
+        ``executor`` is a session or connection.
+        """
+        stamp = tuple(
+            executor.execute(select(func.count(), func.max(FxRate.loaded_at))).one()
+        )
+        with self._lock:
+            if stamp == self._stamp:
+                return self._rates
+
+        by_currency = defaultdict(lambda: ([], []))
+        for currency, month, rate in executor.execute(
+            select(FxRate.currency, FxRate.month, FxRate.rate).order_by(
+                FxRate.currency, FxRate.month
+            )
+        ):
+            by_currency[currency][0].append(month)
+            by_currency[currency][1].append(float(rate))
+        rates = {
+            currency: (
+                np.array(months, dtype="datetime64[M]"),
+                np.array(values, dtype=np.float64),
+            )
+            for currency, (months, values) in by_currency.items()
+        }
+        with self._lock:
+            self._stamp = stamp
+            self._rates = rates
+            self.reloads += 1
+        return rates
+
+    def clear(self):
+        with self._lock:
+            self._stamp = None
+            self._rates = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {"currencies": len(self._rates), "reloads": self.reloads}
+
+
+rate_cache = RateCache()
+
+
+def read_rates(path):
+    """``{(currency, month): rate}`` from a CSV with currency,month,rate columns.
+
+    ``rate`` is one unit of ``currency`` in BASE_CURRENCY. ``month`` is
+    YYYY-MM or a full date; several rows in a month (daily rates) are
+    averaged. Raises ValueError on a malformed file.
+    """
+    sums = defaultdict(lambda: [Decimal(0), 0])
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = {"currency", "month", "rate"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+        for line, row in enumerate(reader, start=2):
+            try:
+                currency = row["currency"].strip().upper()
+                month = date.fromisoformat(row["month"].strip()[:7] + "-01")
+                rate = Decimal(row["rate"].strip())
+            except (AttributeError, InvalidOperation, ValueError):
+                raise ValueError(f"Line {line}: invalid row {row}")
+            if len(currency) != 3 or not rate.is_finite() or rate <= 0:
+                raise ValueError(f"Line {line}: invalid currency or rate")
+            if currency != BASE_CURRENCY:
+                total = sums[(currency, month)]
+                total[0] += rate
+                total[1] += 1
+    return {
+        key: (total / count).quantize(Decimal("1e-8"))
+        for key, (total, count) in sums.items()
+    }
+
+
+def store_rates(connection, rates):
+    """Replace the stored rates of the given (currency, month) keys.
+
+    Returns ``{currency: earliest month loaded}``.
+    """
+    table = FxRate.__table__
+    months = defaultdict(list)
+    for currency, month in rates:
+        months[currency].append(month)
+    for currency, loaded in months.items():
+        connection.execute(
+            delete(table).where(table.c.currency == currency, table.c.month.in_(loaded))
+        )
+
+    loaded_at = datetime.now(timezone.utc)
+    connection.execute(
+        insert(table),
+        [
+            {"currency": c, "month": m, "rate": rate, "loaded_at": loaded_at}
+            for (c, m), rate in rates.items()
+        ],
+    )
+    return {currency: min(loaded) for currency, loaded in months.items()}
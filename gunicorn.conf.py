@@ -0,0 +1,51 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master (preload_app), so its startup work,
+# including the database check and create_all, runs once rather than per
+# worker, and workers share its memory copy-on-write. Each worker then drops
+# the pooled connections it inherited and warms up before taking traffic.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+preload_app = True
+
+# Threaded workers: requests mostly wait on the database, so a few threads
+# per process serve more users than extra processes would. Keep
+# workers x threads within the connection budget (see DB_MAX_CONNECTIONS).
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth; jitter keeps them from
+# all restarting at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+
+def when_ready(server):
+    # The master never queries again; close what the startup check opened
+    from app import app
+    from serving import dispose_engines
+
+    dispose_engines(app)
+
+
+def post_fork(server, worker):
+    from app import app
+    from serving import dispose_engines
+
+    dispose_engines(app, close=False)
+
+
+def post_worker_init(worker):
+    from app import app
+    from serving import warm_up
+
+    warm_up(app)
@@ -0,0 +1,31 @@
+import hmac
+from flask import Blueprint, abort, current_app, jsonify, request
+
+metrics_bp = Blueprint("metrics", __name__)
+
+# name -> zero-argument callable returning a JSON-serialisable snapshot
+_providers = {}
+
+
+def register_metrics(name, provider):
+    """Expose ``provider()`` under ``name`` on the metrics endpoint."""
+    _providers[name] = provider
+
+
+def collect_metrics():
+    """Snapshot every registered metrics provider."""
+    return {name: provider() for name, provider in _providers.items()}
+
+
+@metrics_bp.route("/internal/metrics")
+def metrics():
+    """Operational counters for this worker, guarded by METRICS_TOKEN."""
+    token = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        abort(404)
+
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied, f"Bearer {token}"):
+        abort(403)
+
+    return jsonify(collect_metrics())
@@ -1,9 +1,31 @@
-from datetime import datetime, timezone
-from sqlalchemy import UUID, Boolean, DateTime, Integer
+from datetime import date, datetime, timezone
+from sqlalchemy import UUID, Boolean, DateTime, Integer, and_
+import os
+import secrets
 import uuid
 from flask_login import UserMixin
 from extensions import db
 
+# Optional declarative range partitioning of the expenses table on PostgreSQL.
+# Set EXPENSES_PARTITION_BY to "year" or "month"; SQLite stays unpartitioned.
+EXPENSES_PARTITION_BY = os.environ.get("EXPENSES_PARTITION_BY", "").lower() or None
+if EXPENSES_PARTITION_BY not in (None, "year", "month"):
+    raise ValueError("EXPENSES_PARTITION_BY must be 'year' or 'month'")
+
+# Currency analytics and reports are in; other currencies convert via fx_rates
+BASE_CURRENCY = os.environ.get("BASE_CURRENCY", "USD").upper()
+
+
+def period_bounds(year, month=0):
+    """Return the [start, end) dates of a calendar year, or of a month if given."""
+    if month:
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    else:
+        start = date(year, 1, 1)
+        end = date(year + 1, 1, 1)
+    return start, end
+
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
@@ -72,6 +94,14 @@ class User(UserMixin, db.Model):
 
 class Expense(db.Model):
     __tablename__ = "expenses"
+    # Partitioned tables need the partition key in the primary key, so
+    # ``date`` joins ``id`` in the key only when partitioning is enabled.
+    __table_args__ = (
+        # Delta sync pages through a user's changes in (updated_at, id) order
+        db.Index("ix_expenses_user_updated", "user_id", "updated_at", "id"),
+        {"postgresql_partition_by": "RANGE (date)"} if EXPENSES_PARTITION_BY else {},
+    )
+
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(
         UUID(as_uuid=True), db.ForeignKey("users.id"), nullable=False, index=True
@@ -80,12 +110,24 @@ class Expense(db.Model):
     name = db.Column(db.String(64), nullable=True)
 
     amount = db.Column(db.Numeric(10, 2), nullable=False)
+    # ISO 4217 code of ``amount``
+    currency = db.Column(
+        db.String(3),
+        nullable=False,
+        default=BASE_CURRENCY,
+        server_default=BASE_CURRENCY,
+    )
     description = db.Column(db.String(255))
 
     main_category = db.Column(db.String(64), nullable=False, index=True)
     subcategory = db.Column(db.String(64), nullable=False, index=True)
 
-    date = db.Column(db.Date, nullable=False, index=True)
+    date = db.Column(
+        db.Date,
+        nullable=False,
+        index=True,
+        primary_key=EXPENSES_PARTITION_BY is not None,
+    )
     payment_method = db.Column(db.String(64))
 
     created_at = db.Column(
@@ -104,3 +146,262 @@ class Expense(db.Model):
     def __repr__(self):
         return f"<Expense {self.name} - ${self.amount}>"
 
+    @classmethod
+    def in_period(cls, year, month=0):
+        """Filter for a calendar year, or a single month when ``month`` is set.
+
+        Plain range comparisons on ``date`` (instead of ``extract()``) can use
+        the date index and let PostgreSQL prune partitions.
+        """
+        start, end = period_bounds(year, month)
+        return and_(cls.date >= start, cls.date < end)
+
+
+
+class ExpenseRollup(db.Model):
+    """Per-user monthly totals by main category, maintained on every write.
+
+    Totals are in BASE_CURRENCY, converted with the month's FX rates.
+
+    Lets the dashboard and period summaries read a handful of rows instead of
+    scanning expenses. See ``expenses.rollups``.
+    """
+
+    __tablename__ = "expense_rollups"
+    user_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey("users.id"), primary_key=True
+    )
+    # First day of the month
+    month = db.Column(db.Date, primary_key=True)
+    main_category = db.Column(db.String(64), primary_key=True)
+
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    count = db.Column(Integer, nullable=False, default=0)
+    # Cents spent on each day of the month, packed int64s (rollups.pack_daily)
+    daily = db.Column(db.LargeBinary)
+
+    def __repr__(self):
+        return f"<ExpenseRollup {self.month:%Y-%m} {self.main_category} ${self.total}>"
+
+
+class ExpenseVersion(db.Model):
+    """Per-user, per-month counter bumped whenever that month's expenses change.
+
+    Cached analytics are keyed by these versions, so any write invalidates
+    them on every worker without a cache round trip.
+    """
+
+    __tablename__ = "expense_versions"
+    user_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey("users.id"), primary_key=True
+    )
+    # First day of the month
+    month = db.Column(db.Date, primary_key=True)
+    version = db.Column(Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"<ExpenseVersion {self.month:%Y-%m} v{self.version}>"
+
+
+class ExpenseTombstone(db.Model):
+    """Record of a deleted expense, so syncing clients can drop their copy.
+
+    Written in the same transaction as the delete; see ``expenses.sync``.
+    """
+
+    __tablename__ = "expense_tombstones"
+    __table_args__ = (
+        db.Index(
+            "ix_expense_tombstones_user_deleted", "user_id", "deleted_at", "expense_id"
+        ),
+    )
+    expense_id = db.Column(UUID(as_uuid=True), primary_key=True)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey("users.id"), nullable=False)
+    deleted_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f"<ExpenseTombstone {self.expense_id}>"
+
+
+class ExpenseArchive(db.Model):
+    """Where a user's archived (cold) expenses live.
+
+    Expenses dated before ``archived_before`` have been moved out of the
+    expenses table into columnar files under ``ARCHIVE_DIR``. See
+    ``expenses.archive``.
+    """
+
+    __tablename__ = "expense_archives"
+    user_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey("users.id"), primary_key=True
+    )
+    archived_before = db.Column(db.Date, nullable=False)
+    # Bumped on every re-archive; names the directory holding the files
+    generation = db.Column(Integer, nullable=False, default=1)
+    row_count = db.Column(Integer, nullable=False, default=0)
+
+    updated_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f"<ExpenseArchive before {self.archived_before} ({self.row_count} rows)>"
+
+
+class ForecastModel(db.Model):
+    """A user's fitted spending forecast for one month.
+
+    Fitted from complete months only, so it stays valid until an earlier
+    month's data changes (``history_version``) or a new month starts. See
+    ``analytics.forecast``.
+    """
+
+    __tablename__ = "forecast_models"
+    user_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey("users.id"), primary_key=True
+    )
+    # First day of the month the forecast is for
+    month = db.Column(db.Date, nullable=False)
+    history_version = db.Column(Integer, nullable=False)
+    params = db.Column(db.JSON, nullable=False)
+
+    fitted_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f"<ForecastModel {self.month:%Y-%m} v{self.history_version}>"
+
+
+class Household(db.Model):
+    """A group of users, such as a couple or a family, with combined analytics."""
+
+    __tablename__ = "households"
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = db.Column(db.String(100), nullable=False)
+    # Shared with the people who should be able to join
+    invite_code = db.Column(
+        db.String(32),
+        nullable=False,
+        unique=True,
+        default=lambda: secrets.token_urlsafe(12),
+    )
+
+    created_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f"<Household {self.name}>"
+
+
+class HouseholdMember(db.Model):
+    """A user's membership of a household; a user is in at most one."""
+
+    __tablename__ = "household_members"
+    user_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey("users.id"), primary_key=True
+    )
+    household_id = db.Column(
+        UUID(as_uuid=True),
+        db.ForeignKey("households.id"),
+        nullable=False,
+        index=True,
+    )
+
+    joined_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f"<HouseholdMember {self.user_id} of {self.household_id}>"
+
+
+class FxRate(db.Model):
+    """Monthly exchange rate: one unit of ``currency`` in BASE_CURRENCY.
+
+    Loaded from a file with ``flask load-fx-rates``; see ``fx``.
+    """
+
+    __tablename__ = "fx_rates"
+    currency = db.Column(db.String(3), primary_key=True)
+    # First day of the month
+    month = db.Column(db.Date, primary_key=True)
+    rate = db.Column(db.Numeric(18, 8), nullable=False)
+
+    loaded_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f"<FxRate {self.currency} {self.month:%Y-%m} {self.rate}>"
+
+
+class PlatformStatsRun(db.Model):
+    """One run of ``flask platform-stats``; the latest one is what admins see."""
+
+    __tablename__ = "platform_stats_runs"
+    id = db.Column(Integer, primary_key=True)
+    computed_at = db.Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+    shards = db.Column(Integer, nullable=False)
+    # Accounts that were not deleted when the run started
+    users = db.Column(Integer, nullable=False)
+    seconds = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<PlatformStatsRun {self.computed_at:%Y-%m-%d %H:%M}>"
+
+
+class PlatformMonthStat(db.Model):
+    """Platform-wide totals for one month, from the latest stats run.
+
+    Totals are in BASE_CURRENCY; see ``analytics.platform_stats``.
+    """
+
+    __tablename__ = "platform_month_stats"
+    # First day of the month
+    month = db.Column(db.Date, primary_key=True)
+    total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    count = db.Column(Integer, nullable=False, default=0)
+    # Users with at least one expense in the month
+    active_users = db.Column(Integer, nullable=False, default=0)
+    # Accounts created in the month
+    new_users = db.Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<PlatformMonthStat {self.month:%Y-%m} ${self.total}>"
+
+
+class PlatformCategoryStat(db.Model):
+    """Platform-wide spending on one main category in one month."""
+
+    __tablename__ = "platform_category_stats"
+    # First day of the month
+    month = db.Column(db.Date, primary_key=True)
+    main_category = db.Column(db.String(64), primary_key=True)
+    total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    count = db.Column(Integer, nullable=False, default=0)
+    # Users who spent on the category in the month
+    users = db.Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<PlatformCategoryStat {self.month:%Y-%m} {self.main_category}>"
@@ -0,0 +1,198 @@
+import math
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from flask import current_app, jsonify, make_response, request
+from flask_login import current_user
+from metrics import register_metrics
+
+try:
+    import redis
+except ImportError:  # optional, only needed for RATE_LIMIT_REDIS_URL
+    redis = None
+
+# Route class -> (tokens refilled per second, bucket size)
+DEFAULT_RATE_LIMITS = {
+    # A dashboard filter change fires seven chart requests
+    "analytics": (2.0, 30),
+    "export": (0.05, 3),
+    "bulk": (1.0, 10),
+}
+
+# Buckets kept by the in-memory backend before idle ones are dropped
+MAX_MEMORY_BUCKETS = 10000
+
+
+class MemoryBackend:
+    """Token buckets in this process; each worker limits on its own."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take a token; returns ``(allowed, retry_after_seconds)``."""
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # A bucket idle long enough to refill completely carries no state
+        for key, (tokens, stamp) in list(self._buckets.items()):
+            if now - stamp > 3600:
+                del self._buckets[key]
+
+
+class RedisBackend:
+    """Token buckets in Redis, shared by every worker and host."""
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call("HMGET", KEYS[1], "tokens", "stamp")
+    local tokens = tonumber(state[1]) or burst
+    local stamp = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(now - stamp, 0) * rate)
+    local allowed = 0
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call("HSET", KEYS[1], "tokens", tokens, "stamp", now)
+    redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL needs the redis package")
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, now):
+        allowed, retry_after = self._take(
+            keys=[f"ratelimit:{key}"], args=[rate, burst, now]
+        )
+        return bool(allowed), float(retry_after)
+
+
+class RateLimiter:
+    """Per-user token buckets per route class, plus a cap on heavy routes."""
+
+    def __init__(self, backend, limits, heavy_concurrency):
+        self.backend = backend
+        self.limits = limits
+        self.heavy_concurrency = heavy_concurrency
+        self._heavy = threading.BoundedSemaphore(heavy_concurrency)
+        self.allowed = Counter()
+        self.rejected = Counter()
+
+    def take(self, route_class, user_key):
+        rate, burst = self.limits[route_class]
+        allowed, retry_after = self.backend.take(
+            f"{route_class}:{user_key}", rate, burst, time.time()
+        )
+        (self.allowed if allowed else self.rejected)[route_class] += 1
+        return allowed, retry_after
+
+    def enter_heavy(self):
+        if self._heavy.acquire(blocking=False):
+            return True
+        self.rejected["heavy"] += 1
+        return False
+
+    def leave_heavy(self):
+        self._heavy.release()
+
+    def snapshot(self):
+        return {
+            "allowed": dict(self.allowed),
+            "rejected": dict(self.rejected),
+            "heavy_concurrency": self.heavy_concurrency,
+        }
+
+
+def too_many_requests(retry_after):
+    """429 with Retry-After, as JSON for API calls and text otherwise."""
+    message = "Too many requests. Please slow down and try again shortly."
+    if "/api/" in request.path or request.accept_mimetypes.best == "application/json":
+        response = make_response(jsonify({"error": message}), 429)
+    else:
+        response = make_response(message, 429)
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limit(route_class, heavy=False):
+    """Limit a view per user by its route class's token bucket.
+
+    With ``heavy``, at most RATE_LIMIT_HEAVY_CONCURRENCY such requests run
+    at once in this worker. Put it below ``@login_required``.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            limiter = current_app.extensions.get("rate_limiter")
+            if limiter is None:
+                return view(*args, **kwargs)
+
+            user_key = (
+                current_user.get_id()
+                if current_user.is_authenticated
+                else request.remote_addr
+            )
+            allowed, retry_after = limiter.take(route_class, user_key)
+            if not allowed:
+                return too_many_requests(retry_after)
+            if not heavy:
+                return view(*args, **kwargs)
+
+            if not limiter.enter_heavy():
+                return too_many_requests(1)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                limiter.leave_heavy()
+                raise
+            # Generated bodies keep working after the view returns; files
+            # passed straight through are already built
+            if response.is_streamed and not response.direct_passthrough:
+                response.call_on_close(limiter.leave_heavy)
+            else:
+                limiter.leave_heavy()
+            return response
+
+        return wrapped
+
+    return decorator
+
+
+def init_rate_limits(app):
+    """Set up the limiter from RATE_LIMIT_* config unless it is disabled."""
+    app.config.setdefault("RATE_LIMIT_ENABLED", True)
+    app.config.setdefault("RATE_LIMIT_REDIS_URL", None)
+    app.config.setdefault("RATE_LIMIT_HEAVY_CONCURRENCY", 2)
+    limits = dict(DEFAULT_RATE_LIMITS, **app.config.get("RATE_LIMITS", {}))
+    if not app.config["RATE_LIMIT_ENABLED"]:
+        return
+
+    url = app.config["RATE_LIMIT_REDIS_URL"]
+    backend = RedisBackend(url) if url else MemoryBackend()
+    limiter = RateLimiter(backend, limits, app.config["RATE_LIMIT_HEAVY_CONCURRENCY"])
+    app.extensions["rate_limiter"] = limiter
+    register_metrics("rate_limits", limiter.snapshot)
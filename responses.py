@@ -0,0 +1,102 @@
+import gzip
+import os
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib json provider
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# Response types worth compressing. Not text/html: pages hold the CSRF token
+# next to reflected input, which compression would leak (BREACH).
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/css",
+    "text/csv",
+    "application/javascript",
+}
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson.
+
+    Dates and anything orjson can't encode natively (Decimal, ...) go through
+    Flask's default conversion, so output matches the stdlib provider.
+    """
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.options)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json(app):
+    """Use orjson for JSON when installed, unless JSON_PROVIDER=default."""
+    choice = os.environ.get("JSON_PROVIDER", "orjson").lower()
+    if choice == "orjson" and orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+def _pick_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_body(data, encoding):
+    """Compress ``data`` for the given Content-Encoding."""
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def init_compression(app):
+    """Compress text responses above COMPRESS_MIN_SIZE bytes with br or gzip."""
+    app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code >= 300
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = _pick_encoding()
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        response.set_data(compress_body(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,50 @@
+import logging
+import time
+from sqlalchemy import text
+from extensions import db
+from fx import rate_cache
+
+logger = logging.getLogger(__name__)
+
+# Pages rendered once per worker before it takes traffic; no login needed
+WARMUP_PATHS = ("/", "/auth/login", "/auth/signup")
+
+
+def dispose_engines(app, close=True):
+    """Drop the pooled connections of every engine.
+
+    After a fork, pass ``close=False``: the connections belong to the parent
+    and must be forgotten, not closed underneath it.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def warm_up(app):
+    """Get a freshly forked worker ready before it accepts requests.
+
+    Compiles every template, renders the public pages, opens a connection
+    per engine and loads the FX rates, so the first users it serves don't
+    pay for any of it. Failures are logged; the worker starts regardless.
+    """
+    started = time.perf_counter()
+    try:
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+
+        client = app.test_client()
+        for path in WARMUP_PATHS:
+            client.get(path)
+
+        with app.app_context():
+            for engine in db.engines.values():
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            rate_cache.get(db.session)
+    except Exception as e:
+        logger.warning(f"⚠️ Worker warm-up incomplete: {e}")
+        return False
+
+    logger.info(f"🔥 Worker warmed up in {time.perf_counter() - started:.2f}s")
+    return True
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extensions import db  # noqa: E402
+import models  # noqa: E402,F401  registers the tables
+
+
+@pytest.fixture
+def session():
+    """A plain SQLAlchemy session on a fresh in-memory SQLite database."""
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
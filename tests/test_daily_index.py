@@ -0,0 +1,96 @@
+import random
+from datetime import date, timedelta
+from types import SimpleNamespace
+import numpy as np
+from analytics.daily_index import DailyIndex, _days_in
+from expenses.rollups import pack_daily
+
+
+def rollup(month, category, cents_by_day):
+    daily = np.zeros(31, dtype=np.int64)
+    for day, cents in cents_by_day.items():
+        daily[day - 1] = cents
+    return SimpleNamespace(month=month, main_category=category, daily=pack_daily(daily))
+
+
+def random_rollups(rnd, months, categories):
+    return [
+        rollup(
+            month,
+            category,
+            {
+                rnd.randint(1, _days_in(month)): rnd.randint(1, 10000)
+                for _ in range(rnd.randint(1, 5))
+            },
+        )
+        for month in months
+        for category in categories
+        if rnd.random() < 0.7
+    ]
+
+
+def brute_totals(rollups, start, end):
+    by_category = {}
+    for r in rollups:
+        cents = np.frombuffer(r.daily, dtype="<i8")
+        for day in range(_days_in(r.month)):
+            if start <= r.month + timedelta(days=day) <= end and cents[day]:
+                by_category[r.main_category] = (
+                    by_category.get(r.main_category, 0) + int(cents[day])
+                )
+    return sum(by_category.values()), by_category
+
+
+MONTHS = [date(1900, 1, 1), date(2023, 2, 1), date(2023, 3, 1), date(2024, 12, 1)]
+CATEGORIES = ["Food", "Housing", "Travel"]
+
+
+def test_totals_match_brute_force_across_gaps():
+    rnd = random.Random(1)
+    rollups = random_rollups(rnd, MONTHS, CATEGORIES)
+    index = DailyIndex.build(rollups, {})
+    # Only the stored months' days are kept, not the 125 years between them
+    assert index.daily.shape[1] == sum(_days_in(m) for m in MONTHS)
+    for _ in range(200):
+        start = date(1899, 12, 1) + timedelta(days=rnd.randint(0, 46000))
+        end = start + timedelta(days=rnd.randint(0, 46000))
+        assert index.totals(start, end) == brute_totals(rollups, start, end)
+    assert index.totals(date(1900, 2, 1), date(2023, 1, 31)) == (0, {})
+
+
+def test_empty_index():
+    index = DailyIndex.build([], {})
+    assert index.totals(date(2020, 1, 1), date(2030, 1, 1)) == (0, {})
+    assert index.covers([])
+    assert not index.covers([rollup(date(2020, 1, 1), "Food", {1: 5})])
+
+
+def test_patched_matches_full_rebuild():
+    rnd = random.Random(2)
+    rollups = random_rollups(rnd, MONTHS, CATEGORIES)
+    index = DailyIndex.build(rollups, {})
+    for _ in range(20):
+        changed = set(rnd.sample(MONTHS, rnd.randint(1, 2)))
+        replaced = random_rollups(rnd, sorted(changed), CATEGORIES[:2])
+        rollups = [r for r in rollups if r.month not in changed] + replaced
+        assert index.covers(replaced)
+        index = index.patched(changed, replaced, {})
+        rebuilt = DailyIndex.build(rollups, {})
+        for start, end in [(MONTHS[0], MONTHS[-1] + timedelta(days=30))] + [
+            (m, m + timedelta(days=rnd.randint(0, 40))) for m in MONTHS
+        ]:
+            assert index.totals(start, end) == rebuilt.totals(start, end)
+
+
+def test_patched_without_changes_shares_arrays():
+    index = DailyIndex.build([rollup(date(2024, 1, 1), "Food", {3: 250})], {})
+    patched = index.patched(set(), [], {"v": 1})
+    assert patched.cumulative is index.cumulative
+    assert patched.totals(date(2024, 1, 1), date(2024, 1, 31)) == (250, {"Food": 250})
+
+
+def test_covers_rejects_new_months_and_categories():
+    index = DailyIndex.build([rollup(date(2024, 1, 1), "Food", {3: 250})], {})
+    assert index.covers([rollup(date(2024, 1, 1), "Food", {4: 1})])
+    assert not index.covers([rollup(date(2024, 2, 1), "Food", {4: 1})])
+    assert not index.covers([rollup(date(2024, 1, 1), "Travel", {4: 1})])
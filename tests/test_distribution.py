@@ -0,0 +1,67 @@
+import random
+import uuid
+from datetime import date
+from decimal import Decimal
+import numpy as np
+from analytics.distribution import PERCENTILE_NAMES, PERCENTILES, numpy_distribution
+from models import Expense
+
+
+def add_expenses(session, user_id, amounts_by_category):
+    for category, amounts in amounts_by_category.items():
+        for i, amount in enumerate(amounts):
+            session.add(
+                Expense(
+                    user_id=user_id,
+                    name=f"{category} {i}",
+                    amount=Decimal(f"{amount:.2f}"),
+                    currency="USD",
+                    main_category=category,
+                    subcategory="Other",
+                    date=date(2024, 1 + i % 12, 1 + i % 28),
+                )
+            )
+    session.commit()
+
+
+def test_percentiles_match_numpy(session):
+    rnd = random.Random(3)
+    user_id = uuid.uuid4()
+    stored = {
+        "Food": [round(rnd.uniform(1, 200), 2) for _ in range(101)],
+        "Travel": [round(rnd.uniform(50, 2000), 2) for _ in range(7)],
+        "Gifts": [42.0],
+    }
+    add_expenses(session, user_id, stored)
+    add_expenses(session, uuid.uuid4(), {"Food": [99999.0]})
+    extra = {"Travel": np.array([5000.0, 10.5]), "Books": np.array([12.0, 30.0])}
+
+    payload = numpy_distribution(session, [Expense.user_id == user_id], 10, extra)
+
+    combined = {category: list(amounts) for category, amounts in stored.items()}
+    for category, amounts in extra.items():
+        combined.setdefault(category, []).extend(amounts.tolist())
+    assert payload["labels"] == ["Food", "Travel", "Books", "Gifts"]
+    for i, category in enumerate(payload["labels"]):
+        values = np.array(combined[category])
+        assert payload["count"][i] == len(values)
+        assert payload["min"][i] == round(values.min(), 2)
+        assert payload["max"][i] == round(values.max(), 2)
+        for name, p in zip(PERCENTILE_NAMES, PERCENTILES):
+            assert payload[name][i] == round(float(np.percentile(values, p)), 2)
+        assert sum(payload["buckets"][i]) == len(values)
+        assert len(payload["bucket_edges"][i]) == 11
+
+
+def test_histogram_buckets(session):
+    user_id = uuid.uuid4()
+    add_expenses(session, user_id, {"Food": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]})
+    payload = numpy_distribution(session, [Expense.user_id == user_id], 5)
+    # The maximum falls in the last bucket, not one past it
+    assert payload["buckets"] == [[2, 2, 2, 2, 3]]
+    assert payload["bucket_edges"] == [[0.0, 2.0, 4.0, 6.0, 8.0, 10.0]]
+
+
+def test_empty(session):
+    payload = numpy_distribution(session, [Expense.user_id == uuid.uuid4()], 10)
+    assert payload["labels"] == [] and payload["buckets"] == []
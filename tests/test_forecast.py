@@ -0,0 +1,93 @@
+from datetime import date
+import numpy as np
+import pytest
+from analytics.forecast import HISTORY_MONTHS, fit, predict
+
+
+def inputs(monthly, daily=None):
+    monthly = np.array(monthly, dtype=float)
+    return {
+        "month": "2025-01-01",
+        "categories": [f"c{i}" for i in range(len(monthly))],
+        "monthly": monthly,
+        "daily": np.zeros((len(monthly), 31)) if daily is None else daily,
+    }
+
+
+def test_fit_linear_trend():
+    t = np.arange(HISTORY_MONTHS)
+    params = fit(inputs([100 + 10 * t, np.full(HISTORY_MONTHS, 50.0)]))
+    # t = 0 is the forecast month, one step after the last history month
+    assert params["intercept"] == pytest.approx([100 + 10 * HISTORY_MONTHS, 50])
+    assert params["slope"] == pytest.approx([10, 0])
+    assert params["seasonal"][0] == [float(v) for v in 100 + 10 * t[-12:]]
+
+
+def test_fit_ignores_months_before_first_spending():
+    monthly = np.zeros((1, HISTORY_MONTHS))
+    monthly[0, -3:] = [30, 60, 90]
+    params = fit(inputs(monthly))
+    assert params["intercept"] == pytest.approx([120])
+    assert params["slope"] == pytest.approx([30])
+    assert params["seasonal"][0] == [None] * 9 + [30.0, 60.0, 90.0]
+
+
+def test_fit_single_month_and_no_history():
+    monthly = np.zeros((1, HISTORY_MONTHS))
+    monthly[0, -1] = 70
+    params = fit(inputs(monthly))
+    assert params["intercept"] == [70] and params["slope"] == [0]
+
+    params = fit(inputs(np.zeros((1, HISTORY_MONTHS))))
+    assert params["intercept"] == [0] and params["seasonal"] == [[None] * 12]
+
+
+def test_fit_profile():
+    daily = np.zeros((2, 31))
+    daily[0, 0] = 300
+    daily[0, 14] = 100
+    params = fit(inputs(np.ones((2, HISTORY_MONTHS)), daily))
+    assert params["profile"][0][0] == 0.75
+    assert params["profile"][0][14:] == [1.0] * 17
+    # No daily history: spending is assumed even over the month
+    assert params["profile"][1] == pytest.approx(np.arange(1, 32) / 31, abs=1e-4)
+
+
+def params_for(intercept, slope=0.0, seasonal=None):
+    return {
+        "month": "2025-04-01",
+        "categories": ["Food"],
+        "intercept": [intercept],
+        "slope": [slope],
+        "seasonal": [seasonal or [None] * 12],
+        "profile": [list(np.arange(1, 32) / 31)],
+    }
+
+
+def test_predict_even_profile():
+    # April has 30 days; the even profile is rescaled to them
+    estimates = predict(params_for(300.0, 10.0), {"Food": 40.0}, date(2025, 4, 10))
+    month, rest = estimates["Food"]
+    assert month == pytest.approx(40 + (1 - 10 / 30) * 300)
+    # May to December: 310, 320, ..., 380
+    assert rest == pytest.approx(sum(300 + 10 * k for k in range(1, 9)))
+
+
+def test_predict_averages_seasonal():
+    seasonal = [100.0] + [None] * 11
+    month, _ = predict(params_for(300.0, seasonal=seasonal), {}, date(2025, 4, 30))[
+        "Food"
+    ]
+    assert month == pytest.approx(0)
+    month, _ = predict(params_for(300.0, seasonal=seasonal), {}, date(2025, 4, 15))[
+        "Food"
+    ]
+    assert month == pytest.approx(0.5 * (300 + 100) / 2)
+
+
+def test_predict_extrapolates_unknown_categories():
+    estimates = predict(params_for(0.0), {"Travel": 50.0}, date(2025, 4, 10))
+    assert estimates["Travel"] == (150.0, 0.0)
+    assert predict({"categories": []}, {"Gifts": 31.0}, date(2025, 1, 31)) == {
+        "Gifts": (31.0, 0.0)
+    }
@@ -0,0 +1,62 @@
+from datetime import date
+import pytest
+from analytics.views import MAX_COMPARE_PERIODS, parse_periods, parse_range
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("2024,2025", [(2024, 0), (2025, 0)]),
+        (" 2024-03 , 2025-03 ", [(2024, 3), (2025, 3)]),
+        ("1,9998", [(1, 0), (9998, 0)]),
+        ("2025-12,2025-01", [(2025, 12), (2025, 1)]),
+    ],
+)
+def test_parse_periods(raw, expected):
+    assert parse_periods(raw) == expected
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "2024",
+        "",
+        "2024,2025-03",
+        "2024,9999",
+        "0,2024",
+        "2024-13,2025-01",
+        "2024-00,2025-01",
+        "2024,abc",
+        "2024,,2025",
+        ",".join(str(2000 + i) for i in range(MAX_COMPARE_PERIODS + 1)),
+    ],
+)
+def test_parse_periods_rejects(raw):
+    with pytest.raises(ValueError):
+        parse_periods(raw)
+
+
+def test_parse_range():
+    assert parse_range("2024-02-01", "2024-02-29") == (
+        date(2024, 2, 1),
+        date(2024, 2, 29),
+    )
+    assert parse_range("2024-02-01", "2024-02-01") == (
+        date(2024, 2, 1),
+        date(2024, 2, 1),
+    )
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        ("2024-02-02", "2024-02-01"),
+        ("2024-02-30", "2024-03-01"),
+        (None, "2024-03-01"),
+        ("2024-01-01", None),
+        ("yesterday", "today"),
+    ],
+)
+def test_parse_range_rejects(start, end):
+    with pytest.raises(ValueError):
+        parse_range(start, end)
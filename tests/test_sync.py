@@ -0,0 +1,57 @@
+import base64
+import uuid
+from datetime import date, datetime, timedelta, timezone
+import pytest
+from api.serializers import decode_sync_cursor, encode_sync_cursor
+from expenses.sync import ARCHIVE_START, changes_since, first_sync_positions
+from models import ExpenseTombstone
+
+NOW = datetime(2025, 6, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "changed, deleted, archived",
+    [
+        ((NOW, uuid.uuid4()), (NOW - timedelta(days=1), uuid.uuid4()), None),
+        (None, None, None),
+        (None, (NOW, uuid.UUID(int=(1 << 128) - 1)), ARCHIVE_START),
+        ((NOW, uuid.uuid4()), None, (date(2020, 2, 29), uuid.uuid4())),
+    ],
+)
+def test_sync_cursor_round_trip(changed, deleted, archived):
+    cursor = encode_sync_cursor(changed, deleted, archived)
+    assert "=" not in cursor
+    assert decode_sync_cursor(cursor) == (changed, deleted, archived)
+
+
+@pytest.mark.parametrize(
+    "raw", [b"", b"a|b|c", b"x|y|z|w", b"|||||", b"\xff\xfe", b"1|2|3|4|5"]
+)
+def test_invalid_sync_cursor(raw):
+    cursor = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    with pytest.raises(ValueError):
+        decode_sync_cursor(cursor)
+
+
+def test_first_sync_skips_earlier_tombstones(session):
+    user_id = uuid.uuid4()
+    for minutes in (-10, -5, 0, 5):
+        session.add(
+            ExpenseTombstone(
+                expense_id=uuid.uuid4(),
+                user_id=user_id,
+                deleted_at=NOW + timedelta(minutes=minutes),
+            )
+        )
+    session.commit()
+
+    changed, deleted, archived = first_sync_positions(NOW)
+    assert changed is None and archived == ARCHIVE_START
+    _, tombstones, has_more = changes_since(
+        session, user_id, changed, deleted, NOW, 10
+    )
+    assert tombstones == [] and not has_more
+
+    # Without the first-sync position every tombstone up to ``until`` is sent
+    _, tombstones, _ = changes_since(session, user_id, None, None, NOW, 10)
+    assert len(tombstones) == 3
@@ -78,3 +78,27 @@ class AccountSettingsForm(FlaskForm):
     export_data = BooleanField("Include me in anonymized data analysis")
 
     submit = SubmitField("Save Settings")
+
+
+class CreateHouseholdForm(FlaskForm):
+    """Form for starting a household."""
+
+    name = StringField("Household Name", validators=[DataRequired(), Length(max=100)])
+
+    submit = SubmitField("Create Household")
+
+
+class JoinHouseholdForm(FlaskForm):
+    """Form for joining a household with its invite code."""
+
+    invite_code = StringField(
+        "Invite Code", validators=[DataRequired(), Length(max=32)]
+    )
+
+    submit = SubmitField("Join Household")
+
+
+class LeaveHouseholdForm(FlaskForm):
+    """Confirmation for leaving a household."""
+
+    submit = SubmitField("Leave Household")
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select
+from extensions import db
+from models import (
+    Expense,
+    ExpenseArchive,
+    ExpenseRollup,
+    ExpenseTombstone,
+    ExpenseVersion,
+    ForecastModel,
+    User,
+)
+from expenses.archive import remove_archive
+from analytics.household import remove_member
+from analytics.report import remove_chart_cache
+
+# Small per-user tables, removed in one statement each just before the user
+USER_OWNED = (
+    ExpenseRollup,
+    ExpenseVersion,
+    ExpenseArchive,
+    ExpenseTombstone,
+    ForecastModel,
+)
+
+
+def purgeable_users(grace_days, now=None):
+    """Ids of soft-deleted users whose grace period has ended, oldest first."""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=grace_days)
+    return (
+        db.session.execute(
+            select(User.id)
+            .where(User.deleted_at.isnot(None), User.deleted_at < cutoff)
+            .order_by(User.deleted_at)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def purge_user(user_id, batch_size=1000, pause=0.0):
+    """Hard-delete a user and everything they own, files on disk included.
+
+    Expenses go ``batch_size`` rows per transaction with ``pause`` seconds
+    between batches, so locks stay short and replicas can keep up. Returns
+    the number of expenses deleted.
+    """
+    deleted = 0
+    while True:
+        batch = select(Expense.id).where(Expense.user_id == user_id).limit(batch_size)
+        count = db.session.execute(
+            delete(Expense.__table__).where(Expense.__table__.c.id.in_(batch))
+        ).rowcount
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    remove_member(user_id)
+    for model in USER_OWNED:
+        db.session.execute(delete(model.__table__).where(model.user_id == user_id))
+    db.session.execute(delete(User.__table__).where(User.id == user_id))
+    db.session.commit()
+    remove_archive(user_id)
+    remove_chart_cache(user_id)
+    return deleted
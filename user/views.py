@@ -1,9 +1,18 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from extensions import db
-from models import User
-from .forms import ProfileForm, ChangePasswordForm, AccountSettingsForm
-from auth.views import hash_password_with_salt
+from models import Household, HouseholdMember, User
+from analytics.household import MAX_HOUSEHOLD_MEMBERS, remove_member
+from .forms import (
+    ProfileForm,
+    ChangePasswordForm,
+    AccountSettingsForm,
+    CreateHouseholdForm,
+    JoinHouseholdForm,
+    LeaveHouseholdForm,
+)
+from auth.hashing import HasherBusy, hash_password, verify_password
+from auth.views import BUSY_MESSAGE
 from datetime import datetime, timezone
 
 user_bp = Blueprint("user", __name__, url_prefix="/user")
@@ -55,20 +64,21 @@ def change_password():
     form = ChangePasswordForm()
 
     if form.validate_on_submit():
-        # Verify current password
-        current_password_hash = hash_password_with_salt(
-            form.current_password.data, current_user.salt
-        )
-
-        if current_password_hash != current_user.password_hash:
-            flash("Current password is incorrect.", "danger")
-            return render_template("user/change_password.html", form=form)
+        try:
+            # Verify current password
+            verified, _ = verify_password(current_user, form.current_password.data)
+            if not verified:
+                flash("Current password is incorrect.", "danger")
+                return render_template("user/change_password.html", form=form)
+
+            # Update to new password
+            new_password_hash = hash_password(form.new_password.data)
+        except HasherBusy:
+            flash(BUSY_MESSAGE, "warning")
+            return render_template("user/change_password.html", form=form), 503
 
-        # Update to new password
-        new_password_hash = hash_password_with_salt(
-            form.new_password.data, current_user.salt
-        )
         current_user.password_hash = new_password_hash
+        current_user.salt = ""
         current_user.updated_at = datetime.now(timezone.utc)
 
         try:
@@ -98,6 +108,117 @@ def account_settings():
     return render_template("user/account_settings.html", form=form)
 
 
+@user_bp.route("/settings/household")
+@login_required
+def household():
+    """The user's household and its invite code, or forms to create or join one."""
+    membership = db.session.get(HouseholdMember, current_user.id)
+    household = members = None
+    if membership is not None:
+        household = db.session.get(Household, membership.household_id)
+        members = (
+            User.query.join(HouseholdMember, HouseholdMember.user_id == User.id)
+            .filter(HouseholdMember.household_id == household.id)
+            .order_by(HouseholdMember.joined_at)
+            .all()
+        )
+
+    return render_template(
+        "user/household.html",
+        household=household,
+        members=members,
+        create_form=CreateHouseholdForm(),
+        join_form=JoinHouseholdForm(),
+        leave_form=LeaveHouseholdForm(),
+    )
+
+
+@user_bp.route("/settings/household/create", methods=["POST"])
+@login_required
+def create_household():
+    """Start a household with the current user as its first member."""
+    form = CreateHouseholdForm()
+
+    if not form.validate_on_submit():
+        flash("Please enter a name for your household.", "danger")
+    elif db.session.get(HouseholdMember, current_user.id) is not None:
+        flash("You are already in a household.", "warning")
+    else:
+        household = Household(name=form.name.data.strip())
+        db.session.add(household)
+        try:
+            db.session.flush()
+            db.session.add(
+                HouseholdMember(user_id=current_user.id, household_id=household.id)
+            )
+            db.session.commit()
+            flash("Household created! Share the invite code to add members.", "success")
+        except Exception as e:
+            db.session.rollback()
+            flash("An error occurred while creating the household.", "danger")
+            print(f"Household creation error: {e}")
+
+    return redirect(url_for("user.household"))
+
+
+@user_bp.route("/settings/household/join", methods=["POST"])
+@login_required
+def join_household():
+    """Join a household with its invite code."""
+    form = JoinHouseholdForm()
+
+    household = None
+    if form.validate_on_submit():
+        household = Household.query.filter_by(
+            invite_code=form.invite_code.data.strip()
+        ).first()
+
+    if household is None:
+        flash("That invite code is not valid.", "danger")
+    elif db.session.get(HouseholdMember, current_user.id) is not None:
+        flash("You are already in a household.", "warning")
+    elif (
+        HouseholdMember.query.filter_by(household_id=household.id).count()
+        >= MAX_HOUSEHOLD_MEMBERS
+    ):
+        flash(
+            f"A household can have at most {MAX_HOUSEHOLD_MEMBERS} members.",
+            "warning",
+        )
+    else:
+        db.session.add(
+            HouseholdMember(user_id=current_user.id, household_id=household.id)
+        )
+        try:
+            db.session.commit()
+            flash(f"You joined {household.name}!", "success")
+        except Exception as e:
+            db.session.rollback()
+            flash("An error occurred while joining the household.", "danger")
+            print(f"Household join error: {e}")
+
+    return redirect(url_for("user.household"))
+
+
+@user_bp.route("/settings/household/leave", methods=["POST"])
+@login_required
+def leave_household():
+    """Leave the current household; the last member to leave deletes it."""
+    form = LeaveHouseholdForm()
+
+    if form.validate_on_submit():
+        try:
+            remove_member(current_user.id)
+            db.session.commit()
+            flash("You left the household.", "info")
+        except Exception as e:
+            db.session.rollback()
+            flash("An error occurred while leaving the household.", "danger")
+            print(f"Household leave error: {e}")
+
+    return redirect(url_for("user.household"))
+
+
 @user_bp.route("/settings/delete-account", methods=["GET", "POST"])
 @login_required
 def delete_account():